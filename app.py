@@ -1,12 +1,38 @@
-from flask import Flask
-from flask_cors import CORS
+import importlib
+import os
+import time
 
+# Soğuk başlangıç raporu için import süresi buradan ölçülür
+_import_started = time.perf_counter()
+
+from dotenv import load_dotenv
+
+# .env tek yerde, controller'lar import edilmeden önce yüklenir
+load_dotenv()
+
+from services.startup import STARTUP_WARMUP, StartupReport
+
+startup_report = StartupReport(started_at=_import_started)
+
+with startup_report.phase("flask"):
+    from flask import Flask, Response, g, jsonify, request
+    from flask_cors import CORS
+
+with startup_report.phase("services"):
+    from services.deadlines import start_request_deadline
+    from services.metrics import REQUEST_LATENCY, Gauge, log_event, register, render_metrics
+    from services.job_queue import job_queue
+    from services.storage import storage
+    from services.derivatives import cache as derivative_cache
+    from services.user_images_writer import user_images_writer
+    from supabase_client.supabase_client import get_pool_stats, init_supabase_client
 
 #controller importları
-from controllers.session_controller import session_bp
-from controllers.changeHair_Controller import model_bp
-from controllers.userPremiumAndToken_Controller import premiumAndToken_bp
-from controllers.scanFace import scan_bp
+with startup_report.phase("controllers"):
+    from controllers.session_controller import session_bp
+    from controllers.changeHair_Controller import model_bp
+    from controllers.userPremiumAndToken_Controller import premiumAndToken_bp
+    from controllers.scanFace import scan_bp, get_gemini_client
 
 
 
@@ -14,8 +40,50 @@ from controllers.scanFace import scan_bp
 app = Flask(__name__)
 CORS(app)
 
+# Route bazlı süre sınırları (saniye); gunicorn timeout'u bunların üstünde olmalı
+app.config['ROUTE_TIMEOUTS'] = {
+    "default": int(os.getenv("ROUTE_TIMEOUT_DEFAULT", "30")),
+    # Süre dolarsa üretim arka planda sürer, istemciye job_id döner
+    "model.change_hair": int(os.getenv("ROUTE_TIMEOUT_CHANGE_HAIR", "90")),
+    # Süresi dolan varyantlar "timeout" olarak bildirilir, arka planda tamamlanır
+    "model.change_hair_batch": int(os.getenv("ROUTE_TIMEOUT_CHANGE_HAIR_BATCH", "150")),
+    "scan.analyze_face": int(os.getenv("ROUTE_TIMEOUT_ANALYZE_FACE", "45")),
+}
+app.before_request(start_request_deadline)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    if "request_start" in g:
+        duration = time.perf_counter() - g.request_start
+        # Label olarak ham path değil endpoint adı kullanılır (kardinalite sınırlı kalsın)
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_LATENCY.observe(duration, request.method, endpoint, response.status_code)
+        log_event(
+            "request",
+            method=request.method,
+            endpoint=endpoint,
+            status=response.status_code,
+            duration_ms=round(duration * 1000, 2)
+        )
+    return response
 
 
+register(Gauge("job_queue_depth", "Kuyrukta bekleyen ya da çalışan üretim işi", job_queue.depth))
+for _stat in ("hits", "misses", "retries"):
+    register(Gauge(f"supabase_pool_{_stat}", f"Supabase HTTP havuzu {_stat} sayacı", lambda stat=_stat: get_pool_stats()[stat]))
+register(Gauge("user_images_write_buffer_rows", "Supabase'e henüz yazılmamış user_images satırı", user_images_writer.pending))
+if hasattr(storage, "cache_stats"):
+    register(Gauge("storage_cache_bytes", "Storage disk önbelleğindeki toplam byte", lambda: storage.cache_stats()["bytes"]))
+    register(Gauge("storage_cache_files", "Storage disk önbelleğindeki dosya sayısı", lambda: storage.cache_stats()["files"]))
+register(Gauge("derivative_cache_bytes", "Küçültülmüş resim önbelleğindeki toplam byte", lambda: derivative_cache.stats()["bytes"]))
+register(Gauge("derivative_cache_files", "Küçültülmüş resim önbelleğindeki dosya sayısı", lambda: derivative_cache.stats()["files"]))
+
 
 
 # Controller'lar
@@ -25,9 +93,40 @@ app.register_blueprint(premiumAndToken_bp, url_prefix='/check')
 app.register_blueprint(scan_bp, url_prefix='/scan')
 
 
+startup_report.finish_import()
+
+
+def start_warmup():
+    """Ağır SDK'ları ve client'ları ilk istekten önce yükler (gunicorn post_fork'ta çağrılır)"""
+    startup_report.start_warmup({
+        "supabase": init_supabase_client,
+        "gemini": get_gemini_client,
+        "replicate": lambda: importlib.import_module("replicate"),
+        "image_pipeline": lambda: importlib.import_module("services.image_pipeline").warm_up(),
+    })
+
+
 @app.route('/')
 def home():
     return {"message": "Merhaba, API'ye hoşgeldin!"}
 
+
+@app.route('/ready')
+def ready():
+    # Isınma tetiklenmemişse (örn. gunicorn dışında) ilk probe başlatır
+    if STARTUP_WARMUP:
+        start_warmup()
+    report = startup_report.as_dict()
+    if not startup_report.ready():
+        return jsonify({"ready": False, "startup": report}), 503
+    return jsonify({"ready": True, "startup": report}), 200
+
+
+@app.route('/metrics')
+def metrics():
+    # Her gunicorn worker'ı kendi sayaçlarını raporlar
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == '__main__':
+    # Sadece geliştirme için; production: gunicorn -c gunicorn.conf.py app:app
     app.run(host='0.0.0.0', port=5001, debug=True)
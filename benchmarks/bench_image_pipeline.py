@@ -0,0 +1,59 @@
+"""Ön işleme hattının kazandırdığı byte'ları ve resim başına süreyi ölçer.
+
+Kullanım:
+    python -m benchmarks.bench_image_pipeline [resim_yolu ...]
+
+Yol verilmezse uploads/ altındaki resimler ve sentetik bir telefon fotoğrafı kullanılır.
+"""
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from services.image_pipeline import IMAGE_MAX_EDGE, SCAN_MAX_EDGE, normalize_image
+
+REPEAT = 5
+
+
+def _synthetic_phone_photo():
+    # 12MP, gürültülü bir JPEG: gerçek telefon fotoğrafı boyutlarına yakın
+    image = Image.effect_noise((4032, 3024), 64).convert("RGB")
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=95)
+    return "synthetic-12mp.jpg", output.getvalue()
+
+
+def _inputs(paths):
+    if paths:
+        return [(Path(p).name, Path(p).read_bytes()) for p in paths]
+
+    inputs = [(p.name, p.read_bytes()) for p in sorted(Path("uploads").glob("*")) if p.suffix in (".png", ".jpg", ".jpeg", ".webp")]
+    inputs.append(_synthetic_phone_photo())
+    return inputs
+
+
+def _measure(image_bytes, max_edge):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        output, _ = normalize_image(image_bytes, max_edge=max_edge)
+    return len(output), (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main(paths):
+    total_in = total_out = 0
+    print(f"{'resim':<48} {'girdi':>10} {'upload':>10} {'ms':>8} {'scan':>10} {'ms':>8}")
+    for name, image_bytes in _inputs(paths):
+        upload_size, upload_ms = _measure(image_bytes, IMAGE_MAX_EDGE)
+        scan_size, scan_ms = _measure(image_bytes, SCAN_MAX_EDGE)
+        total_in += len(image_bytes)
+        total_out += upload_size
+        print(f"{name[:48]:<48} {len(image_bytes):>10} {upload_size:>10} {upload_ms:>8.1f} {scan_size:>10} {scan_ms:>8.1f}")
+
+    if total_in:
+        print(f"\nToplam: {total_in} -> {total_out} byte ({100 * (1 - total_out / total_in):.1f}% tasarruf)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,65 @@
+"""Soğuk başlangıç süresini ve en pahalı import'ları ölçer.
+
+Kullanım:
+    python -m benchmarks.bench_startup [--repeat 5] [--top 20]
+
+Her tekrar temiz bir python process'inde `import app` yapar (worker/container
+ilk açılışı gibi). -X importtime çıktısından kümülatif süreye göre en yavaş
+modüller listelenir; app.py'nin kendi aşama raporu da yazdırılır.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Çocuk process'te app import edilir, rapor JSON olarak stdout'a yazılır
+_CHILD = "import json, app; print(json.dumps(app.startup_report.as_dict()))"
+
+
+def _run_child(importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", _CHILD]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return report, result.stderr
+
+
+def _slowest_imports(importtime_output, top):
+    """'import time: self [us] | cumulative | imported package' satırlarından en yavaş üst seviye modüller"""
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        # Girinti seviyesi: app ve doğrudan import ettikleri (iç içe olanlar üsttekinin kümülatifinde)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cumulative_us), int(self_us), depth, name.strip()))
+    top_level = [row for row in rows if row[2] <= 1]
+    return sorted(top_level, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    reports = [_run_child()[0] for _ in range(args.repeat)]
+    import_seconds = [report["import_seconds"] for report in reports]
+    print(f"app import: medyan {statistics.median(import_seconds) * 1000:.1f} ms, "
+          f"min {min(import_seconds) * 1000:.1f} ms ({args.repeat} tekrar)")
+    for phase in reports[0]["phases"]:
+        print(f"  {phase:<12} {statistics.median(r['phases'][phase] for r in reports) * 1000:>8.1f} ms")
+    print(f"Import sırasında yüklenen ağır paketler: {', '.join(reports[0]['heavy_modules']) or 'yok'}")
+
+    _, importtime_output = _run_child(importtime=True)
+    print(f"\n{'kümülatif ms':>12} {'kendi ms':>10}  modül")
+    for cumulative_us, self_us, _, name in _slowest_imports(importtime_output, args.top):
+        print(f"{cumulative_us / 1000:>12.1f} {self_us / 1000:>10.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""Benchmark için Supabase, Replicate, çıktı resim sunucusu ve Gemini'nin yerel taklitleri.
+
+Her upstream ayrı bir portta, ayarlanabilir gecikme ve hata oranıyla çalışır.
+Tek başına çalıştırıldığında API'yi bu taklitlere yönlendiren env değişkenlerini yazar:
+
+    python -m benchmarks.fake_upstreams --latency replicate=2000 --error-rate gemini=0.05 --slow-rate gemini=0.1
+"""
+import argparse
+import email.parser
+import email.policy
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+# Milisaniye; gerçek servislerin kabaca tipik yanıt süreleri
+DEFAULT_LATENCY_MS = {"supabase": 15, "replicate": 2000, "images": 30, "gemini": 1500}
+# Gecikmeye eklenen rastgele sapma (oran)
+LATENCY_JITTER = 0.2
+# --slow-rate ile seçilen isteklere eklenen kuyruk gecikmesi (ms)
+DEFAULT_SLOW_MS = 10000
+
+FAKE_ANALYSIS = {
+    "gender": "male",
+    "face_shape": "oval",
+    "face_analysis_reason": "Benchmark yanıtı",
+    "recommended_hairstyles": ["Textured Crop", "Pompadour", "Quiff", "Buzz Cut", "Side Part"],
+}
+
+
+def fake_jpeg(size=(1024, 1024)):
+    image = Image.effect_noise(size, 48).convert("RGB")
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+class UpstreamConfig:
+    """Upstream başına gecikme/hata ayarı ve istek sayaçları; çalışırken değiştirilebilir"""
+
+    def __init__(self, name, latency_ms, error_rate=0.0, slow_rate=0.0, slow_ms=DEFAULT_SLOW_MS):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        # slow_rate olasılıkla istek slow_ms daha geç döner (kuyruk gecikmesi / takılan istek)
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        jitter = self.latency_ms * LATENCY_JITTER
+        latency_ms = max(0.0, random.uniform(self.latency_ms - jitter, self.latency_ms + jitter))
+        if random.random() < self.slow_rate:
+            latency_ms += self.slow_ms
+        time.sleep(latency_ms / 1000)
+
+    def should_fail(self):
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.requests += 1
+            self.errors += failed
+        return failed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive: API tarafındaki bağlantı havuzları gerçekçi davransın
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.raw_body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(self.raw_body) if self.raw_body else None
+        except ValueError:
+            return None
+
+    def _send(self, status, body=b"", content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _handle(self):
+        body = self._body()
+        self.config.delay()
+        if self.config.should_fail():
+            self._send(503, {"message": "fake upstream error"})
+            return
+        self.respond(urlparse(self.path), body)
+
+    do_GET = do_POST = do_PATCH = do_HEAD = do_DELETE = _handle
+
+    def respond(self, url, body):
+        raise NotImplementedError
+
+
+def _uploaded_file(content_type, raw_body):
+    """Yükleme gövdesinden (byte'lar, content-type); multipart ise dosya parçası alınır"""
+    if not content_type.startswith("multipart/"):
+        return raw_body, content_type or "application/octet-stream"
+
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + raw_body
+    )
+    for part in message.iter_parts():
+        if part.get_filename() is not None:
+            return part.get_payload(decode=True), part.get_content_type()
+    return raw_body, "application/octet-stream"
+
+
+class SupabaseHandler(_Handler):
+    """PostgREST: USER / user_images tabloları ve kredi RPC'leri; Storage: bellekte tutulan bucket'lar"""
+
+    # (bucket, ad) -> (byte'lar, content-type, updated_at); sunucu sınıfı başına ayrı
+    objects = None
+    objects_lock = None
+
+    def respond(self, url, body):
+        if url.path.startswith("/storage/v1/"):
+            self.respond_storage(url.path.removeprefix("/storage/v1/"), body)
+            return
+
+        table = url.path.removeprefix("/rest/v1/")
+
+        if table.startswith("rpc/"):
+            self._send(200, {"status": "ok", "credits": 1000})
+            return
+
+        if self.command == "POST":
+            rows = body if isinstance(body, list) else [body or {}]
+            self._send(201, [dict(row, id=random.randint(1, 10**9)) for row in rows])
+            return
+
+        if table == "USER":
+            device_id = parse_qs(url.query).get("device_id", ["eq."])[0].removeprefix("eq.")
+            self._send(200, [{"device_id": device_id, "credits": 1000, "is_premium": False}])
+            return
+
+        self._send(200, [])
+
+    def respond_storage(self, path, body):
+        list_match = re.match(r"^object/list/([^/]+)$", path)
+        if list_match:
+            self._list_objects(list_match.group(1), body or {})
+            return
+
+        match = re.match(r"^object/([^/]+)/?(.*)$", path)
+        if not match:
+            self._send(404, {"statusCode": "404", "error": "not_found", "message": "not found"})
+            return
+        bucket, name = match.group(1), match.group(2)
+
+        if self.command == "DELETE":
+            with self.objects_lock:
+                removed = [self.objects.pop((bucket, n), None) and {"name": n} for n in (body or {}).get("prefixes", [])]
+            self._send(200, [item for item in removed if item])
+            return
+
+        if self.command == "POST":
+            data, content_type = _uploaded_file(self.headers.get("Content-Type", ""), self.raw_body)
+            with self.objects_lock:
+                self.objects[(bucket, name)] = (data, content_type, time.time())
+            self._send(200, {"Key": f"{bucket}/{name}"})
+            return
+
+        with self.objects_lock:
+            stored = self.objects.get((bucket, name))
+        if stored is None:
+            self._send(404, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+            return
+        self._send(200, stored[0], content_type=stored[1])
+
+    def _list_objects(self, bucket, options):
+        with self.objects_lock:
+            items = [(name, stored[2]) for (b, name), stored in self.objects.items() if b == bucket]
+        items.sort(key=lambda item: item[1])
+        offset = int(options.get("offset", 0))
+        limit = int(options.get("limit", 100))
+        self._send(200, [
+            {"name": name, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(updated_at))}
+            for name, updated_at in items[offset:offset + limit]
+        ])
+
+
+class ReplicateHandler(_Handler):
+    """Prefer: wait ile tamamlanmış dönen tahmin API'si; çıktı resim sunucusunu gösterir"""
+
+    image_base_url = None
+
+    def respond(self, url, body):
+        match = re.match(r"^/v1/models/([^/]+)/([^/]+)/predictions$", url.path)
+        if self.command != "POST" or not match:
+            self._send(404, {"detail": "not found"})
+            return
+
+        prediction_id = uuid.uuid4().hex
+        self._send(201, {
+            "id": prediction_id,
+            "model": f"{match.group(1)}/{match.group(2)}",
+            "version": "bench",
+            "status": "succeeded",
+            "input": (body or {}).get("input"),
+            "output": f"{self.image_base_url}/outputs/{prediction_id}.jpg",
+            "logs": "",
+            "error": None,
+            "metrics": {},
+            "created_at": None,
+            "started_at": None,
+            "completed_at": None,
+            "urls": {},
+        })
+
+
+class ImageHandler(_Handler):
+    """Replicate çıktı dosyalarının indirildiği host"""
+
+    image_bytes = b""
+
+    def respond(self, url, body):
+        self._send(200, self.image_bytes, content_type="image/jpeg")
+
+
+class GeminiHandler(_Handler):
+    """generateContent: sabit yüz analizi döner (structured output istenmediyse markdown blok içinde);
+    streamGenerateContent: aynı metni SSE parçaları halinde, aralarında bekleyerek gönderir"""
+
+    # Akışta parça sayısı ve parçalar arası bekleme (ms)
+    stream_chunks = 4
+    stream_interval_ms = 150
+
+    def respond(self, url, body):
+        config = (body or {}).get("generationConfig") or {}
+        text = json.dumps(FAKE_ANALYSIS)
+        if config.get("responseMimeType") != "application/json":
+            text = "```json\n" + text + "\n```"
+
+        if url.path.endswith(":generateContent"):
+            self._send(200, self._response(text))
+        elif url.path.endswith(":streamGenerateContent"):
+            self._stream(text)
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def _response(self, text, finished=True):
+        response = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+        if finished:
+            response["candidates"][0]["finishReason"] = "STOP"
+            response["usageMetadata"] = {"promptTokenCount": 1, "candidatesTokenCount": 1, "totalTokenCount": 2}
+        return response
+
+    def _stream(self, text):
+        size = -(-len(text) // self.stream_chunks)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        events = [
+            f"data: {json.dumps(self._response(piece, finished=index == len(pieces) - 1))}\r\n\r\n".encode("utf-8")
+            for index, piece in enumerate(pieces)
+        ]
+        # Uzunluk baştan bilinir; parçalar yine de aralıklarla yazılır (istemci ilk alanları erken görür)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(sum(len(event) for event in events)))
+        self.end_headers()
+        for index, event in enumerate(events):
+            if index:
+                time.sleep(self.stream_interval_ms / 1000)
+            self.wfile.write(event)
+            self.wfile.flush()
+
+
+HANDLERS = {
+    "supabase": SupabaseHandler,
+    "replicate": ReplicateHandler,
+    "images": ImageHandler,
+    "gemini": GeminiHandler,
+}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Yüksek eşzamanlılıkta bağlantılar reddedilmesin
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Süre sınırı/hedge ile bırakılan istekler beklenen durum; traceback basılmaz
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class FakeUpstreams:
+    """Dört taklit sunucuyu boş portlarda arka plan thread'lerinde başlatır"""
+
+    def __init__(self, latency_ms=None, error_rate=None, slow_rate=None, slow_ms=DEFAULT_SLOW_MS, host="127.0.0.1"):
+        latency_ms = dict(DEFAULT_LATENCY_MS, **(latency_ms or {}))
+        error_rate = error_rate or {}
+        slow_rate = slow_rate or {}
+        self.host = host
+        self.configs = {
+            name: UpstreamConfig(name, latency_ms[name], error_rate.get(name, 0.0), slow_rate.get(name, 0.0), slow_ms)
+            for name in HANDLERS
+        }
+        self._servers = {}
+
+    def url(self, name):
+        return f"http://{self.host}:{self._servers[name].server_address[1]}"
+
+    def start(self):
+        for name, handler in HANDLERS.items():
+            attrs = {"config": self.configs[name]}
+            if name == "images":
+                attrs["image_bytes"] = fake_jpeg()
+            if name == "supabase":
+                attrs["objects"] = {}
+                attrs["objects_lock"] = threading.Lock()
+            server = _Server((self.host, 0), type(handler.__name__, (handler,), attrs))
+            self._servers[name] = server
+
+        # Replicate çıktıları resim sunucusunu göstermeli
+        self._servers["replicate"].RequestHandlerClass.image_base_url = self.url("images")
+
+        for name, server in self._servers.items():
+            threading.Thread(target=server.serve_forever, name=f"fake-{name}", daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def env(self):
+        """API'yi taklitlere yönlendiren env değişkenleri"""
+        return {
+            "SUPABASE_URL": self.url("supabase"),
+            "SUPABASE_KEY": "bench",
+            # Storage bucket'ı da Supabase taklidinde, yerel disk önbelleği önünde
+            "STORAGE_BACKEND": "supabase",
+            "IMAGE_URL_SIGNING_KEYS": "bench:bench-secret",
+            "REPLICATE_BASE_URL": self.url("replicate"),
+            "REPLICATE_API_TOKEN": "bench",
+            "GOOGLE_GEMINI_BASE_URL": self.url("gemini"),
+            "GEMINI_API_KEY": "bench",
+        }
+
+    def stats(self):
+        return {name: {"requests": c.requests, "errors": c.errors} for name, c in self.configs.items()}
+
+
+def parse_upstream_values(pairs, cast=float):
+    """['replicate=2000', 'gemini=500'] -> {'replicate': 2000.0, 'gemini': 500.0}"""
+    values = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition("=")
+        if name not in HANDLERS or not value:
+            raise argparse.ArgumentTypeError(f"Geçersiz upstream ayarı: {pair} (upstream'ler: {', '.join(HANDLERS)})")
+        values[name] = cast(value)
+    return values
+
+
+def add_upstream_arguments(parser):
+    parser.add_argument("--latency", action="append", metavar="UPSTREAM=MS",
+                        help=f"Upstream gecikmesi, ms (varsayılan: {DEFAULT_LATENCY_MS})")
+    parser.add_argument("--error-rate", action="append", metavar="UPSTREAM=ORAN",
+                        help="Upstream'in 503 dönme olasılığı, 0-1 arası")
+    parser.add_argument("--slow-rate", action="append", metavar="UPSTREAM=ORAN",
+                        help="İsteğin --slow-ms kadar geç dönme olasılığı, 0-1 arası")
+    parser.add_argument("--slow-ms", type=float, default=DEFAULT_SLOW_MS, help="Yavaş isteklere eklenen gecikme, ms")
+
+
+def build_upstreams(args):
+    """add_upstream_arguments ile okunan ayarlardan taklitleri kurar (başlatmaz)"""
+    return FakeUpstreams(
+        parse_upstream_values(args.latency), parse_upstream_values(args.error_rate),
+        parse_upstream_values(args.slow_rate), args.slow_ms
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_upstream_arguments(parser)
+    args = parser.parse_args()
+
+    upstreams = build_upstreams(args).start()
+    for key, value in upstreams.env().items():
+        print(f"export {key}={value}")
+    print("# Durdurmak için Ctrl+C", flush=True)
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        upstreams.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Upstream katmanını (süre sınırı, tekrar deneme, devre kesici, hedge) yerel taklitlere arıza vererek doğrular.
+
+Kullanım:
+    python -m benchmarks.fault_injection
+    python -m benchmarks.fault_injection --scenario gemini_outage --scenario gemini_recovery
+    python -m benchmarks.fault_injection --sync        # ASYNC_UPSTREAMS=0 yolu (hedge senaryosu atlanır)
+
+Taklitler ve uygulama aynı process'te başlatılır; arızalar taklitlerin ayarları çalışırken
+değiştirilerek verilir. Senaryolar süreleri kısaltılmış politikalarla çalışır (FAULT_ENV,
+ortamda verilen değerler önceliklidir). Beklenen davranış tutmazsa çıkış kodu 1.
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+from benchmarks.fake_upstreams import DEFAULT_LATENCY_MS, FakeUpstreams
+from benchmarks.load_test import LoadClient, _start_local_app, run_scenario
+
+# Senaryolar saniyeler içinde bitsin diye kısaltılmış süreler
+FAULT_ENV = {
+    "GEMINI_ATTEMPT_TIMEOUT": "5",
+    "GEMINI_HEDGE_DELAY": "0.5",
+    "GEMINI_BREAKER_THRESHOLD": "5",
+    "GEMINI_BREAKER_RESET": "3",
+    "REPLICATE_TIMEOUT": "3",
+    "DOWNLOAD_RETRIES": "2",
+}
+# Yavaş istek gecikmesi; hedge'li p95 bunun yarısının altında kalmalı
+TAIL_SLOW_MS = 4000
+
+
+class ScenarioFailed(AssertionError):
+    pass
+
+
+def expect(condition, message):
+    if not condition:
+        raise ScenarioFailed(message)
+
+
+def _reset(upstreams):
+    """Taklitleri varsayılan gecikmeye, devre kesicileri kapalı duruma döndürür"""
+    from services.upstream import breakers
+
+    for name, config in upstreams.configs.items():
+        config.latency_ms = DEFAULT_LATENCY_MS[name]
+        config.error_rate = 0.0
+        config.slow_rate = 0.0
+    for breaker in breakers.values():
+        breaker.record_success()
+
+
+def gemini_outage(client, upstreams, counter):
+    """Gemini hep 503 dönerken devre açılır; sonraki istekler Gemini'ye gitmeden hızlıca 503 + Retry-After alır"""
+    from services.upstream import breakers
+
+    gemini = upstreams.configs["gemini"]
+    gemini.latency_ms = 50
+    gemini.error_rate = 1.0
+    for _ in range(3):
+        client.analyze_face(next(counter))
+    expect(breakers["gemini"].state == "open", f"devre açılmadı (durum: {breakers['gemini'].state})")
+
+    requests_before = gemini.requests
+    for _ in range(5):
+        start = time.perf_counter()
+        response = client.analyze_face(next(counter))
+        duration_ms = (time.perf_counter() - start) * 1000
+        expect(response.status_code == 503, f"açık devrede durum {response.status_code}, beklenen 503")
+        expect("Retry-After" in response.headers, "Retry-After başlığı yok")
+        expect(duration_ms < 200, f"açık devrede istek {duration_ms:.0f} ms sürdü")
+    expect(gemini.requests == requests_before, f"açık devrede Gemini'ye {gemini.requests - requests_before} istek gitti")
+
+
+def gemini_recovery(client, upstreams, counter):
+    """Gemini düzelince reset süresinden sonra tek deneme isteği geçer ve devre kapanır"""
+    from services.upstream import breakers
+
+    breaker = breakers["gemini"]
+    gemini = upstreams.configs["gemini"]
+    gemini.latency_ms = 50
+    gemini.error_rate = 1.0
+    while breaker.state != "open":
+        client.analyze_face(next(counter))
+
+    gemini.error_rate = 0.0
+    time.sleep(breaker.reset_timeout + 0.5)
+    response = client.analyze_face(next(counter))
+    expect(response.status_code == 200, f"reset sonrası durum {response.status_code}, beklenen 200")
+    expect(breaker.state == "closed", f"başarılı denemeden sonra devre {breaker.state}")
+
+
+def gemini_flaky(client, upstreams, counter):
+    """%30 geçici hata tekrar denemelerle kullanıcıya neredeyse hiç yansımaz"""
+    upstreams.configs["gemini"].latency_ms = 100
+    upstreams.configs["gemini"].error_rate = 0.3
+    result = run_scenario(_Numbered(client, counter), "analyze_face", 40, 4)
+    expect(result["error_rate"] <= 0.1, f"hata oranı {result['error_rate']} ({result['statuses']})")
+    return result
+
+
+def gemini_tail(client, upstreams, counter):
+    """İsteklerin %10'u takılırken hedge sayesinde p95 takılma süresinin çok altında kalır"""
+    from services.async_runtime import ASYNC_UPSTREAMS
+
+    if not ASYNC_UPSTREAMS:
+        return "atlandı: hedge sadece ASYNC_UPSTREAMS=1 yolunda"
+    upstreams.configs["gemini"].latency_ms = 200
+    upstreams.configs["gemini"].slow_rate = 0.1
+    upstreams.configs["gemini"].slow_ms = TAIL_SLOW_MS
+    result = run_scenario(_Numbered(client, counter), "analyze_face", 40, 4)
+    expect(result["error_rate"] == 0, f"hata oranı {result['error_rate']} ({result['statuses']})")
+    expect(result["p95_ms"] < TAIL_SLOW_MS / 2, f"p95 {result['p95_ms']} ms, hedge takılan istekleri kesmedi")
+    return result
+
+
+def replicate_timeout(client, upstreams, counter):
+    """Replicate süre sınırını aşınca istek route süresini beklemeden 504 döner"""
+    from services.upstream import UPSTREAM_POLICIES
+
+    timeout = UPSTREAM_POLICIES["replicate"].timeout
+    upstreams.configs["replicate"].latency_ms = (timeout + 3) * 1000
+    start = time.perf_counter()
+    response = client.change_hair(next(counter))
+    duration = time.perf_counter() - start
+    expect(response.status_code == 504, f"durum {response.status_code}, beklenen 504")
+    expect(duration < timeout + 2, f"istek {duration:.1f} sn sürdü (süre sınırı {timeout} sn)")
+
+
+def download_flaky(client, upstreams, counter):
+    """Çıktı indirmesindeki geçici 503'ler tekrar denenir, üretim başarılı biter"""
+    upstreams.configs["replicate"].latency_ms = 100
+    upstreams.configs["images"].error_rate = 0.3
+    result = run_scenario(_Numbered(client, counter), "change_hair", 20, 4)
+    expect(result["error_rate"] <= 0.1, f"hata oranı {result['error_rate']} ({result['statuses']})")
+    return result
+
+
+SCENARIOS = {
+    "gemini_outage": gemini_outage,
+    "gemini_recovery": gemini_recovery,
+    "gemini_flaky": gemini_flaky,
+    "gemini_tail": gemini_tail,
+    "replicate_timeout": replicate_timeout,
+    "download_flaky": download_flaky,
+}
+
+
+class _Numbered:
+    """run_scenario'nun verdiği sıra numarası yerine süreç boyunca artan numara kullanır
+    (her istek ayrı cihaz: rate limit ve önbellekler senaryoları etkilemez)"""
+
+    def __init__(self, client, counter):
+        self._client = client
+        self._counter = counter
+
+    def __getattr__(self, scenario):
+        send = getattr(self._client, scenario)
+        return lambda i: send(next(self._counter))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Varsayılan: hepsi")
+    parser.add_argument("--sync", action="store_true", help="Senkron upstream yolunu dene (ASYNC_UPSTREAMS=0)")
+    args = parser.parse_args()
+
+    for key, value in FAULT_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ["ASYNC_UPSTREAMS"] = "0" if args.sync else "1"
+
+    upstreams = FakeUpstreams().start()
+    server, base_url = _start_local_app(upstreams)
+    # Cihaz sayısı istek sayısından büyük: her istek ayrı cihazdan gelir
+    client = LoadClient(base_url, devices=10**9, reuse_payloads=False)
+    # itertools.count thread'ler arasında paylaşılabilir
+    counter = itertools.count(1)
+
+    failures = 0
+    try:
+        for name in args.scenario or SCENARIOS:
+            _reset(upstreams)
+            start = time.perf_counter()
+            try:
+                detail = SCENARIOS[name](client, upstreams, counter)
+                outcome = "OK"
+            except ScenarioFailed as e:
+                failures += 1
+                outcome, detail = "BAŞARISIZ", str(e)
+            print(f"{name:<18} {outcome:<10} {time.perf_counter() - start:>6.1f} sn  {detail or ''}", flush=True)
+    finally:
+        server.shutdown()
+        upstreams.stop()
+
+    print(f"\nupstream istekleri: {upstreams.stats()}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
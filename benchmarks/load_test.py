@@ -0,0 +1,262 @@
+"""API'yi yerel upstream taklitlerine karşı hedef eşzamanlılıkta yükler; throughput ve p50/p95/p99 raporlar.
+
+Kullanım:
+    python -m benchmarks.load_test --concurrency 32 --requests 500
+    python -m benchmarks.load_test --scenario change_hair --latency replicate=4000 --error-rate replicate=0.02
+    python -m benchmarks.load_test --output sonuc.json
+    python -m benchmarks.load_test --baseline sonuc.json --max-regression 0.2
+
+--url verilmezse taklitler ve uygulama aynı process'te (werkzeug, threaded) başlatılır.
+Gunicorn'u ölçmek için taklitleri ayrı çalıştırıp yazdığı env ile gunicorn'u başlatın:
+    python -m benchmarks.fake_upstreams          # export satırlarını gunicorn shell'ine verin
+    python -m benchmarks.load_test --url http://127.0.0.1:8000
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+
+from benchmarks.fake_upstreams import add_upstream_arguments, build_upstreams, fake_jpeg
+
+SCENARIOS = ("change_hair", "view_image", "analyze_face", "premium")
+PERCENTILES = (50, 95, 99)
+REQUEST_TIMEOUT = 180
+
+
+class LoadClient:
+    """Senaryo başına tek bir isteği gönderir; thread başına ayrı requests.Session"""
+
+    def __init__(self, base_url, devices, reuse_payloads):
+        self.base_url = base_url.rstrip("/")
+        self.devices = devices
+        self.reuse_payloads = reuse_payloads
+        self.image_bytes = fake_jpeg((1600, 1200))
+        self.view_image_path = None
+        self.view_image_params = None
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _device(self, i):
+        return f"bench-{i % self.devices}"
+
+    def _image(self, i):
+        # JPEG sonuna eklenen byte'lar çözmeyi etkilemez ama hash'i değiştirir (önbellekler atlanır)
+        if self.reuse_payloads:
+            return self.image_bytes
+        return self.image_bytes + uuid.uuid4().bytes
+
+    def _post_change_hair(self, i):
+        data = {"device_id": self._device(i), "prompt": "Make the hair short and wavy"}
+        if not self.reuse_payloads:
+            data["prompt"] += f" #{i}"
+        return self._session().post(
+            f"{self.base_url}/model/change-hair",
+            files={"image": ("face.jpg", self._image(i), "image/jpeg")},
+            data={"data": json.dumps(data)},
+            timeout=REQUEST_TIMEOUT
+        )
+
+    def prepare(self):
+        """view_image senaryosu için gerçek bir çıktı dosyası üretir"""
+        response = self._post_change_hair(0)
+        response.raise_for_status()
+        output_url = urlparse(response.json()["output_image_url"])
+        self.view_image_path = output_url.path
+        # İmzalı URL (device_id'ye bağlı) olduğu gibi kullanılır; imzasızsa her istekte farklı cihaz
+        params = dict(parse_qsl(output_url.query))
+        self.view_image_params = params if "sig" in params else None
+
+    def change_hair(self, i):
+        return self._post_change_hair(i)
+
+    def view_image(self, i):
+        return self._session().get(
+            f"{self.base_url}{self.view_image_path}",
+            params=self.view_image_params or {"device_id": self._device(i)},
+            timeout=REQUEST_TIMEOUT
+        )
+
+    def analyze_face(self, i):
+        return self._session().post(
+            f"{self.base_url}/scan/analyze-face",
+            files={"image": ("face.jpg", self._image(i), "image/jpeg")},
+            data={"device_id": self._device(i)},
+            timeout=REQUEST_TIMEOUT
+        )
+
+    def premium(self, i):
+        return self._session().post(
+            f"{self.base_url}/check/premium",
+            json={
+                "device_id": self._device(i),
+                "subscription_type": "monthly",
+                "subscription_expiration": "2030-01-01T00:00:00Z",
+                "last_token_renewal_time": "2026-01-01T00:00:00Z",
+                "idempotency_key": uuid.uuid4().hex
+            },
+            timeout=REQUEST_TIMEOUT
+        )
+
+
+def percentile(sorted_values, p):
+    """En yakın sıra yöntemi"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def run_scenario(client, scenario, total, concurrency):
+    send = getattr(client, scenario)
+    results = []
+    results_lock = threading.Lock()
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            status = send(i).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        duration = time.perf_counter() - start
+        with results_lock:
+            results.append((duration, status))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(duration for duration, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = sum(count for status, count in statuses.items() if status.startswith("2") or status == "304")
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "ok": ok,
+        "error_rate": round(1 - ok / total, 4) if total else 0.0,
+        "statuses": statuses,
+        "throughput": round(total / elapsed, 2) if elapsed else 0.0,
+        **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 1) for p in PERCENTILES},
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+def print_report(report):
+    print(f"\n{'senaryo':<14} {'istek':>7} {'başarılı':>9} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  durumlar")
+    for scenario, r in report["scenarios"].items():
+        print(f"{scenario:<14} {r['requests']:>7} {r['ok']:>9} {r['throughput']:>9.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}  {r['statuses']}")
+    if report.get("upstreams"):
+        print(f"\nupstream istekleri: {report['upstreams']}")
+
+
+def compare(report, baseline, max_regression):
+    """p95 artışı veya throughput düşüşü eşiği aşan senaryoları döner"""
+    regressions = []
+    for scenario, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{scenario}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if previous["throughput"] and current["throughput"] < previous["throughput"] * (1 - max_regression):
+            regressions.append(f"{scenario}: throughput {previous['throughput']} -> {current['throughput']} req/s")
+        if current["error_rate"] > previous["error_rate"] + max_regression:
+            regressions.append(f"{scenario}: hata oranı {previous['error_rate']} -> {current['error_rate']}")
+    return regressions
+
+
+def _start_local_app(upstreams):
+    """Taklitlere yönlenmiş uygulamayı geçici bir çalışma dizininde başlatır (repo'daki uploads/ kirlenmesin)"""
+    os.environ.update(upstreams.env())
+    # Tüm sanal cihazlar aynı IP'den gelir; IP başına admission sınırı ölçümü bozmasın
+    os.environ.setdefault("ADMISSION_IP_MULTIPLIER", "0")
+    os.chdir(tempfile.mkdtemp(prefix="hair-bench-"))
+
+    from werkzeug.serving import make_server
+    from app import app
+
+    # İstek başına JSON/erişim logu ölçümü boğmasın
+    logging.getLogger("hair_api").setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Çalışan API adresi; verilmezse yerel taklitlerle process içinde başlatılır")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Varsayılan: hepsi")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="Senaryo başına istek sayısı")
+    parser.add_argument("--devices", type=int, default=100, help="Kullanılacak farklı device_id sayısı")
+    parser.add_argument("--reuse-payloads", action="store_true", help="Aynı resim/prompt tekrar gönderilir (önbellek isabet yolu)")
+    parser.add_argument("--output", help="Sonuçları JSON olarak yaz")
+    parser.add_argument("--baseline", help="Önceki --output dosyası; gerileme varsa çıkış kodu 1")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="İzin verilen gerileme oranı")
+    add_upstream_arguments(parser)
+    args = parser.parse_args()
+    # Yerel modda çalışma dizini değişir; dosya yolları önceden sabitlenir
+    output_path = args.output and os.path.abspath(args.output)
+    baseline_path = args.baseline and os.path.abspath(args.baseline)
+
+    upstreams = server = None
+    base_url = args.url
+    if not base_url:
+        upstreams = build_upstreams(args).start()
+        server, base_url = _start_local_app(upstreams)
+
+    client = LoadClient(base_url, args.devices, args.reuse_payloads)
+    scenarios = args.scenario or SCENARIOS
+    report = {"url": base_url, "scenarios": {}}
+
+    try:
+        if "view_image" in scenarios:
+            client.prepare()
+        for scenario in scenarios:
+            print(f"{scenario}: {args.requests} istek, eşzamanlılık {args.concurrency}", file=sys.stderr)
+            report["scenarios"][scenario] = run_scenario(client, scenario, args.requests, args.concurrency)
+        if upstreams:
+            report["upstreams"] = upstreams.stats()
+    finally:
+        if server:
+            server.shutdown()
+        if upstreams:
+            upstreams.stop()
+
+    print_report(report)
+
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print("\nGerileme tespit edildi:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nBaseline'a göre gerileme yok")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,44 @@
-from flask import Blueprint, request, jsonify
-from dotenv import load_dotenv
-from supabase_client.supabase_client import get_supabase_client
-import replicate
-import os
-import requests
-import uuid
-from pathlib import Path
-from werkzeug.utils import secure_filename  # Dosya adı güvenliği için
+from flask import Blueprint, request, jsonify, make_response
+from services.generation import GenerationError, save_upload, run_generation, run_generation_async
+from services.job_queue import job_queue, InvalidCallbackUrl, QueueFullError, validate_callback_url
+from services.deadlines import remaining, route_timeout
+from services.async_runtime import ASYNC_UPSTREAMS
+from services.user_lookup import get_user
+from services.image_serving import serve_image
+from services.storage import storage
+from services.derivatives import DERIVATIVE_ACCEL_REDIRECT_PREFIX, InvalidDerivative, derivative_name, derivative_path, parse_size
+from services.image_urls import IMAGE_URL_ALLOW_UNSIGNED, verify_signature
+from services.user_images import list_user_images, InvalidListingParams
+from services.metrics import span
+from services.streaming import stream_response
+from services.batch_generation import InvalidBatch, parse_variants, run_batch
+from services.admission import CHANGE_HAIR, admit, hold_admission
 import json  # JSON string'i parse etmek için
 
-# .env dosyasını yüklüyoruz
-load_dotenv()
-
 model_bp = Blueprint("model", __name__)
-supabase = get_supabase_client()
 
-# Uploads klasörünü oluştur
-UPLOAD_FOLDER = Path("uploads")
-UPLOAD_FOLDER.mkdir(exist_ok=True)
- 
+
+def _request_data():
+    # Admission kontrolü view'dan önce çalışır; bozuk JSON'u view kendisi 400 ile döner
+    try:
+        data = json.loads(request.form.get('data') or '{}')
+    except json.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _request_device_id():
+    return _request_data().get('device_id')
+
+
+def _batch_cost():
+    # Her varyant ayrı bir üretim olarak sayılır
+    variants = _request_data().get('variants')
+    return len(variants) if isinstance(variants, list) else 1
+
+
 @model_bp.route('/change-hair', methods=['POST'])
+@admit(CHANGE_HAIR, device_id=_request_device_id)
 def change_hair():
     try:
         # Form-data'dan dosyayı ve diğer bilgileri al
@@ -46,11 +65,11 @@ def change_hair():
         aspect_ratio = data.get('aspect_ratio', 'match_input_image')
         output_format = data.get('output_format', 'jpg')
         
-        # Filters bilgilerini al
+        # Filters bilgilerini al (gender, haircut_style, hair_color)
         filters = data.get('filters', {})
-        gender = filters.get('gender')
-        haircut_style = filters.get('haircut_style')
-        hair_color = filters.get('hair_color')
+
+        # Aynı istek tekrar gönderilirse kredi ikinci kez düşülmez
+        idempotency_key = data.get('idempotency_key') or request.headers.get('Idempotency-Key')
 
         if not device_id:
             return jsonify({"error": "device_id gerekli"}), 400
@@ -62,8 +81,9 @@ def change_hair():
         prompt = prompt.strip()
 
         # Kullanıcı kontrolü ekleyelim
-        user_response = supabase.table('USER').select("*").eq("device_id", device_id).execute()
-        if not user_response.data:
+        with span("change_hair", "user_lookup"):
+            user = get_user(device_id)
+        if not user:
             return jsonify({
                 "error": "Geçersiz device_id. Lütfen önce kayıt olun."
             }), 403
@@ -71,70 +91,117 @@ def change_hair():
         if image.filename == '':
             return jsonify({"error": "Resim seçilmedi"}), 400
 
-        # Gelen resmi kaydet
-        input_filename = f"{uuid.uuid4()}.png"  # Uzantıyı .png olarak sabitledik
-        input_file_path = UPLOAD_FOLDER / input_filename
-        image.save(input_file_path)
-
-        # View-image endpoint'i üzerinden resim URL'i oluştur
-        input_image_url = f"https://hair.serdardyck.com/model/view-image/{input_filename}?device_id={device_id}"
-
-        # Replicate modelini çalıştır
-        output = replicate.run(
-            "black-forest-labs/flux-kontext-pro",
-            input={
-                "prompt": prompt,
-                "input_image": input_image_url,
-                "output_format": output_format
-            }
-        )
-        
-        # Output'u kontrol et ve URL'e çevir
-        output_url = str(output) if output else None
+        try:
+            callback_url = validate_callback_url(data.get('callback_url'))
+        except InvalidCallbackUrl as callback_error:
+            return jsonify({"error": str(callback_error)}), 400
+
+        # Gelen resmi normalize edip kaydet
+        try:
+            with span("change_hair", "upload_save"):
+                input_filename = save_upload(image)
+        except GenerationError as upload_error:
+            return jsonify({"error": upload_error.message}), upload_error.status_code
+
+        # Üretim her iki modda da kuyrukta çalışır; worker thread'i en fazla route süresi kadar bekler
+        try:
+            job_id = job_queue.submit(
+                device_id,
+                run_generation_async if ASYNC_UPSTREAMS else run_generation,
+                device_id,
+                input_filename,
+                prompt,
+                output_format=output_format,
+                filters=filters,
+                idempotency_key=idempotency_key,
+                callback_url=callback_url,
+                # Senkron modda kayıt ancak süre dolup job_id dönerken ortak depoya yazılır
+                shared=data.get('mode') == 'async' or bool(callback_url),
+                # Rate limit slot'u iş bitene kadar tutulur (async modda ve süre dolunca yanıt daha önce döner)
+                on_done=hold_admission()
+            )
+        except QueueFullError as queue_error:
+            return jsonify({"error": str(queue_error)}), 503
+
+        # Asenkron mod: job_id ile hemen dön
+        job = None
+        if data.get('mode') != 'async':
+            job = job_queue.wait(job_id, timeout=remaining(default=route_timeout()))
+
+        if job and job["status"] == "succeeded":
+            return jsonify({
+                "success": True,
+                "message": "Görsel başarıyla oluşturuldu ve kaydedildi",
+                **job["result"]
+            }), 200
 
-        if not output_url:
-            return jsonify({"error": "Model çıktısı alınamadı"}), 500
+        if job and job["status"] == "failed":
+            return jsonify({"error": job["error"]}), job["error_status"]
+
+        # Async istendiyse ya da süre dolduysa üretim arka planda sürer
+        job_queue.share(job_id)
+        return jsonify({
+            "success": True,
+            "message": "Görsel oluşturma işi kuyruğa alındı",
+            "job_id": job_id,
+            "status_url": f"/model/jobs/{job_id}?device_id={device_id}"
+        }), 202
 
-        # Oluşturulan görseli indir
-        response = requests.get(output_url)
-        if response.status_code != 200:
-            return jsonify({"error": "Görsel indirilemedi"}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Oluşturulan görsel için rastgele dosya adı oluştur (output_format'a göre uzantı)
-        output_filename = f"{uuid.uuid4()}.{output_format}"
-        output_file_path = UPLOAD_FOLDER / output_filename
+@model_bp.route('/change-hair/batch', methods=['POST'])
+@admit(CHANGE_HAIR, device_id=_request_device_id, cost=_batch_cost)
+def change_hair_batch():
+    try:
+        # Tek resim + N varyant: {"device_id", "variants": [{"prompt", "filters", "output_format"}]}
+        if 'image' not in request.files:
+            return jsonify({"error": "Resim dosyası gerekli"}), 400
 
-        # Oluşturulan görseli kaydet
-        with open(output_file_path, 'wb') as f:
-            f.write(response.content)
+        if 'data' not in request.form:
+            return jsonify({"error": "data alanı gerekli"}), 400
 
-        # Oluşturulan görselin URL'ini oluştur
-        output_image_url = f"https://hair.serdardyck.com/model/view-image/{output_filename}?device_id={device_id}"
+        image = request.files['image']
 
-        # Supabase'e kaydet
         try:
-            result = supabase.table('user_images').insert({
-                "device_id": device_id,
-                "user_image": input_image_url,  # Kullanıcının yüklediği resmin URL'i
-                "generated_image": output_image_url,  # Oluşturulan resmin URL'i
-                "prompt": prompt,
-                "gender": gender,
-                "haircut_style": haircut_style,
-                "hair_color": hair_color
-            }).execute()
-            print(f"Database insert successful: {result}")
-        except Exception as db_error:
-            print(f"Database error: {str(db_error)}")
-            # Hata olsa bile işlemi devam ettir, sadece log'la
-            # return jsonify({"error": f"Database kayıt hatası: {str(db_error)}"}), 500
+            data = json.loads(request.form['data'])
+        except json.JSONDecodeError as json_error:
+            return jsonify({
+                "error": f"Geçersiz JSON formatı: {str(json_error)}"
+            }), 400
 
-        return jsonify({
-            "success": True,
-            "message": "Görsel başarıyla oluşturuldu ve kaydedildi",
-            "input_image_url": input_image_url,
-            "output_image_url": output_image_url,
-            "original_output_url": output_url
-        }), 200
+        device_id = data.get('device_id')
+        if not device_id:
+            return jsonify({"error": "device_id gerekli"}), 400
+
+        try:
+            variants = parse_variants(data.get('variants'), data.get('output_format', 'jpg'))
+        except InvalidBatch as batch_error:
+            return jsonify({"error": str(batch_error)}), 400
+
+        idempotency_key = data.get('idempotency_key') or request.headers.get('Idempotency-Key')
+
+        # Kullanıcı ve resim tüm varyantlar için bir kez işlenir
+        with span("change_hair_batch", "user_lookup"):
+            user = get_user(device_id)
+        if not user:
+            return jsonify({
+                "error": "Geçersiz device_id. Lütfen önce kayıt olun."
+            }), 403
+
+        if image.filename == '':
+            return jsonify({"error": "Resim seçilmedi"}), 400
+
+        try:
+            with span("change_hair_batch", "upload_save"):
+                input_filename = save_upload(image)
+        except GenerationError as upload_error:
+            return jsonify({"error": upload_error.message}), upload_error.status_code
+
+        results = run_batch(device_id, input_filename, variants, idempotency_key, timeout=remaining(default=route_timeout()))
+
+        # Sonuçlar bittikçe gönderilir: Accept text/event-stream ise SSE, değilse satır satır JSON
+        return stream_response(results, lambda item: "done" if item.get("done") else "result")
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -150,29 +217,49 @@ def viewImage(image_name):
                 "error": "device_id parametresi gerekli"
             }), 400
 
-        # Önce kullanıcının varlığını kontrol et
-        user_response = supabase.table('USER').select("*").eq("device_id", device_id).execute()
-
-        if not user_response.data:
+        if request.args.get('sig'):
+            # İmzalı URL: veritabanına gitmeden HMAC ve süre kontrolü
+            if not verify_signature(image_name, device_id, request.args.get('exp'), request.args.get('kid'), request.args.get('sig')):
+                return jsonify({
+                    "error": "Geçersiz ya da süresi dolmuş resim bağlantısı"
+                }), 403
+        elif not IMAGE_URL_ALLOW_UNSIGNED:
+            return jsonify({
+                "error": "İmzalı resim bağlantısı gerekli"
+            }), 403
+        # Eski imzasız URL: kullanıcının varlığını kontrol et (önbellekten; kaydı yeni olan cihazın henüz resmi yoktur)
+        elif not get_user(device_id, recheck_missing=False):
             return jsonify({
                 "error": "Yetkisiz erişim. Kullanıcı bulunamadı."
             }), 403
 
-        # Resim dosyasının yolunu oluştur
-        image_path = UPLOAD_FOLDER / image_name
+        # ?w=256&fmt=webp: küçültülmüş kopya (genişlik izinli değerlere yuvarlanır, ilk istekte üretilip önbelleğe alınır)
+        try:
+            size = parse_size(request.args.get('w'), request.args.get('fmt'))
+        except InvalidDerivative as size_error:
+            return jsonify({
+                "error": str(size_error)
+            }), 400
+
+        if size:
+            image_path = derivative_path(image_name, *size)
+            if image_path is None:
+                return jsonify({
+                    "error": "Resim bulunamadı"
+                }), 404
+            return serve_image(image_path, derivative_name(image_name, *size), accel_prefix=DERIVATIVE_ACCEL_REDIRECT_PREFIX)
+
+        # Resmin yerel kopyası (uzak backend'de ise disk önbelleğine indirilir)
+        image_path = storage.local_path(image_name)
 
         # Resim dosyasının varlığını kontrol et
-        if not image_path.exists():
+        if image_path is None:
             return jsonify({
                 "error": "Resim bulunamadı"
             }), 404
 
-        # Resmi gönder
-        from flask import send_file
-        return send_file(
-            image_path,
-            mimetype='image/png'
-        )
+        # Resmi gönder (mimetype dosyadan, 304/206 ve cache header'ları ile)
+        return serve_image(image_path, image_name)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -180,18 +267,67 @@ def viewImage(image_name):
 @model_bp.route('/user-images/<device_id>', methods=['GET'])
 def getUserImages(device_id):
     try:
-        # Kullanıcının tüm resimlerini getir
-        response = supabase.table('user_images').select("*").eq("device_id", device_id).execute()
+        # Query parametreleri: limit, cursor (önceki yanıtın next_cursor'ı), fields (virgülle ayrılmış)
+        try:
+            page = list_user_images(
+                device_id,
+                limit=request.args.get('limit'),
+                cursor=request.args.get('cursor'),
+                fields=request.args.get('fields')
+            )
+        except InvalidListingParams as params_error:
+            return jsonify({"error": str(params_error)}), 400
+
+        # İstemcideki sayfa güncelse gövdeyi tekrar gönderme
+        if page["etag"] in request.if_none_match:
+            response = make_response("", 304)
+            response.set_etag(page["etag"])
+            return response
+
+        if not page["images"]:
+            response = make_response(jsonify({
+                "message": "Bu kullanıcıya ait resim bulunamadı",
+                "images": [],
+                "next_cursor": None
+            }), 200)
+        else:
+            response = make_response(jsonify({
+                "success": True,
+                "images": page["images"],
+                "next_cursor": page["next_cursor"]
+            }), 200)
+
+        response.set_etag(page["etag"])
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@model_bp.route('/jobs/<job_id>', methods=['GET'])
+def getJobStatus(job_id):
+    try:
+        device_id = request.args.get('device_id')
 
-        if not response.data:
+        if not device_id:
             return jsonify({
-                "message": "Bu kullanıcıya ait resim bulunamadı",
-                "images": []
-            }), 200
+                "error": "device_id parametresi gerekli"
+            }), 400
+
+        job = job_queue.get(job_id)
+
+        # Başka cihazın işi de bulunamadı olarak döner
+        if not job or job["device_id"] != device_id:
+            return jsonify({
+                "error": "İş bulunamadı"
+            }), 404
 
+        job.pop("device_id")
         return jsonify({
             "success": True,
-            "images": response.data
+            "job": job
         }), 200
 
     except Exception as e:
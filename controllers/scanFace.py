@@ -1,19 +1,47 @@
 from flask import Blueprint, request, jsonify
-from dotenv import load_dotenv
+import functools
+import itertools
 import os
-import json
-from google import genai
-from google.genai import types
-from PIL import Image
-from io import BytesIO
-
-# .env dosyasını yüklüyoruz
-load_dotenv()
+from services.image_pipeline import FORMAT_MIMETYPES, SCAN_MAX_EDGE, normalize_image
+from services.face_cache import analysis_key, get_analysis, set_analysis
+from services.hairstyle_catalog import HairstyleCatalog, normalize_gender
+from services.json_extract import IncrementalJsonObject, extract_json
+from services.async_runtime import ASYNC_UPSTREAMS, runtime
+from services.deadlines import remaining
+from services.metrics import log_event, span
+from services.admission import ANALYZE_FACE, admit
+from services.streaming import stream_response
+from services import upstream
+from services.upstream import UPSTREAM_POLICIES, CircuitOpenError, UpstreamError
 
 scan_bp = Blueprint("scan", __name__)
 
-# Gemini Client'ını yapılandır
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+# Gemini Client'ı ilk kullanımda ve process başına kurulur (gunicorn preload/fork sonrası paylaşılmaz)
+GEMINI_TIMEOUT = int(os.getenv("GEMINI_TIMEOUT", "40"))
+_client = None
+_client_pid = None
+
+
+def get_gemini_client():
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        # google-genai ağır bir import; ilk kullanımda yüklenir (soğuk başlangıç kısalır)
+        from google import genai
+        from google.genai import types
+
+        # HTTP süre sınırı tek denemeninki; toplam süreyi upstream katmanı yönetir
+        _client = genai.Client(
+            api_key=os.getenv("GEMINI_API_KEY"),
+            http_options=types.HttpOptions(timeout=int(UPSTREAM_POLICIES["gemini"].attempt_timeout * 1000))
+        )
+        _client_pid = os.getpid()
+    return _client
+
+
+async def _generate_content_async(**request_args):
+    # Async client runtime loop'unda kullanılır; aynı anda en fazla GEMINI_CONCURRENCY istek
+    async with runtime.semaphore("gemini"):
+        return await get_gemini_client().aio.models.generate_content(**request_args)
 
 # Saç modelleri verileri
 HAIRCUT_STYLES_DATA = {
@@ -69,15 +97,11 @@ HAIRCUT_STYLES_DATA = {
     ]
 }
 
-def analyze_face_with_gemini(image_file):
-    """Gemini API ile yüz analizi yapar - doğrudan file objesi alır"""
-    try:
-        # Flask FileStorage objesini PIL Image'e çevir
-        image_bytes = image_file.read()
-        image = Image.open(BytesIO(image_bytes))
-        
-        # Prompt'u hazırla
-        text_input = f"""
+# Katalog bir kez indekslenir (isim eşleştirme ve prompt için)
+catalog = HairstyleCatalog(HAIRCUT_STYLES_DATA)
+
+# {male_styles} / {female_styles} katalogdan doldurulur, JSON süslü parantezleri çift yazılır
+FACE_ANALYSIS_PROMPT_TEMPLATE = """
         Bu yüz resmini DETAYLİ olarak analiz et ve aşağıdaki kriterleri kullanarak doğru yüz şeklini belirle:
 
         YÜZÜN ÖLÇÜMSEL ANALİZİNİ YAP:
@@ -103,8 +127,8 @@ def analyze_face_with_gemini(image_file):
         4. Seçimini gerekçelendir (hangi özellikler bu yüz şekline işaret ediyor)
 
         Mevcut saç modelleri kategorilere göre:
-        - Male: {', '.join(HAIRCUT_STYLES_DATA['male'])}
-        - Female: {', '.join(HAIRCUT_STYLES_DATA['female'])}
+        - Male: {male_styles}
+        - Female: {female_styles}
 
         ÖNEMLİ: Her yüz şekli için en uygun saç modellerini seç:
         - Oval: Hemen hemen her stil uygun
@@ -125,52 +149,195 @@ def analyze_face_with_gemini(image_file):
         DİKKAT: Yüzü gerçekten DİKKATLE incele ve farklı yüz şekillerini ayırt et. Aynı cevabı verme, her yüzün kendine özgü yapısı var!
         Cinsiyete göre sadece o kategorideki saç modellerini öner!
         """
-        
-        # Gemini'ye gönder
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp",
-            contents=[text_input, image],
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT']
-            )
-        )
-        
-        # Yanıtı al
-        response_text = response.candidates[0].content.parts[0].text.strip()
-        
-        # JSON'u ayıkla (bazen extra metin olabilir)
-        if response_text.startswith('```json'):
-            response_text = response_text[7:-3]
-        elif response_text.startswith('```'):
-            response_text = response_text[3:-3]
-        
-        # JSON'u parse et
-        result = json.loads(response_text)
-        
-        return result
-        
+
+# Structured output: yanıt şemaya uygun saf JSON gelir; kapalıysa serbest metinden ayıklanır
+GEMINI_STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "1") == "1"
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+ANALYSIS_FIELDS = ("gender", "face_shape", "face_analysis_reason", "recommended_hairstyles")
+REQUIRED_ANALYSIS_FIELDS = ("gender", "face_shape", "recommended_hairstyles")
+# Akışta gelir gelmez istemciye gönderilen alanlar; öneriler katalogla düzeltildikten sonra gider
+STREAMED_FIELDS = ("gender", "face_shape")
+# Yüz analizi önbellek anahtarına girer: model, çıktı modu ya da katalog değişince önbellek yeniden dolar
+ANALYSIS_CACHE_VARIANT = f"{GEMINI_MODEL}:structured={int(GEMINI_STRUCTURED_OUTPUT)}:catalog={catalog.version}"
+
+
+@functools.cache
+def _response_schema():
+    from google.genai import types
+
+    return types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "gender": types.Schema(type=types.Type.STRING, enum=["male", "female"]),
+            "face_shape": types.Schema(type=types.Type.STRING),
+            "face_analysis_reason": types.Schema(type=types.Type.STRING),
+            "recommended_hairstyles": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
+        },
+        required=list(ANALYSIS_FIELDS),
+        # Alan sırası sabit: akışta cinsiyet ve yüz şekli ilk gelir
+        property_ordering=list(ANALYSIS_FIELDS),
+    )
+
+
+def _prepare_analysis(image_file):
+    """(önbellek anahtarı, önbellekteki sonuç, Gemini istek argümanları); önbellekte varsa argümanlar None"""
+    image_bytes = image_file.read()
+
+    # Aynı resim aynı model/katalog/çıktı moduyla daha önce analiz edildiyse Gemini'ye tekrar gitme
+    cache_key = analysis_key(image_bytes, ANALYSIS_CACHE_VARIANT)
+    cached_result = get_analysis(cache_key)
+    if cached_result is not None:
+        return cache_key, cached_result, None
+
+    # Flask FileStorage objesini küçültülmüş, yeniden kodlanmış byte'lara çevir
+    with span("analyze_face", "preprocess"):
+        normalized_bytes, image_format = normalize_image(image_bytes, max_edge=SCAN_MAX_EDGE)
+    from google.genai import types
+
+    image = types.Part.from_bytes(data=normalized_bytes, mime_type=FORMAT_MIMETYPES[image_format])
+
+    # Hazır prompt'u al (katalog listesi bir kez yerleştirildi)
+    text_input = catalog.render_prompt(FACE_ANALYSIS_PROMPT_TEMPLATE)
+
+    config = dict(response_modalities=['TEXT'])
+    if GEMINI_STRUCTURED_OUTPUT:
+        config.update(response_mime_type="application/json", response_schema=_response_schema())
+    request_args = dict(
+        model=GEMINI_MODEL,
+        contents=[text_input, image],
+        config=types.GenerateContentConfig(**config)
+    )
+    return cache_key, None, request_args
+
+
+def _finish_analysis(cache_key, response_text):
+    """Yanıt metnindeki JSON'u ayıklar, katalogla düzeltir ve önbelleğe yazar"""
+    # Baştaki/sondaki metin ya da ``` blokları analizi düşürmez (structured output kapalıyken olur)
+    result = extract_json(response_text)
+    missing = [field for field in REQUIRED_ANALYSIS_FIELDS if field not in result]
+    if missing:
+        raise ValueError(f"Gemini yanıtında eksik alan(lar): {', '.join(missing)}")
+
+    # Katalogda olmayan önerileri düzelt/ayıkla (boşa change-hair üretimi olmasın)
+    result = catalog.repair_analysis(result)
+    set_analysis(cache_key, result)
+    return result
+
+
+def _public_analysis(result):
+    return {
+        "gender": result.get('gender'),
+        "face_shape": result.get('face_shape'),
+        "recommended_hairstyles": result.get('recommended_hairstyles')
+    }
+
+
+def analyze_face_with_gemini(image_file):
+    """Gemini API ile yüz analizi yapar - doğrudan file objesi alır"""
+    try:
+        cache_key, cached_result, request_args = _prepare_analysis(image_file)
+        if cached_result is not None:
+            return cached_result
+
+        # Analiz salt okunur: geçici hatalarda tekrar denenir, async yolda yavaş isteğin yanına hedge açılır
+        with span("analyze_face", "gemini_generate"):
+            if ASYNC_UPSTREAMS:
+                timeout = remaining(default=GEMINI_TIMEOUT)
+                response = runtime.run(
+                    upstream.call_async("gemini", lambda: _generate_content_async(**request_args), timeout=timeout, hedge=True),
+                    # İç süre sınırı önce dolsun, UpstreamTimeout olarak dönsün
+                    timeout=timeout + 1
+                )
+            else:
+                response = upstream.call("gemini", get_gemini_client().models.generate_content, **request_args)
+
+        return _finish_analysis(cache_key, response.text)
+
+    except UpstreamError:
+        # Route 503/504 + Retry-After döner
+        raise
     except Exception as e:
-        print(f"Gemini API hatası: {str(e)}")
+        log_event("gemini_failed", error=str(e))
         return None
 
+
+def _open_stream(**request_args):
+    """Akışı açıp ilk parçayı bekler; bağlantı ve 5xx hataları upstream katmanında tekrar denenir"""
+    chunks = iter(get_gemini_client().models.generate_content_stream(**request_args))
+    return next(chunks, None), chunks
+
+
+def _stream_analysis(cache_key, request_args):
+    parser = IncrementalJsonObject()
+    text = []
+    try:
+        with span("analyze_face", "gemini_stream"):
+            # Akış senkron client'la istek thread'inde okunur; hedge sadece tek parça yanıtta var
+            first_chunk, chunks = upstream.call("gemini", _open_stream, **request_args)
+            for chunk in itertools.chain([first_chunk] if first_chunk else [], chunks):
+                piece = chunk.text or ""
+                text.append(piece)
+                for field, value in parser.feed(piece).items():
+                    if field in STREAMED_FIELDS:
+                        if field == "gender":
+                            value = normalize_gender(value) or value
+                        yield {"field": field, "value": value}
+        result = _finish_analysis(cache_key, "".join(text))
+    except UpstreamError as upstream_error:
+        log_event("gemini_failed", error=str(upstream_error))
+        status_code = 503 if isinstance(upstream_error, CircuitOpenError) else 504
+        yield {"error": "Yüz analizi servisi şu anda yanıt vermiyor, lütfen biraz sonra tekrar deneyin",
+               "status_code": status_code, "retry_after": upstream_error.retry_after}
+        return
+    except Exception as e:
+        log_event("gemini_failed", error=str(e))
+        yield {"error": "Yüz analizi yapılamadı", "status_code": 500}
+        return
+
+    yield {"done": True, "data": _public_analysis(result)}
+
+
+def stream_face_analysis(image_file):
+    """Resmi hemen hazırlar (hatalar akış başlamadan yükselir), sonra olay üreteci döner:
+    {"field", "value"} alanlar geldikçe, sonunda {"done", "data"} ya da {"error", "status_code"}"""
+    cache_key, cached_result, request_args = _prepare_analysis(image_file)
+    if cached_result is not None:
+        return iter([{"done": True, "cached": True, "data": _public_analysis(cached_result)}])
+    return _stream_analysis(cache_key, request_args)
+
+
+def _validate_form():
+    """Form hatasında (yanıt, durum kodu), geçerliyse None"""
+    if 'image' not in request.files:
+        return jsonify({"error": "Resim dosyası gerekli"}), 400
+    if not request.form.get('device_id'):
+        return jsonify({"error": "device_id gerekli"}), 400
+    if request.files['image'].filename == '':
+        return jsonify({"error": "Resim seçilmedi"}), 400
+    return None
+
+
 @scan_bp.route('/analyze-face', methods=['POST'])
+@admit(ANALYZE_FACE, device_id=lambda: request.form.get('device_id'))
 def analyze_face():
     try:
         # Form-data'dan dosyayı ve device_id'yi al
-        if 'image' not in request.files:
-            return jsonify({"error": "Resim dosyası gerekli"}), 400
-            
-        device_id = request.form.get('device_id')
-        if not device_id:
-            return jsonify({"error": "device_id gerekli"}), 400
+        invalid = _validate_form()
+        if invalid:
+            return invalid
 
         image = request.files['image']
-        
-        if image.filename == '':
-            return jsonify({"error": "Resim seçilmedi"}), 400
 
         # Gemini ile yüz analizi yap - doğrudan file objesi gönder
-        analysis_result = analyze_face_with_gemini(image)
+        try:
+            analysis_result = analyze_face_with_gemini(image)
+        except UpstreamError as upstream_error:
+            log_event("gemini_failed", error=str(upstream_error))
+            status_code = 503 if isinstance(upstream_error, CircuitOpenError) else 504
+            response = jsonify({"error": "Yüz analizi servisi şu anda yanıt vermiyor, lütfen biraz sonra tekrar deneyin",
+                                "retry_after": upstream_error.retry_after})
+            response.headers["Retry-After"] = str(upstream_error.retry_after)
+            return response, status_code
         
         if not analysis_result:
             return jsonify({"error": "Yüz analizi yapılamadı"}), 500
@@ -178,12 +345,24 @@ def analyze_face():
         return jsonify({
             "success": True,
             "message": "Yüz analizi başarıyla tamamlandı",
-            "data": {
-                "gender": analysis_result.get('gender'),
-                "face_shape": analysis_result.get('face_shape'),
-                "recommended_hairstyles": analysis_result.get('recommended_hairstyles')
-            }
+            "data": _public_analysis(analysis_result)
         }), 200
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+
+@scan_bp.route('/analyze-face/stream', methods=['POST'])
+@admit(ANALYZE_FACE, device_id=lambda: request.form.get('device_id'))
+def analyze_face_stream():
+    """analyze-face'in akışlı sürümü: gender ve face_shape model yazdıkça gönderilir"""
+    try:
+        invalid = _validate_form()
+        if invalid:
+            return invalid
+
+        events = stream_face_analysis(request.files['image'])
+        return stream_response(events, lambda item: "field" if "field" in item else "error" if "error" in item else "done")
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
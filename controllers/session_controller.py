@@ -1,5 +1,7 @@
 from flask import Blueprint, request, jsonify
 from supabase_client.supabase_client import get_supabase_client
+from services.user_lookup import get_user, invalidate_user
+from services.metrics import log_event
 
 session_bp = Blueprint("session", __name__)
 supabase = get_supabase_client()
@@ -13,20 +15,21 @@ def register():
         return jsonify({"error": "Eksik bilgiler"}), 400
 
     try:
-        # Önce bu device_id ile kayıtlı kullanıcı var mı kontrol et
-        existing_user = supabase.table('USER').select("*").eq("device_id", device_id).execute()
+        # Önce bu device_id ile kayıtlı kullanıcı var mı kontrol et (başka worker'da kayıt olmuş olabilir, önbellek atlanır)
+        existing_user = get_user(device_id, fresh=True)
 
-        if existing_user.data:
+        if existing_user:
             # Kullanıcı zaten varsa bilgilerini döndür
-            return jsonify({"message": "Kullanıcı zaten kayıtlı!", "user": existing_user.data[0]}), 201
+            return jsonify({"message": "Kullanıcı zaten kayıtlı!", "user": existing_user}), 201
 
         # Eğer kayıtlı değilse yeni kullanıcı ekle
         response = supabase.table('USER').insert({
             "device_id": device_id,
         }).execute()
+        invalidate_user(device_id)
 
         # Response'u kontrol edelim
-        print("Response:", response)  # Debug için
+        log_event("user_registered", device_id=device_id, rows=len(response.data or []))
         
         if not response.data:
             return jsonify({"message": "Kullanıcı kaydedildi fakat veri dönmedi"}), 201
@@ -1,16 +1,10 @@
 from flask import Blueprint, request, jsonify
-from dotenv import load_dotenv
-from supabase_client.supabase_client import get_supabase_client
-from datetime import datetime, timedelta
+from services.credits import PREMIUM_CREDIT_MAPPING, activate_premium, renew_premium_credits
 
 
 
 
-# .env dosyasını yüklüyoruz
-load_dotenv()
-
 premiumAndToken_bp = Blueprint("premiumAndToken", __name__)
-supabase = get_supabase_client()
 
 
 @premiumAndToken_bp.route("/premium", methods=["POST"])
@@ -29,19 +23,32 @@ def premium():
                 "status": False
             }), 400
 
-        # 1. Device ID kontrolü
-        user_response = supabase.table('USER').select('*').eq('device_id', device_id).execute()
-        
-        if not user_response.data:
+        credits = PREMIUM_CREDIT_MAPPING.get(subscription_type.lower())
+        if credits is None:
+            return jsonify({
+                "error": "Geçersiz abonelik türü",
+                "status": False
+            }), 400
+
+        # Kontrol, kredi sıfırlama ve güncelleme tek atomik RPC'de yapılır
+        result = activate_premium(
+            device_id,
+            subscription_type,
+            subscription_expiration,
+            last_token_renewal_time,
+            credits,
+            idempotency_key=data.get('idempotency_key') or request.headers.get('Idempotency-Key')
+        )
+
+        if result.get('status') == 'not_found':
             return jsonify({
                 "error": "Yetkisiz erişim. Device ID bulunamadı.",
                 "status": False
             }), 401
 
-        user_data = user_response.data[0]
-
         # Premium kontrolü
-        if user_data.get('is_premium'):
+        if result.get('status') == 'already_premium':
+            user_data = result.get('user') or {}
             return jsonify({
                 "error": "Bu kullanıcı zaten premium üye",
                 "status": False,
@@ -52,44 +59,11 @@ def premium():
                 }
             }), 400
 
-        current_credits = user_data.get('credits', 0)
-
-        # Eğer mevcut credits 0'dan büyükse, önce sıfırla
-        if current_credits > 0:
-            reset_response = supabase.table('USER').update({
-                'credits': 0
-            }).eq('device_id', device_id).execute()
-
-        # Subscription type'a göre credit belirleme
-        credit_mapping = {
-            'yearly': 250,
-            'monthly': 150,
-            'weekly': 50
-        }
-        
-        credits = credit_mapping.get(subscription_type.lower())
-        if credits is None:
-            return jsonify({
-                "error": "Geçersiz abonelik türü",
-                "status": False
-            }), 400
-
-        # Update user data
-        update_data = {
-            'subscription_expiration': subscription_expiration,
-            'subscription_type': subscription_type,
-            'is_premium': True,
-            'credits': credits,
-            'last_token_renewal_time': last_token_renewal_time
-        }
-
-        update_response = supabase.table('USER').update(update_data).eq('device_id', device_id).execute()
-
         return jsonify({
             "message": "Premium bilgileri başarıyla güncellendi",
             "status": True,
-            "data": update_response.data,
-            "previous_credits": current_credits
+            "data": [result.get('user')],
+            "previous_credits": result.get('previous_credits')
         }), 200
 
     except Exception as e:
@@ -115,70 +89,50 @@ def renew_premium():
                 "status": False
             }), 400
 
-        # Device ID kontrolü
-        user_response = supabase.table('USER').select('*').eq('device_id', device_id).execute()
-        
-        if not user_response.data:
+        # Kontrol ve güncelleme tek atomik RPC'de; son yenileme tarihi farklıysa krediler yüklenir
+        result = renew_premium_credits(
+            device_id,
+            latest_purchase_date,
+            subscription_expiration,
+            idempotency_key=data.get('idempotency_key') or request.headers.get('Idempotency-Key')
+        )
+        status = result.get('status')
+
+        if status == 'not_found':
             return jsonify({
                 "error": "Kullanıcı bulunamadı",
                 "status": False
             }), 404
 
-        user_data = user_response.data[0]
-
         # Premium kullanıcı kontrolü
-        if not user_data.get('is_premium'):
+        if status == 'not_premium':
             return jsonify({
                 "error": "Bu kullanıcı premium üye değil",
                 "status": False
             }), 403
 
-        # 2. Tarihleri karşılaştır
-        db_last_renewal = datetime.fromisoformat(user_data['last_token_renewal_time'].replace('Z', '+00:00'))
-        new_purchase_date = datetime.fromisoformat(latest_purchase_date.replace('Z', '+00:00'))
-
-        # Eğer yeni satın alma tarihi, veritabanındaki son yenileme tarihinden farklı değilse
-        if db_last_renewal == new_purchase_date:
+        # Yeni satın alma tarihi, veritabanındaki son yenileme tarihinden farklı değilse
+        if status == 'already_renewed':
             return jsonify({
                 "error": "Kredi zaten yüklenmiş",
                 "status": False,
-                "last_renewal": db_last_renewal.isoformat()
+                "last_renewal": result.get('last_renewal')
             }), 400
 
-        # 3. Subscription type'a göre credit belirleme
-        credit_mapping = {
-            'yearly': 500,
-            'monthly': 250,
-            'weekly': 50
-        }
-
-        subscription_type = user_data['subscription_type']
-        new_credits = credit_mapping.get(subscription_type.lower())
-        
-        if new_credits is None:
+        if status == 'invalid_subscription_type':
             return jsonify({
                 "error": "Geçersiz abonelik türü",
                 "status": False
             }), 400
 
-        # Verileri güncelle
-        update_data = {
-            'credits': new_credits,
-            'last_token_renewal_time': latest_purchase_date,  # ön yüzden gelen değeri kullan
-            'subscription_expiration': subscription_expiration,  # ön yüzden gelen değeri kullan
-            'is_premium': True
-        }
-
-        update_response = supabase.table('USER').update(update_data).eq('device_id', device_id).execute()
-
         return jsonify({
             "message": "Premium abonelik başarıyla yenilendi",
             "status": True,
             "data": {
-                "new_credits": new_credits,
+                "new_credits": result.get('new_credits'),
                 "renewal_time": latest_purchase_date,
                 "next_renewal_date": subscription_expiration,
-                "subscription_type": subscription_type
+                "subscription_type": result.get('subscription_type')
             }
         }), 200
 
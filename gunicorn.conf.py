@@ -0,0 +1,43 @@
+"""Production sunucu ayarları: gunicorn -c gunicorn.conf.py app:app
+
+Tüm değerler ortam değişkenleriyle değiştirilebilir. Graceful reload için
+master process'e HUP gönderilir (kill -HUP <pid>): yeni worker'lar ayağa
+kalkar, eskiler elindeki istekleri graceful_timeout içinde bitirir.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+
+# İstekler çoğunlukla Replicate/Gemini/Supabase beklediği için gthread:
+# çekirdek başına bir process, her process'te çok sayıda thread
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# Worker bu kadar saniye sessiz kalırsa yeniden başlatılır; route bazlı
+# süreler app.py'deki ROUTE_TIMEOUTS ile uygulanır, bu en üst sınırdır
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "60"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Bellek şişmesine karşı worker'lar belli istek sayısından sonra yenilenir
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "200"))
+
+# Uygulama master'da bir kez import edilir, worker'lar fork ile kopyalanır.
+# Client'lar (Supabase, Gemini, indirme session'ı) ilk kullanımda ve process
+# başına kurulduğu için fork sonrası paylaşılmaz.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # Her worker ağır SDK'ları ve client'ları arka planda ısıtır; /ready o zamana kadar 503 döner
+    from app import STARTUP_WARMUP, start_warmup
+
+    if STARTUP_WARMUP:
+        start_warmup()
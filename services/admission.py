@@ -0,0 +1,341 @@
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import g, jsonify, make_response, request
+
+from services.metrics import Counter, log_event, register
+
+# "memory": process başına sayaçlar (gunicorn'da limitler worker sayısıyla çarpılır),
+# "redis": tüm worker'lar/makineler arasında ortak (REDIS_URL, Redis protokolü konuşan her sunucu)
+ADMISSION_STORE = os.getenv("ADMISSION_STORE", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+ADMISSION_KEY_PREFIX = os.getenv("ADMISSION_KEY_PREFIX", "hair:admission")
+# Süreç çökerse Redis'te kalan in-flight sayacı bu kadar saniye sonra kendiliğinden silinir
+INFLIGHT_TTL = int(os.getenv("ADMISSION_INFLIGHT_TTL", "300"))
+# device_id istemciden gelir ve kullanıcı kontrolünden önce okunur; her istekte yeni id uyduran
+# istemci cihaz limitlerine hiç takılmaz. Bu yüzden IP başına da sınır uygulanır: cihaz limitlerinin
+# bu katı (NAT arkasında birçok cihaz aynı IP'yi paylaşır). 0: IP sınırı yok
+ADMISSION_IP_MULTIPLIER = float(os.getenv("ADMISSION_IP_MULTIPLIER", "5"))
+# Kuyrukta bu kadar iş varsa yeni üretim istekleri hemen 503 alır (JOB_MAX_PENDING'e varmadan)
+ADMISSION_SHED_QUEUE_DEPTH = int(os.getenv("ADMISSION_SHED_QUEUE_DEPTH", "400"))
+
+# Cihaz başına dakikalık istek hakkı, anlık patlama payı ve aynı anda açık istek sınırı
+CHANGE_HAIR_RATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_CHANGE_HAIR_PER_MINUTE", "10"))
+CHANGE_HAIR_BURST = int(os.getenv("RATE_LIMIT_CHANGE_HAIR_BURST", "8"))
+CHANGE_HAIR_DEVICE_CONCURRENCY = int(os.getenv("MAX_INFLIGHT_CHANGE_HAIR_PER_DEVICE", "2"))
+ANALYZE_FACE_RATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_ANALYZE_FACE_PER_MINUTE", "20"))
+ANALYZE_FACE_BURST = int(os.getenv("RATE_LIMIT_ANALYZE_FACE_BURST", "5"))
+ANALYZE_FACE_DEVICE_CONCURRENCY = int(os.getenv("MAX_INFLIGHT_ANALYZE_FACE_PER_DEVICE", "2"))
+# analyze-face worker thread'inde Gemini'yi bekler; process başına en fazla bu kadar (0: sınırsız)
+ANALYZE_FACE_PROCESS_CONCURRENCY = int(os.getenv("MAX_INFLIGHT_ANALYZE_FACE", "64"))
+
+ADMISSION_REJECTIONS = register(Counter(
+    "admission_rejections_total", "Admission control tarafından reddedilen istekler", labels=("policy", "reason")
+))
+
+
+class Policy:
+    """Endpoint grubu için limitler: cihaz başına token bucket + in-flight sınırı, process geneli yük atma"""
+
+    def __init__(self, name, rate_per_minute, burst, device_concurrency, process_concurrency, shed_when=None):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.device_concurrency = device_concurrency
+        self.process_concurrency = process_concurrency
+        self.shed_when = shed_when
+        self.inflight = 0
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self.inflight = 0
+        self._lock = threading.Lock()
+
+    def enter_process(self):
+        with self._lock:
+            if self.process_concurrency and self.inflight >= self.process_concurrency:
+                return False
+            self.inflight += 1
+            return True
+
+    def exit_process(self):
+        with self._lock:
+            self.inflight -= 1
+
+
+def _job_queue_saturated():
+    from services.job_queue import job_queue
+
+    return job_queue.depth() >= ADMISSION_SHED_QUEUE_DEPTH
+
+
+CHANGE_HAIR = Policy(
+    "change_hair", CHANGE_HAIR_RATE_PER_MINUTE, CHANGE_HAIR_BURST, CHANGE_HAIR_DEVICE_CONCURRENCY,
+    process_concurrency=0, shed_when=_job_queue_saturated
+)
+ANALYZE_FACE = Policy(
+    "analyze_face", ANALYZE_FACE_RATE_PER_MINUTE, ANALYZE_FACE_BURST, ANALYZE_FACE_DEVICE_CONCURRENCY,
+    process_concurrency=ANALYZE_FACE_PROCESS_CONCURRENCY
+)
+
+
+class MemoryStore:
+    """Process içi token bucket ve in-flight sayaçları"""
+
+    def __init__(self):
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._buckets = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """(izin verildi mi, kaç saniye sonra tekrar denenebilir)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return True, 0.0
+            self._buckets[key] = (tokens, now)
+            return False, (cost - tokens) / rate if rate > 0 else float(INFLIGHT_TTL)
+
+    def acquire(self, key, limit):
+        with self._lock:
+            count = self._inflight.get(key, 0)
+            if count >= limit:
+                return False
+            self._inflight[key] = count + 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            count = self._inflight.get(key, 0) - 1
+            if count > 0:
+                self._inflight[key] = count
+            else:
+                self._inflight.pop(key, None)
+
+
+# Saat Redis'ten alınır: tüm worker'lar aynı zamanı görür
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+_ACQUIRE_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+if count > tonumber(ARGV[1]) then
+    redis.call('DECR', KEYS[1])
+    return 0
+end
+return 1
+"""
+
+# Sayaç TTL ile silinip yeniden oluşmuşsa DECR sıfırın altına iner ve sonraki acquire'lara
+# fazladan hak verirdi; sıfıra inen anahtar silinir
+_RELEASE_SCRIPT = """
+local count = redis.call('DECR', KEYS[1])
+if count <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return count
+"""
+
+
+class RedisStore:
+    """Token bucket ve in-flight sayaçları Redis'te; Lua script'leriyle tek round-trip ve atomik"""
+
+    def __init__(self, url=REDIS_URL):
+        # redis opsiyonel bağımlılık; sadece ADMISSION_STORE=redis ise gerekir
+        import redis
+
+        # redis-py bağlantı havuzu fork sonrası kendini yeniler
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+        self._acquire = self._client.register_script(_ACQUIRE_SCRIPT)
+        self._release = self._client.register_script(_RELEASE_SCRIPT)
+
+    def take(self, key, rate, burst, cost=1):
+        allowed, retry_after = self._take(keys=[key], args=[rate, burst, cost])
+        return bool(allowed), float(retry_after)
+
+    def acquire(self, key, limit):
+        return bool(self._acquire(keys=[key], args=[limit, INFLIGHT_TTL]))
+
+    def release(self, key):
+        self._release(keys=[key])
+
+
+def build_store(backend=ADMISSION_STORE):
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "redis":
+        return RedisStore()
+    raise ValueError(f"Bilinmeyen ADMISSION_STORE: {backend}")
+
+
+store = build_store()
+
+
+def _reject(policy, reason, status_code, retry_after, message):
+    ADMISSION_REJECTIONS.inc(policy.name, reason)
+    response = make_response(jsonify({"error": message, "retry_after": retry_after}), status_code)
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+class _Release:
+    """In-flight sayaçlarını ve process slot'unu bir kez bırakır (hangi thread'den çağrılırsa çağrılsın)"""
+
+    def __init__(self, policy, inflight_keys=()):
+        self._policy = policy
+        self._inflight_keys = inflight_keys
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            _release_all(self._inflight_keys)
+        except Exception as store_error:
+            log_event("admission_store_failed", policy=self._policy.name, error=str(store_error))
+        finally:
+            self._policy.exit_process()
+
+
+def _release_all(keys):
+    for key in keys:
+        store.release(key)
+
+
+def _limits(policy, device):
+    """(kapsam, anahtar eki, eşzamanlılık, dakikalık hız çarpanı) listesi; IP her zaman önce denetlenir"""
+    ip = f"ip:{request.remote_addr}"
+    if not device:
+        return [("device", ip, policy.device_concurrency, 1)]
+    if ADMISSION_IP_MULTIPLIER <= 0:
+        return [("device", device, policy.device_concurrency, 1)]
+    return [
+        ("ip", ip, max(1, int(policy.device_concurrency * ADMISSION_IP_MULTIPLIER)), ADMISSION_IP_MULTIPLIER),
+        ("device", device, policy.device_concurrency, 1),
+    ]
+
+
+def hold_admission():
+    """Yanıt döndükten sonra da süren iş (kuyruğa alınan üretim) için slot'u view'dan devralır.
+    Dönen fonksiyon iş bitince çağrılmalı; admit dışında çağrılırsa hiçbir şey yapmayan fonksiyon döner."""
+    return g.pop("admission_release", None) or (lambda: None)
+
+
+def _respond(view, release, args, kwargs):
+    g.admission_release = release
+    try:
+        response = make_response(view(*args, **kwargs))
+    except BaseException:
+        release()
+        raise
+
+    if g.pop("admission_release", None) is None:
+        # View slot'u devraldı, iş bitince bırakılacak
+        return response
+    if response.is_streamed:
+        # Akış yanıtı view döndükten sonra üretilir; slot istemciye gönderim bitince bırakılır
+        response.call_on_close(release)
+    else:
+        release()
+    return response
+
+
+def admit(policy, device_id=None, cost=None):
+    """View decorator'ı: limit aşıldıysa view çalışmadan 429/503 döner.
+    device_id ve cost, istekten değeri çıkaran fonksiyonlardır; device_id yoksa IP kullanılır,
+    varsa IP'ye ayrıca ADMISSION_IP_MULTIPLIER katı limit uygulanır.
+    Slot'lar view dönünce, akış yanıtında akış bitince, hold_admission ile devralındıysa iş bitince bırakılır."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Kuyruk zaten dolmak üzereyse yavaşça zaman aşımına uğramak yerine hemen reddet
+            if policy.shed_when and policy.shed_when():
+                return _reject(policy, "shed", 503, 5, "Sunucu yoğun, lütfen biraz sonra tekrar deneyin")
+            if not policy.enter_process():
+                return _reject(policy, "shed", 503, 1, "Sunucu yoğun, lütfen biraz sonra tekrar deneyin")
+
+            try:
+                limits = _limits(policy, device_id() if device_id else None)
+                acquired = []
+                rejected = None
+
+                try:
+                    # Önce eşzamanlılık: sınıra takılan istek rate limit hakkı harcamaz
+                    for scope, caller, concurrency, _ in limits:
+                        inflight_key = f"{ADMISSION_KEY_PREFIX}:inflight:{policy.name}:{caller}"
+                        if not store.acquire(inflight_key, concurrency):
+                            rejected = (f"{scope}_concurrency", 0.0)
+                            break
+                        acquired.append(inflight_key)
+
+                    if rejected is None:
+                        # Burst'ten pahalı istek hiç kabul edilemezdi; en fazla tüm kova harcanır
+                        request_cost = (cost() if cost else None) or 1
+                        for scope, caller, _, multiplier in limits:
+                            burst = policy.burst * multiplier
+                            allowed, retry_after = store.take(
+                                f"{ADMISSION_KEY_PREFIX}:rate:{policy.name}:{caller}",
+                                policy.rate * multiplier, burst, min(request_cost, burst)
+                            )
+                            if not allowed:
+                                rejected = ("rate_limited", retry_after)
+                                break
+
+                    if rejected is not None:
+                        _release_all(acquired)
+                except Exception as store_error:
+                    # Limit deposu erişilemezse istek geçer (fail-open), sadece log'lanır
+                    log_event("admission_store_failed", policy=policy.name, error=str(store_error))
+                    return _respond(view, _Release(policy, acquired), args, kwargs)
+            except BaseException:
+                policy.exit_process()
+                raise
+
+            if rejected is not None:
+                policy.exit_process()
+                reason, retry_after = rejected
+                if reason == "device_concurrency":
+                    return _reject(policy, reason, 429, 1, "Bu cihaz için devam eden istek sayısı sınırda")
+                if reason == "ip_concurrency":
+                    return _reject(policy, reason, 429, 1, "Bu ağdan devam eden istek sayısı sınırda")
+                return _reject(policy, reason, 429, max(1, math.ceil(retry_after)), "Çok fazla istek, lütfen biraz bekleyin")
+
+            return _respond(view, _Release(policy, acquired), args, kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import threading
+
+# Üretim ve tarama çağrıları asyncio yolundan yapılır (0: eski thread'li yol)
+ASYNC_UPSTREAMS = os.getenv("ASYNC_UPSTREAMS", "1") == "1"
+
+# Upstream başına aynı anda uçuşta olabilecek en fazla istek
+UPSTREAM_CONCURRENCY = {
+    "replicate": int(os.getenv("REPLICATE_CONCURRENCY", "200")),
+    "gemini": int(os.getenv("GEMINI_CONCURRENCY", "50")),
+    "download": int(os.getenv("DOWNLOAD_CONCURRENCY", "50")),
+    "supabase": int(os.getenv("SUPABASE_CONCURRENCY", "20")),
+}
+
+
+class AsyncRuntime:
+    """Process başına arka plan thread'inde dönen tek event loop; Flask thread'leri coroutine'leri buraya gönderir"""
+
+    def __init__(self):
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def _ensure_loop(self):
+        # Fork sonrası parent'ın loop thread'i child'da yoktur, yeniden kurulur
+        if self._loop is None or self._pid != os.getpid():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid():
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name="async-runtime", daemon=True)
+                    thread.start()
+                    self._loop = loop
+                    self._pid = os.getpid()
+                    self._semaphores = {}
+        return self._loop
+
+    def submit(self, coro):
+        """Coroutine'i loop'a gönderir, concurrent.futures.Future döner"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run(self, coro, timeout=None):
+        """Coroutine'i loop'ta çalıştırıp sonucunu bekler (Flask view'larından çağrılır)"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def semaphore(self, upstream):
+        """Loop içinde çağrılır; upstream için eşzamanlılık sınırı"""
+        semaphore = self._semaphores.get(upstream)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(UPSTREAM_CONCURRENCY.get(upstream, 10))
+            self._semaphores[upstream] = semaphore
+        return semaphore
+
+
+runtime = AsyncRuntime()
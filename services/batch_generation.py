@@ -0,0 +1,148 @@
+import os
+import queue
+import threading
+import time
+
+from services.async_runtime import ASYNC_UPSTREAMS
+from services.generation import run_generation, run_generation_async
+from services.job_queue import QueueFullError, job_queue
+from services.user_images_writer import insert_user_images
+from services.metrics import log_event
+
+# Tek istekte en fazla kaç varyant ve bunlardan kaçı aynı anda ortak iş kuyruğunda olur
+BATCH_MAX_VARIANTS = int(os.getenv("BATCH_MAX_VARIANTS", "8"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "4"))
+
+
+class InvalidBatch(Exception):
+    pass
+
+
+def parse_variants(variants, default_output_format="jpg"):
+    """[{prompt, filters, output_format}] listesini doğrular ve temizler"""
+    if not isinstance(variants, list) or not variants:
+        raise InvalidBatch("variants boş olmayan bir liste olmalı")
+    if len(variants) > BATCH_MAX_VARIANTS:
+        raise InvalidBatch(f"En fazla {BATCH_MAX_VARIANTS} varyant gönderilebilir")
+
+    parsed = []
+    for index, variant in enumerate(variants):
+        if not isinstance(variant, dict):
+            raise InvalidBatch(f"variants[{index}] nesne olmalı")
+        prompt = (variant.get('prompt') or "").strip()
+        if not prompt:
+            raise InvalidBatch(f"variants[{index}].prompt gerekli")
+        parsed.append({
+            "prompt": prompt,
+            "filters": variant.get('filters') or {},
+            "output_format": variant.get('output_format', default_output_format)
+        })
+    return parsed
+
+
+def _submit(device_id, input_filename, variants, idempotency_key, index, rows, finished):
+    """Varyantı ortak iş kuyruğuna ekler; iş bitince index finished'e düşer. job_id ya da QueueFullError döner"""
+    variant = variants[index]
+    try:
+        return job_queue.submit(
+            device_id,
+            run_generation_async if ASYNC_UPSTREAMS else run_generation,
+            device_id,
+            input_filename,
+            variant["prompt"],
+            output_format=variant["output_format"],
+            filters=variant["filters"],
+            # Varyant başına ayrı kredi anahtarı; aynı toplu istek tekrar gelirse tekrar düşülmez
+            idempotency_key=f"{idempotency_key}:{index}" if idempotency_key else None,
+            on_row=lambda row: rows.add(index, row),
+            # Kuyruk doluysa on_done submit içinde, hata fırlamadan önce çağrılır
+            on_done=lambda: finished.put(index),
+            # Sadece süresi dolup job_id istemciye dönenler ortak depoya yazılır
+            shared=False
+        )
+    except QueueFullError as queue_error:
+        return queue_error
+
+
+class _Rows:
+    """Biten varyantların user_images satırları; toplu istek kapanınca tek insert'le yazılır,
+    sonra gelenler (süresi dolup arka planda bitenler) kendileri yazılır"""
+
+    def __init__(self, device_id):
+        self._device_id = device_id
+        self._rows = {}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def add(self, index, row):
+        with self._lock:
+            if not self._closed:
+                self._rows[index] = row
+                return
+        insert_user_images(self._device_id, [row])
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            rows = [row for index, row in sorted(self._rows.items())]
+        insert_user_images(self._device_id, rows)
+
+
+def _outcome(index, submitted):
+    if isinstance(submitted, QueueFullError):
+        return {"index": index, "status": "failed", "error": str(submitted), "status_code": 503}
+    job = job_queue.get(submitted)
+    if job["status"] == "succeeded":
+        return {"index": index, "status": "succeeded", **job["result"]}
+    return {"index": index, "status": "failed", "error": job["error"], "status_code": job["error_status"]}
+
+
+def run_batch(device_id, input_filename, variants, idempotency_key=None, timeout=None):
+    """Varyantları ortak iş kuyruğunda, aynı anda en fazla BATCH_PARALLELISM tanesi olacak şekilde üretir;
+    biten her sonucu sırayla yield eder. user_images satırları tek insert'le yazılır."""
+    rows = _Rows(device_id)
+    finished = queue.SimpleQueue()
+    submitted = {}
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def submit_next():
+        index = len(submitted)
+        if index < len(variants):
+            submitted[index] = _submit(device_id, input_filename, variants, idempotency_key, index, rows, finished)
+
+    for _ in range(min(BATCH_PARALLELISM, len(variants))):
+        submit_next()
+
+    succeeded = failed = 0
+    reported = set()
+    try:
+        while len(reported) < len(variants):
+            try:
+                index = finished.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            outcome = _outcome(index, submitted[index])
+            reported.add(index)
+            if outcome["status"] == "succeeded":
+                succeeded += 1
+            else:
+                failed += 1
+            yield outcome
+            submit_next()
+
+        # Süresi dolanlar arka planda sürer; job_id ile sorgulanabilir, sonuçları önbelleğe düşer.
+        # Hiç başlamayanlar çalıştırılmaz (kredi düşülmedi), tekrar istekle üretilebilir.
+        for index in range(len(variants)):
+            if index in reported:
+                continue
+            if index in submitted:
+                job_queue.share(submitted[index])
+                yield {"index": index, "status": "timeout", "job_id": submitted[index]}
+            else:
+                yield {"index": index, "status": "not_started"}
+    finally:
+        rows.close()
+        pending = len(variants) - len(reported)
+        log_event("batch_finished", device_id=device_id, variants=len(variants), succeeded=succeeded, failed=failed, pending=pending)
+
+    yield {"done": True, "succeeded": succeeded, "failed": failed, "pending": pending}
@@ -0,0 +1,87 @@
+import os
+
+from supabase_client.supabase_client import get_supabase_client
+from services.user_lookup import invalidate_user
+
+supabase = get_supabase_client()
+
+# Her change-hair üretiminin düştüğü kredi (0 verilirse kredi düşülmez)
+GENERATION_CREDIT_COST = int(os.getenv("GENERATION_CREDIT_COST", "1"))
+
+# Subscription type'a göre credit belirleme
+PREMIUM_CREDIT_MAPPING = {
+    'yearly': 250,
+    'monthly': 150,
+    'weekly': 50
+}
+
+RENEW_CREDIT_MAPPING = {
+    'yearly': 500,
+    'monthly': 250,
+    'weekly': 50
+}
+
+# Fonksiyonlar supabase/migrations altındaki SQL'de tanımlı; her biri tek round-trip ve atomik
+
+
+def _call(function_name, params, device_id, invalidate=True):
+    # Anahtarlar cihaz bazında ayrılır, başka cihazın sonucu dönmesin
+    if params.get("p_idempotency_key"):
+        params["p_idempotency_key"] = f"{device_id}:{params['p_idempotency_key']}"
+
+    response = supabase.rpc(function_name, params).execute()
+    if invalidate:
+        invalidate_user(device_id)
+    return response.data or {}
+
+
+def activate_premium(device_id, subscription_type, subscription_expiration, last_token_renewal_time, credits, idempotency_key=None):
+    """Premium'a geçiş; status: ok / not_found / already_premium"""
+    return _call("activate_premium", {
+        "p_device_id": device_id,
+        "p_subscription_type": subscription_type,
+        "p_subscription_expiration": subscription_expiration,
+        "p_last_token_renewal_time": last_token_renewal_time,
+        "p_credits": credits,
+        "p_idempotency_key": idempotency_key
+    }, device_id)
+
+
+def renew_premium_credits(device_id, latest_purchase_date, subscription_expiration, idempotency_key=None):
+    """Yenileme; status: ok / not_found / not_premium / already_renewed / invalid_subscription_type"""
+    return _call("renew_premium_credits", {
+        "p_device_id": device_id,
+        "p_latest_purchase_date": latest_purchase_date,
+        "p_subscription_expiration": subscription_expiration,
+        "p_credit_mapping": RENEW_CREDIT_MAPPING,
+        "p_idempotency_key": idempotency_key
+    }, device_id)
+
+
+def consume_credits(device_id, idempotency_key, amount=GENERATION_CREDIT_COST, fingerprint=None):
+    """Kredi düşer; status: ok / not_found / insufficient_credits / conflict.
+    Aynı anahtar aynı parmak iziyle tekrar gelirse replayed=True ve varsa kayıtlı result döner"""
+    return _call("consume_credits", {
+        "p_device_id": device_id,
+        "p_amount": amount,
+        "p_idempotency_key": idempotency_key,
+        "p_fingerprint": fingerprint
+    }, device_id)
+
+
+def complete_credit_operation(device_id, idempotency_key, result):
+    """Başarılı üretimin sonucunu anahtara yazar; bundan sonra iade edilmez"""
+    return _call("complete_credit_operation", {
+        "p_device_id": device_id,
+        "p_idempotency_key": idempotency_key,
+        "p_result": result
+    }, device_id, invalidate=False)
+
+
+def refund_credits(device_id, consume_key, amount=GENERATION_CREDIT_COST):
+    """consume_key ile düşülen krediyi iade eder; ikinci iade bir şey yapmaz"""
+    return _call("refund_credits", {
+        "p_device_id": device_id,
+        "p_amount": amount,
+        "p_consume_key": f"{device_id}:{consume_key}"
+    }, device_id)
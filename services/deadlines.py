@@ -0,0 +1,24 @@
+import time
+
+from flask import current_app, g, has_request_context, request
+
+DEFAULT_ROUTE_TIMEOUT = 30
+
+
+def route_timeout(endpoint=None):
+    """Endpoint için app.config['ROUTE_TIMEOUTS']'ta tanımlı süre (saniye)"""
+    timeouts = current_app.config.get("ROUTE_TIMEOUTS", {})
+    endpoint = endpoint or request.endpoint
+    return timeouts.get(endpoint, timeouts.get("default", DEFAULT_ROUTE_TIMEOUT))
+
+
+def start_request_deadline():
+    """before_request: isteğin bitmesi gereken anı g'ye yazar"""
+    g.request_deadline = time.monotonic() + route_timeout()
+
+
+def remaining(default=None):
+    """İsteğin kalan süresi; istek dışında (arka plan işi) default döner"""
+    if not has_request_context() or "request_deadline" not in g:
+        return default
+    return max(0.0, g.request_deadline - time.monotonic())
@@ -0,0 +1,166 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from services.image_pipeline import FORMAT_EXTENSIONS, load_image
+from services.metrics import log_event, span
+from services.storage import DiskCache, is_valid_name, storage
+
+# İzin verilen genişlikler; istenen genişlik bir üsttekine yuvarlanır (önbellekte sınırlı sayıda kopya olur)
+DERIVATIVE_WIDTHS = sorted(int(width) for width in os.getenv("DERIVATIVE_WIDTHS", "128,256,512,1024").split(",") if width.strip())
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+DERIVATIVE_CACHE_DIR = os.getenv("DERIVATIVE_CACHE_DIR", "derivative_cache")
+DERIVATIVE_CACHE_MAX_BYTES = int(os.getenv("DERIVATIVE_CACHE_MAX_BYTES", str(512 * 1024 ** 2)))
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+# Galeri ızgarasında kullanılan küçük resim
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", "256"))
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "webp")
+# Çıktı kaydedilince arka planda hazırlanan boyutlar ("genişlik:format", virgülle ayrılmış);
+# boşsa türevler sadece ilk istekte üretilir
+DERIVATIVE_PREGENERATE = os.getenv("DERIVATIVE_PREGENERATE", f"{THUMBNAIL_WIDTH}:{THUMBNAIL_FORMAT}")
+# Örn. "/protected-derivatives/": DERIVATIVE_CACHE_DIR'i gösteren nginx internal location'ı
+DERIVATIVE_ACCEL_REDIRECT_PREFIX = os.getenv("DERIVATIVE_ACCEL_REDIRECT_PREFIX")
+
+# fmt parametresi -> Pillow formatı; fmt verilmezse JPEG
+DERIVATIVE_FORMATS = {"webp": "WEBP", "jpg": "JPEG", "jpeg": "JPEG", "png": "PNG"}
+# Sadece format değişiminde boyut korunur; bu değer JPEG draft küçültmesini etkisiz bırakır
+_FULL_SIZE = 1 << 16
+
+cache = DiskCache(DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_MAX_BYTES)
+
+# Aynı türevi aynı anda isteyenler tek render'ı bekler
+_render_locks = {}
+_render_guard = threading.Lock()
+_executor = None
+_executor_pid = None
+
+
+class InvalidDerivative(Exception):
+    pass
+
+
+def parse_size(width, fmt):
+    """?w=&fmt= değerlerinden (genişlik, Pillow formatı); ikisi de yoksa None (orijinal istenmiş)"""
+    if not width and not fmt:
+        return None
+
+    if width:
+        try:
+            width = int(width)
+        except ValueError:
+            raise InvalidDerivative("w sayı olmalı")
+        if width <= 0:
+            raise InvalidDerivative("w pozitif olmalı")
+        width = next((allowed for allowed in DERIVATIVE_WIDTHS if allowed >= width), DERIVATIVE_WIDTHS[-1])
+    else:
+        width = None
+
+    image_format = DERIVATIVE_FORMATS.get((fmt or "jpg").lower())
+    if image_format is None:
+        raise InvalidDerivative(f"fmt şunlardan biri olmalı: {', '.join(DERIVATIVE_FORMATS)}")
+    return width, image_format
+
+
+def derivative_name(name, width, image_format):
+    """Örn. abc.jpg -> abc.jpg.256w.webp (purge için orijinal adla başlar)"""
+    return f"{name}.{f'{width}w' if width else 'full'}.{FORMAT_EXTENSIONS[image_format]}"
+
+
+def render(image_bytes, width, image_format, quality=DERIVATIVE_QUALITY):
+    """Resmi genişliğe göre küçültüp (büyütmeden) istenen formatta kodlar"""
+    from PIL import Image
+
+    image = load_image(image_bytes, width or _FULL_SIZE)
+    if width and image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        # Önce tam sayı katlarıyla hızlı küçült, kalanını LANCZOS ile yap
+        factor = image.width // (width * 2)
+        if factor > 1:
+            image = image.reduce(factor)
+        image = image.resize((width, height), Image.LANCZOS)
+
+    output = BytesIO()
+    if image_format == "PNG":
+        image.save(output, format="PNG", optimize=True)
+    else:
+        image.save(output, format=image_format, quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def derivative_path(name, width, image_format):
+    """Türevin disk yolu; önbellekte yoksa orijinalden üretilir, orijinal yoksa None"""
+    if not is_valid_name(name):
+        return None
+
+    key = derivative_name(name, width, image_format)
+    path = cache.get(key)
+    if path is not None:
+        return path
+
+    with _render_guard:
+        lock = _render_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            # Beklerken başka bir thread üretmiş olabilir
+            path = cache.get(key)
+            if path is not None:
+                return path
+
+            source_path = storage.local_path(name)
+            if source_path is None:
+                return None
+            with span("view_image", "derivative_render", width=width, format=image_format):
+                data = render(Path(source_path).read_bytes(), width, image_format)
+            return cache.put_bytes(key, data)
+    finally:
+        with _render_guard:
+            _render_locks.pop(key, None)
+
+
+def _parse_specs(raw):
+    specs = []
+    for item in raw.split(","):
+        width, _, fmt = item.strip().partition(":")
+        if width:
+            specs.append(parse_size(width, fmt))
+    return specs
+
+
+PREGENERATE_SPECS = _parse_specs(DERIVATIVE_PREGENERATE)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    # Fork sonrası parent'ın thread'leri child'a geçmez
+    if _executor is None or _executor_pid != os.getpid():
+        with _render_guard:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS, thread_name_prefix="derivative")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _pregenerate(name):
+    for width, image_format in PREGENERATE_SPECS:
+        try:
+            derivative_path(name, width, image_format)
+        except Exception as e:
+            log_event("derivative_failed", name=name, width=width, format=image_format, error=str(e))
+
+
+def schedule_derivatives(name):
+    """Yeni kaydedilen resmin sık istenen boyutlarını arka planda hazırlar (galeri ilk açılışta beklemesin)"""
+    if PREGENERATE_SPECS:
+        _get_executor().submit(_pregenerate, name)
+
+
+def purge_derivatives(names):
+    """Silinen orijinallerin türevlerini önbellekten kaldırır"""
+    prefixes = tuple(f"{name}." for name in names)
+    if not prefixes:
+        return
+    with os.scandir(cache.directory) as entries:
+        stale = [entry.name for entry in entries if entry.name.startswith(prefixes)]
+    cache.remove(stale)
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import threading
+import uuid
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+DOWNLOAD_POOL_SIZE = int(os.getenv("DOWNLOAD_POOL_SIZE", "20"))
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "5"))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "60"))
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class DownloadError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        # 429/5xx ise upstream katmanı tekrar dener
+        self.status_code = status_code
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process başına tek, keep-alive bağlantı havuzlu requests.Session"""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+                _session_pid = os.getpid()
+    return _session
+
+
+def download_to_file(url, target_path, max_bytes=DOWNLOAD_MAX_BYTES):
+    """url'i parça parça geçici dosyaya indirir, bitince target_path'e atomik taşır"""
+    target_path = os.fspath(target_path)
+    tmp_path = os.path.join(os.path.dirname(target_path), f".{uuid.uuid4().hex}.part")
+
+    try:
+        with get_session().get(url, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)) as response:
+            if response.status_code != 200:
+                raise DownloadError(f"Beklenmeyen durum kodu: {response.status_code}", response.status_code)
+
+            content_length = response.headers.get("Content-Length")
+            if content_length and int(content_length) > max_bytes:
+                raise DownloadError("Görsel boyutu sınırı aşıyor")
+
+            written = 0
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > max_bytes:
+                        raise DownloadError("Görsel boyutu sınırı aşıyor")
+                    f.write(chunk)
+
+        os.replace(tmp_path, target_path)
+        return written
+    except requests.RequestException as e:
+        raise DownloadError(str(e)) from e
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+_async_client = None
+_async_client_loop = None
+
+
+def _get_async_client():
+    """Çalışan event loop'a bağlı, havuzlu httpx.AsyncClient (loop değişirse yeniden kurulur)"""
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=DOWNLOAD_POOL_SIZE, max_keepalive_connections=DOWNLOAD_POOL_SIZE),
+            timeout=httpx.Timeout(DOWNLOAD_READ_TIMEOUT, connect=DOWNLOAD_CONNECT_TIMEOUT),
+            follow_redirects=True
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+async def download_to_file_async(url, target_path, max_bytes=DOWNLOAD_MAX_BYTES):
+    """download_to_file'ın asyncio sürümü"""
+    target_path = os.fspath(target_path)
+    tmp_path = os.path.join(os.path.dirname(target_path), f".{uuid.uuid4().hex}.part")
+
+    try:
+        async with _get_async_client().stream("GET", url) as response:
+            if response.status_code != 200:
+                raise DownloadError(f"Beklenmeyen durum kodu: {response.status_code}", response.status_code)
+
+            content_length = response.headers.get("Content-Length")
+            if content_length and int(content_length) > max_bytes:
+                raise DownloadError("Görsel boyutu sınırı aşıyor")
+
+            written = 0
+            with open(tmp_path, "wb") as f:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > max_bytes:
+                        raise DownloadError("Görsel boyutu sınırı aşıyor")
+                    f.write(chunk)
+
+        os.replace(tmp_path, target_path)
+        return written
+    except httpx.HTTPError as e:
+        raise DownloadError(str(e)) from e
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+from services.cache import TTLCache
+from services.metrics import log_event
+
+FACE_CACHE_SIZE = int(os.getenv("FACE_CACHE_SIZE", "4096"))
+FACE_CACHE_TTL = int(os.getenv("FACE_CACHE_TTL", str(7 * 24 * 3600)))
+# Verilirse sonuçlar diskte de tutulur (worker'lar ve yeniden başlatmalar arasında paylaşılır)
+FACE_CACHE_DIR = os.getenv("FACE_CACHE_DIR")
+
+_memory_cache = TTLCache(maxsize=FACE_CACHE_SIZE, ttl=FACE_CACHE_TTL)
+
+
+def analysis_key(image_bytes, variant):
+    """Resim + sonucu etkileyen ayarlar (model, katalog sürümü...); ayar değişince eski sonuçlar kullanılmaz"""
+    return hashlib.sha256(f"{variant}\n".encode("utf-8") + image_bytes).hexdigest()
+
+
+class DiskCache:
+    """Her anahtar için bir JSON dosyası tutan basit kalıcı önbellek"""
+
+    def __init__(self, directory, ttl):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+
+    def _path(self, key):
+        return self.directory / f"{key}.json"
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp_path = self.directory / f".{key}.{uuid.uuid4().hex}.tmp"
+        try:
+            tmp_path.write_text(json.dumps(value, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log_event("face_cache_write_failed", error=str(e))
+
+
+_disk_cache = DiskCache(FACE_CACHE_DIR, FACE_CACHE_TTL) if FACE_CACHE_DIR else None
+
+
+def get_analysis(key):
+    """Önce bellekte, sonra diskte önceki yüz analizi sonucunu arar"""
+    result = _memory_cache.get(key)
+    if result is None and _disk_cache:
+        result = _disk_cache.get(key)
+        if result is not None:
+            _memory_cache.set(key, result)
+    return result
+
+
+def set_analysis(key, result):
+    _memory_cache.set(key, result)
+    if _disk_cache:
+        _disk_cache.set(key, result)
@@ -0,0 +1,509 @@
+import asyncio
+import base64
+import hashlib
+import inspect
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from supabase_client.supabase_client import get_supabase_client
+from services.cache import TTLCache
+from services.downloader import DownloadError, download_to_file, download_to_file_async
+from services import upstream
+from services.upstream import CircuitOpenError, UpstreamError
+from services.async_runtime import runtime
+from services.metrics import log_event, span
+from services.user_images_writer import insert_user_images
+from services.credits import GENERATION_CREDIT_COST, complete_credit_operation, consume_credits, refund_credits
+from services.image_pipeline import FORMAT_EXTENSIONS, FORMAT_MIMETYPES, IMAGE_FORMAT, normalize_image
+from services.storage import storage
+from services.image_urls import derivative_url, resign_url, signed_view_image_url, view_image_url
+from services.derivatives import THUMBNAIL_FORMAT, THUMBNAIL_WIDTH, schedule_derivatives
+
+supabase = get_supabase_client()
+
+MODEL_NAME = "black-forest-labs/flux-kontext-pro"
+
+# Aynı resim + prompt + filtreler için önceki sonucu tekrar kullan
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "2048"))
+GENERATION_CACHE_TTL = int(os.getenv("GENERATION_CACHE_TTL", str(24 * 3600)))
+
+_generation_cache = TTLCache(maxsize=GENERATION_CACHE_SIZE, ttl=GENERATION_CACHE_TTL)
+# Aynı anda gelen çift tıklamalar tek model çağrısında birleşir
+_inflight_locks = {}
+_inflight_guard = threading.Lock()
+# Async yolda aynı iş: anahtar -> asyncio.Future (sadece runtime loop'unda erişilir)
+_async_inflight = {}
+
+# Resmin modele nasıl verileceği: "url" (imzalı view-image URL'i, model bizden çeker),
+# "inline" (base64 data URI, ek istek yok), "file" (Replicate dosya API'sine yüklenir)
+MODEL_IMAGE_INPUT = os.getenv("MODEL_IMAGE_INPUT", "url")
+# Bundan büyük resimler inline yerine dosya olarak yüklenir
+MODEL_INLINE_MAX_BYTES = int(os.getenv("MODEL_INLINE_MAX_BYTES", str(1024 * 1024)))
+UPLOAD_PERSIST_WORKERS = int(os.getenv("UPLOAD_PERSIST_WORKERS", "4"))
+
+# Doğrudan modda kalıcı kopya arka planda yazılır: dosya adı -> (byte'lar, content-type, Future)
+_pending_uploads = {}
+_pending_guard = threading.Lock()
+_persist_executor = None
+_persist_executor_pid = None
+
+
+class GenerationError(Exception):
+    """Üretim adımlarında kullanıcıya dönecek hata (mesaj + HTTP kodu)"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _upstream_failure(error):
+    """Upstream katmanının hatasını kullanıcıya dönecek GenerationError'a çevirir"""
+    log_event("upstream_failed", upstream=error.upstream, error=str(error))
+    if isinstance(error, CircuitOpenError):
+        return GenerationError("Görsel servisi şu anda yanıt vermiyor, lütfen biraz sonra tekrar deneyin", 503)
+    return GenerationError("Görsel servisi zamanında yanıt vermedi", 504)
+
+
+def _replicate_predictor(model, model_input):
+    # replicate ağır bir import; ilk üretimde yüklenir
+    import replicate
+
+    return replicate.run(model, input=model_input)
+
+
+# Testlerde/yerelde Replicate yerine sahte bir predictor takılabilir
+_predictor = _replicate_predictor
+
+
+def set_predictor(predictor):
+    """predictor(model, input) -> çıktı URL'i imzalı fonksiyonu ayarlar, None verilirse Replicate'e döner"""
+    global _predictor
+    _predictor = predictor or _replicate_predictor
+
+
+async def _predict_async(model, model_input):
+    if _predictor is _replicate_predictor:
+        import replicate
+
+        return await replicate.async_run(model, input=model_input)
+    if inspect.iscoroutinefunction(_predictor):
+        return await _predictor(model, model_input)
+    return await asyncio.to_thread(_predictor, model, model_input)
+
+
+def save_upload(image):
+    """Gelen resmi içerik hash'iyle, normalize edilmiş olarak kaydeder; aynı byte'lar tek kez işlenir.
+    MODEL_IMAGE_INPUT url değilse kayıt arka planda yapılır, model byte'ları bellekten alır."""
+    image_bytes = image.read()
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    input_filename = f"{image_hash}.{FORMAT_EXTENSIONS[IMAGE_FORMAT]}"
+
+    # Arka planda yazılmakta olan aynı resim tekrar işlenmez; kayıtlı olanın son kullanımı
+    # yenilenir ki GC kullanımdaki girdiyi silmesin
+    if input_filename in _pending_uploads or storage.touch(input_filename):
+        return input_filename
+
+    from PIL import UnidentifiedImageError
+
+    try:
+        normalized_bytes, image_format = normalize_image(image_bytes)
+    except (UnidentifiedImageError, OSError):
+        raise GenerationError("Geçersiz resim dosyası", 400)
+
+    content_type = FORMAT_MIMETYPES[image_format]
+    if MODEL_IMAGE_INPUT == "url":
+        # Model resmi URL'den çekeceği için kayıt tamamlanmış olmalı
+        storage.put_bytes(input_filename, normalized_bytes, content_type)
+    else:
+        _persist_in_background(input_filename, normalized_bytes, content_type)
+
+    return input_filename
+
+
+def _get_persist_executor():
+    global _persist_executor, _persist_executor_pid
+    # Fork sonrası parent'ın thread'leri child'a geçmez
+    if _persist_executor is None or _persist_executor_pid != os.getpid():
+        with _pending_guard:
+            if _persist_executor is None or _persist_executor_pid != os.getpid():
+                _persist_executor = ThreadPoolExecutor(max_workers=UPLOAD_PERSIST_WORKERS, thread_name_prefix="persist")
+                _persist_executor_pid = os.getpid()
+    return _persist_executor
+
+
+def _persist_in_background(input_filename, image_bytes, content_type):
+    # Havuz _pending_guard ile kurulur; kilit alınmadan önce hazırlanmalı
+    executor = _get_persist_executor()
+    with _pending_guard:
+        if input_filename in _pending_uploads:
+            return
+        future = executor.submit(storage.put_bytes, input_filename, image_bytes, content_type)
+        pending = _pending_uploads[input_filename] = (image_bytes, content_type, future)
+
+    def done(f):
+        if f.exception():
+            # Byte'lar bellekte kalır; üretim _wait_persisted'da bir kez daha dener
+            log_event("upload_persist_failed", filename=input_filename, error=str(f.exception()))
+            return
+        # Byte'lar storage'a yazılana kadar bellekte tutulur, sonra oradan okunur
+        _forget_pending(input_filename, pending)
+    future.add_done_callback(done)
+
+
+def _forget_pending(input_filename, pending):
+    with _pending_guard:
+        if _pending_uploads.get(input_filename) is pending:
+            del _pending_uploads[input_filename]
+
+
+def _wait_persisted(input_filename):
+    """Arka planda yazılan girdi resmi bitene kadar bekler (user_images satırı ondan sonra yazılır).
+    Yazılamadıysa bir kez daha dener; yine olmazsa üretim başarısız olur, kredi iade edilir."""
+    with _pending_guard:
+        pending = _pending_uploads.get(input_filename)
+    if not pending:
+        return
+
+    image_bytes, content_type, future = pending
+    if future.exception() is None:
+        return
+    try:
+        storage.put_bytes(input_filename, image_bytes, content_type)
+    except Exception as e:
+        log_event("upload_persist_failed", filename=input_filename, error=str(e), retry=True)
+        raise GenerationError("Yüklenen resim kaydedilemedi, lütfen tekrar deneyin", 503)
+    finally:
+        # Başarısızsa aynı resim tekrar gönderildiğinde save_upload baştan yazar
+        _forget_pending(input_filename, pending)
+
+
+def _model_image(input_filename, device_id):
+    """Modelin input_image alanı: imzalı URL, data URI ya da yüklenecek dosya"""
+    if MODEL_IMAGE_INPUT == "url":
+        return signed_view_image_url(input_filename, device_id)
+
+    with _pending_guard:
+        pending = _pending_uploads.get(input_filename)
+    if pending:
+        image_bytes = pending[0]
+    else:
+        image_path = storage.local_path(input_filename)
+        if image_path is None:
+            return signed_view_image_url(input_filename, device_id)
+        image_bytes = image_path.read_bytes()
+
+    if MODEL_IMAGE_INPUT == "inline" and len(image_bytes) <= MODEL_INLINE_MAX_BYTES:
+        content_type = FORMAT_MIMETYPES[IMAGE_FORMAT]
+        return f"data:{content_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+    # replicate client dosya nesnelerini kendi dosya API'sine yükleyip URL'ini verir
+    image_file = BytesIO(image_bytes)
+    image_file.name = input_filename
+    return image_file
+
+
+def _output_content_type(output_format):
+    return FORMAT_MIMETYPES.get(output_format.upper().replace("JPG", "JPEG"))
+
+
+def _store_output(output_filename, staging_path, output_format):
+    """İndirilen çıktıyı storage'a taşır; başarısız olursa geçici dosya silinir"""
+    try:
+        with span("change_hair", "storage_put"):
+            storage.put_file(output_filename, staging_path, _output_content_type(output_format))
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+    # Galeri küçük resmi arka planda hazırlanır; girdi resimlerininki ilk istekte üretilir
+    schedule_derivatives(output_filename)
+
+
+def _generation_key(device_id, input_filename, prompt, output_format, filters):
+    return (device_id, input_filename, prompt, output_format, json.dumps(filters, sort_keys=True))
+
+
+def _fingerprint(key):
+    """Idempotency key ile saklanır; aynı anahtarla farklı istek gelirse 409 döner"""
+    return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def _response(result, cached):
+    """Önbellekte kalıcı adresler tutulur; istemciye her seferinde taze imzalı adresler döner"""
+    output_image_url = resign_url(result["output_image_url"])
+    return dict(
+        result,
+        input_image_url=resign_url(result["input_image_url"]),
+        output_image_url=output_image_url,
+        output_thumbnail_url=derivative_url(output_image_url, THUMBNAIL_WIDTH, THUMBNAIL_FORMAT),
+        cached=cached
+    )
+
+
+def _inflight_lock(key):
+    with _inflight_guard:
+        return _inflight_locks.setdefault(key, threading.Lock())
+
+
+def run_generation(device_id, input_filename, prompt, output_format="jpg", filters=None, progress=None, idempotency_key=None, on_row=None):
+    """Aynı istek için önbellekteki sonucu döner, yoksa kredi düşüp modeli çalıştırır"""
+    filters = filters or {}
+    key = _generation_key(device_id, input_filename, prompt, output_format, filters)
+
+    cached = _generation_cache.get(key)
+    if cached:
+        return _response(cached, cached=True)
+
+    lock = _inflight_lock(key)
+    with lock:
+        # Beklerken aynı istek tamamlanmış olabilir
+        cached = _generation_cache.get(key)
+        if cached:
+            return _response(cached, cached=True)
+
+        try:
+            charge_key, replayed = _charge_credits(device_id, idempotency_key, _fingerprint(key))
+            if replayed:
+                _generation_cache.set(key, replayed)
+                return _response(replayed, cached=True)
+            try:
+                result = _generate(device_id, input_filename, prompt, output_format, filters, progress, on_row)
+            except Exception:
+                _refund_credits(device_id, charge_key)
+                raise
+            _complete_charge(device_id, charge_key, result)
+            _generation_cache.set(key, result)
+        finally:
+            with _inflight_guard:
+                _inflight_locks.pop(key, None)
+
+        return _response(result, cached=False)
+
+
+async def run_generation_async(device_id, input_filename, prompt, output_format="jpg", filters=None, progress=None, idempotency_key=None, on_row=None):
+    """run_generation'ın asyncio sürümü: runtime loop'unda yüzlerce üretim aynı anda uçuşta olabilir"""
+    filters = filters or {}
+    key = _generation_key(device_id, input_filename, prompt, output_format, filters)
+
+    cached = _generation_cache.get(key)
+    if cached:
+        return _response(cached, cached=True)
+
+    # Aynı istek zaten uçuştaysa onun sonucunu bekle
+    inflight = _async_inflight.get(key)
+    if inflight is not None:
+        result = await asyncio.shield(inflight)
+        return _response(result, cached=True)
+
+    inflight = asyncio.get_running_loop().create_future()
+    _async_inflight[key] = inflight
+    try:
+        async with runtime.semaphore("supabase"):
+            charge_key, replayed = await asyncio.to_thread(_charge_credits, device_id, idempotency_key, _fingerprint(key))
+        if replayed:
+            _generation_cache.set(key, replayed)
+            inflight.set_result(replayed)
+            return _response(replayed, cached=True)
+        try:
+            result = await _generate_async(device_id, input_filename, prompt, output_format, filters, progress, on_row)
+        except Exception:
+            async with runtime.semaphore("supabase"):
+                await asyncio.to_thread(_refund_credits, device_id, charge_key)
+            raise
+        async with runtime.semaphore("supabase"):
+            await asyncio.to_thread(_complete_charge, device_id, charge_key, result)
+        _generation_cache.set(key, result)
+        inflight.set_result(result)
+        return _response(result, cached=False)
+    except asyncio.CancelledError:
+        inflight.cancel()
+        raise
+    except Exception as e:
+        inflight.set_exception(e)
+        # Bekleyen yoksa "exception never retrieved" uyarısı çıkmasın
+        inflight.exception()
+        raise
+    finally:
+        _async_inflight.pop(key, None)
+
+
+def _charge_credits(device_id, idempotency_key, fingerprint):
+    """Üretim öncesi krediyi atomik olarak düşer; aynı idempotency key ikinci kez düşmez.
+    (charge_key, None) ya da tekrarlanan istek için (None, ilk üretimin sonucu) döner."""
+    if GENERATION_CREDIT_COST <= 0:
+        return None, None
+
+    charge_key = f"{idempotency_key or uuid.uuid4()}:consume"
+    result = consume_credits(device_id, charge_key, fingerprint=fingerprint)
+
+    if result.get('status') == 'conflict':
+        raise GenerationError("Bu idempotency key farklı bir istek için kullanılmış", 409)
+    if result.get('status') == 'insufficient_credits':
+        raise GenerationError("Yetersiz kredi", 402)
+    if result.get('status') != 'ok':
+        raise GenerationError("Geçersiz device_id. Lütfen önce kayıt olun.", 403)
+    if result.get('replayed'):
+        # Bu çağrı kredi düşmedi; iade edilecek bir şey yok
+        if not result.get('result'):
+            raise GenerationError("Aynı istek hâlâ işleniyor, lütfen biraz sonra tekrar deneyin", 409)
+        return None, result['result']
+    return charge_key, None
+
+
+def _complete_charge(device_id, charge_key, result):
+    """Sonuç anahtara yazılır; tekrar gelen istek yeniden üretmek yerine bunu alır"""
+    if not charge_key:
+        return
+    try:
+        complete_credit_operation(device_id, charge_key, result)
+    except Exception as complete_error:
+        log_event("credit_complete_failed", device_id=device_id, error=str(complete_error))
+
+
+def _refund_credits(device_id, charge_key):
+    if not charge_key:
+        return
+    try:
+        refund_credits(device_id, charge_key)
+    except Exception as refund_error:
+        log_event("credit_refund_failed", device_id=device_id, error=str(refund_error))
+
+
+def _model_input(input_image, prompt, output_format):
+    return {
+        "prompt": prompt,
+        "input_image": input_image,
+        "output_format": output_format
+    }
+
+
+def _output_url(output):
+    # Output'u kontrol et ve URL'e çevir
+    output_url = str(output) if output else None
+
+    if not output_url:
+        raise GenerationError("Model çıktısı alınamadı")
+    return output_url
+
+
+def _user_image_row(device_id, input_image_url, output_image_url, prompt, filters):
+    return {
+        "device_id": device_id,
+        "user_image": input_image_url,  # Kullanıcının yüklediği resmin URL'i
+        "generated_image": output_image_url,  # Oluşturulan resmin URL'i
+        "prompt": prompt,
+        "gender": filters.get('gender'),
+        "haircut_style": filters.get('haircut_style'),
+        "hair_color": filters.get('hair_color')
+    }
+
+
+def _generate(device_id, input_filename, prompt, output_format, filters, progress, on_row=None):
+    """Replicate modelini çalıştırır, çıktıyı indirir, kaydeder ve user_images'a yazar"""
+    def report(stage):
+        if progress:
+            progress(stage)
+
+    # View-image endpoint'i üzerinden resim URL'i oluştur
+    input_image_url = view_image_url(input_filename, device_id)
+
+    # Replicate modelini çalıştır; resim imzalı URL'den çekilir ya da isteğin içinde gider
+    report("generating")
+    model_input = _model_input(_model_image(input_filename, device_id), prompt, output_format)
+    try:
+        with span("change_hair", "replicate_run"):
+            # Tahmin oluşturmak idempotent değil: tekrar denenmez, sadece süre sınırı ve devre kesici
+            output = upstream.call("replicate", _predictor, MODEL_NAME, model_input, idempotent=False)
+    except UpstreamError as upstream_error:
+        raise _upstream_failure(upstream_error)
+    output_url = _output_url(output)
+
+    # Oluşturulan görsel için rastgele dosya adı oluştur (output_format'a göre uzantı)
+    output_filename = f"{uuid.uuid4()}.{output_format}"
+    staging_path = storage.staging_path(f".{output_format}")
+
+    # Oluşturulan görseli doğrudan diske indir (bellekte tamponlamadan), sonra storage'a taşı
+    report("downloading")
+    try:
+        with span("change_hair", "download"):
+            upstream.call("download", download_to_file, output_url, staging_path)
+    except UpstreamError as upstream_error:
+        raise _upstream_failure(upstream_error)
+    except DownloadError as download_error:
+        log_event("download_failed", url=output_url, error=str(download_error))
+        raise GenerationError("Görsel indirilemedi")
+    _store_output(output_filename, staging_path, output_format)
+
+    # Oluşturulan görselin URL'ini oluştur
+    output_image_url = view_image_url(output_filename, device_id)
+    _wait_persisted(input_filename)
+    row = _user_image_row(device_id, input_image_url, output_image_url, prompt, filters)
+    # Toplu üretimde satır çağırana verilir, hepsi tek insert'te yazılır
+    if on_row:
+        on_row(row)
+    else:
+        insert_user_images(device_id, [row])
+
+    return {
+        "input_image_url": input_image_url,
+        "output_image_url": output_image_url,
+        "original_output_url": output_url
+    }
+
+
+async def _generate_async(device_id, input_filename, prompt, output_format, filters, progress, on_row=None):
+    """_generate'in asyncio sürümü; her upstream kendi semaphore'u ile sınırlanır"""
+    def report(stage):
+        if progress:
+            progress(stage)
+
+    input_image_url = view_image_url(input_filename, device_id)
+
+    report("generating")
+    # Disk okuması loop'u bloklamasın
+    model_image = await asyncio.to_thread(_model_image, input_filename, device_id)
+    model_input = _model_input(model_image, prompt, output_format)
+    try:
+        async with runtime.semaphore("replicate"):
+            with span("change_hair", "replicate_run"):
+                output = await upstream.call_async("replicate", lambda: _predict_async(MODEL_NAME, model_input), idempotent=False)
+    except UpstreamError as upstream_error:
+        raise _upstream_failure(upstream_error)
+    output_url = _output_url(output)
+
+    output_filename = f"{uuid.uuid4()}.{output_format}"
+    staging_path = storage.staging_path(f".{output_format}")
+
+    report("downloading")
+    try:
+        async with runtime.semaphore("download"):
+            with span("change_hair", "download"):
+                await upstream.call_async("download", lambda: download_to_file_async(output_url, staging_path))
+    except UpstreamError as upstream_error:
+        raise _upstream_failure(upstream_error)
+    except DownloadError as download_error:
+        log_event("download_failed", url=output_url, error=str(download_error))
+        raise GenerationError("Görsel indirilemedi")
+    # Uzak backend'e yükleme bloklayıcı; loop'u tutmasın
+    async with runtime.semaphore("supabase"):
+        await asyncio.to_thread(_store_output, output_filename, staging_path, output_format)
+
+    output_image_url = view_image_url(output_filename, device_id)
+    await asyncio.to_thread(_wait_persisted, input_filename)
+    row = _user_image_row(device_id, input_image_url, output_image_url, prompt, filters)
+    if on_row:
+        on_row(row)
+    else:
+        # supabase-py client'ı senkron; havuzlu client thread'de çağrılır
+        async with runtime.semaphore("supabase"):
+            await asyncio.to_thread(insert_user_images, device_id, [row])
+
+    return {
+        "input_image_url": input_image_url,
+        "output_image_url": output_image_url,
+        "original_output_url": output_url
+    }
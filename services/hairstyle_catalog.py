@@ -0,0 +1,94 @@
+import difflib
+import hashlib
+import json
+import re
+
+from services.metrics import log_event
+
+GENDER_ALIASES = {
+    "male": "male", "man": "male", "erkek": "male", "m": "male",
+    "female": "female", "woman": "female", "kadın": "female", "kadin": "female", "f": "female",
+}
+
+# Bulanık eşleşme için minimum benzerlik oranı
+FUZZY_CUTOFF = 0.8
+
+
+def normalize_name(name):
+    """'Half-Up, Half-Down' -> 'half up half down' gibi karşılaştırma anahtarı üretir"""
+    name = name.lower().replace("+", " ")
+    return " ".join(re.sub(r"[^\w\s]", " ", name).split())
+
+
+def normalize_gender(gender):
+    if not isinstance(gender, str):
+        return None
+    return GENDER_ALIASES.get(gender.strip().lower())
+
+
+class HairstyleCatalog:
+    """Saç modeli kataloğunu bir kez indeksler: cinsiyete göre kümeler, normalize isim ve bulanık arama"""
+
+    def __init__(self, styles_by_gender):
+        self.styles = {gender: tuple(styles) for gender, styles in styles_by_gender.items()}
+        self.version = hashlib.sha1(json.dumps(self.styles, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+        # normalize isim -> orijinal isim, cinsiyete göre
+        self._index = {
+            gender: {normalize_name(style): style for style in styles}
+            for gender, styles in self.styles.items()
+        }
+        self._all = {}
+        for index in self._index.values():
+            self._all.update(index)
+        self.style_sets = {gender: frozenset(styles) for gender, styles in self.styles.items()}
+        self._prompts = {}
+
+    def render_prompt(self, template):
+        """Katalog listesini şablona bir kez yerleştirir, sonraki çağrılarda hazır metni döner"""
+        key = (self.version, template)
+        prompt = self._prompts.get(key)
+        if prompt is None:
+            prompt = template.format(**{
+                f"{gender}_styles": ", ".join(styles) for gender, styles in self.styles.items()
+            })
+            self._prompts[key] = prompt
+        return prompt
+
+    def match(self, name, gender=None):
+        """İsmi katalogdaki karşılığına çevirir; tam, normalize ve bulanık eşleşme dener"""
+        if not isinstance(name, str):
+            return None
+
+        index = self._index.get(gender, self._all)
+        if name in self.style_sets.get(gender, ()):
+            return name
+
+        key = normalize_name(name)
+        if key in index:
+            return index[key]
+
+        close = difflib.get_close_matches(key, index.keys(), n=1, cutoff=FUZZY_CUTOFF)
+        return index[close[0]] if close else None
+
+    def repair_recommendations(self, names, gender=None, limit=5):
+        """Model önerilerini katalogla eşler; bilinmeyenleri ve tekrarları ayıklar"""
+        repaired = []
+        rejected = []
+        for name in names or []:
+            style = self.match(name, gender)
+            if style is None:
+                rejected.append(name)
+            elif style not in repaired:
+                repaired.append(style)
+        return repaired[:limit], rejected
+
+    def repair_analysis(self, result):
+        """Gemini çıktısındaki gender ve recommended_hairstyles alanlarını katalogla doğrular"""
+        gender = normalize_gender(result.get("gender"))
+        recommendations, rejected = self.repair_recommendations(result.get("recommended_hairstyles"), gender)
+
+        if rejected:
+            log_event("hairstyle_recommendations_rejected", rejected=rejected)
+
+        return dict(result, gender=gender or result.get("gender"), recommended_hairstyles=recommendations)
@@ -0,0 +1,126 @@
+import os
+from io import BytesIO
+
+from services.metrics import log_event
+
+
+# Modele gönderilen/saklanan resmin en uzun kenarı
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+# Gemini analizi için daha küçük bir boyut yeterli
+SCAN_MAX_EDGE = int(os.getenv("SCAN_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "90"))
+IMAGE_FACE_CROP = os.getenv("IMAGE_FACE_CROP", "1") == "1"
+# Yüz kutusunun kaç katı alan bırakılacağı (saç ve omuzlar kadrajda kalmalı)
+FACE_CROP_MARGIN = float(os.getenv("FACE_CROP_MARGIN", "3.0"))
+
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+FORMAT_MIMETYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+_face_detector = None
+# OpenCV opsiyonel: yoksa yüz odaklı kırpma atlanır, sadece küçültme yapılır
+_cv2_available = None
+
+
+def face_crop_available():
+    """OpenCV yüklenebiliyorsa True; yüklenemezse kırpmanın kapalı olduğu process başına bir kez log'lanır"""
+    global _cv2_available
+    if _cv2_available is None:
+        # OpenCV/numpy ağır import'lar; ısınmada ya da ilk resimde yüklenir
+        try:
+            import cv2
+            import numpy
+        except ImportError as e:
+            _cv2_available = False
+            log_event("face_crop_disabled", error=str(e))
+        else:
+            _cv2_available = True
+    return _cv2_available
+
+
+def warm_up():
+    """Pillow'u ve yüz kırpma açıksa OpenCV'yi yükler (eksikse ilk istekte değil açılışta görünür)"""
+    from PIL import Image
+
+    if IMAGE_FACE_CROP:
+        face_crop_available()
+
+
+def _detect_face(image):
+    """En büyük yüzün (x, y, w, h) kutusunu döner, bulunamazsa None"""
+    global _face_detector
+    if not face_crop_available():
+        return None
+
+    import cv2
+    import numpy as np
+
+    if _face_detector is None:
+        _face_detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+
+    gray = np.asarray(image.convert("L"))
+    faces = _face_detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(64, 64))
+    if len(faces) == 0:
+        return None
+    return max(faces, key=lambda box: box[2] * box[3])
+
+
+def _crop_around_face(image, face):
+    x, y, w, h = face
+    size = max(w, h) * FACE_CROP_MARGIN
+    cx, cy = x + w / 2, y + h / 2
+    # Saç yüzün üstünde olduğu için kadraj biraz yukarı kaydırılır
+    left = max(0, int(cx - size / 2))
+    top = max(0, int(cy - size * 0.45))
+    right = min(image.width, int(cx + size / 2))
+    bottom = min(image.height, int(cy + size * 0.55))
+    return image.crop((left, top, right, bottom))
+
+
+def load_image(image_bytes, max_edge):
+    """Resmi açar; JPEG'lerde draft ile DCT aşamasında küçültür, EXIF yönünü düzeltir"""
+    from PIL import Image, ImageOps
+
+    image = Image.open(BytesIO(image_bytes))
+
+    if image.format == "JPEG":
+        # Hedeften küçük olmayacak en büyük 1/2, 1/4, 1/8 ölçekte decode eder
+        image.draft("RGB", (max_edge, max_edge))
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return image
+
+
+def resize_image(image, max_edge):
+    from PIL import Image
+
+    if max(image.size) <= max_edge:
+        return image
+
+    # Önce tam sayı katlarıyla hızlı küçült, kalanını LANCZOS ile yap
+    factor = max(image.size) // (max_edge * 2)
+    if factor > 1:
+        image = image.reduce(factor)
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return image
+
+
+def normalize_image(image_bytes, max_edge=IMAGE_MAX_EDGE, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY, face_crop=IMAGE_FACE_CROP):
+    """Yönü düzeltilmiş, yüze göre kırpılmış, küçültülmüş ve yeniden kodlanmış (bytes, format) döner"""
+    image = load_image(image_bytes, max_edge)
+
+    if face_crop:
+        face = _detect_face(image)
+        if face is not None:
+            image = _crop_around_face(image, face)
+
+    image = resize_image(image, max_edge)
+
+    output = BytesIO()
+    if image_format == "PNG":
+        image.save(output, format="PNG", optimize=True)
+    else:
+        image.save(output, format=image_format, quality=quality, optimize=True)
+    return output.getvalue(), image_format
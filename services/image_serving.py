@@ -0,0 +1,60 @@
+import mimetypes
+import os
+
+from flask import Response, send_file
+
+# Dosya adları içerik hash'i/uuid olduğu için içerik hiç değişmez
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+# Örn. "/protected-uploads/": nginx bu internal location'dan dosyayı kendisi gönderir
+IMAGE_ACCEL_REDIRECT_PREFIX = os.getenv("IMAGE_ACCEL_REDIRECT_PREFIX")
+
+# Uzantı her zaman gerçeği söylemiyor (girdiler .png olarak kaydediliyor)
+_MAGIC_MIMETYPES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+]
+
+
+def detect_mimetype(image_path):
+    """Dosyanın ilk byte'larından, olmazsa uzantısından mimetype bulur"""
+    with open(image_path, "rb") as f:
+        head = f.read(12)
+
+    for magic, mimetype in _MAGIC_MIMETYPES:
+        if head.startswith(magic):
+            return mimetype
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+
+    return mimetypes.guess_type(str(image_path))[0] or "application/octet-stream"
+
+
+def serve_image(image_path, relative_name, accel_prefix=IMAGE_ACCEL_REDIRECT_PREFIX):
+    """ETag/Last-Modified/Range destekli, mümkünse proxy'ye devredilen resim yanıtı;
+    accel_prefix dosyanın bulunduğu dizini gösteren internal location'dır"""
+    # send_file göreli yolları app.root_path'e göre çözer, kaydettiğimiz yerle aynı olsun
+    image_path = os.path.abspath(image_path)
+    mimetype = detect_mimetype(image_path)
+
+    if accel_prefix:
+        # Byte'ları Python worker yerine reverse proxy (nginx) gönderir
+        response = Response(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = f"{accel_prefix.rstrip('/')}/{relative_name}"
+        response.headers["Cache-Control"] = f"private, max-age={IMAGE_CACHE_MAX_AGE}, immutable"
+        return response
+
+    # conditional=True: If-None-Match/If-Modified-Since için 304, Range için 206 döner;
+    # dosya wsgi.file_wrapper ile gönderilir (gunicorn'da sendfile)
+    response = send_file(
+        image_path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=True,
+        last_modified=os.path.getmtime(image_path),
+        max_age=IMAGE_CACHE_MAX_AGE
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
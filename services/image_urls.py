@@ -0,0 +1,107 @@
+import base64
+import hashlib
+import hmac
+import math
+import os
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "https://hair.serdardyck.com")
+VIEW_IMAGE_PATH = "/model/view-image/"
+
+# "kid:secret" çiftleri, virgülle ayrılmış; ilk anahtar imzalar, hepsi doğrular (rotasyon için
+# yeni anahtar başa eklenir, eskisi IMAGE_URL_TTL kadar sonra listeden çıkarılır)
+IMAGE_URL_SIGNING_KEYS = os.getenv("IMAGE_URL_SIGNING_KEYS", "")
+# İmzalı URL'lerin geçerlilik süresi
+IMAGE_URL_TTL = int(os.getenv("IMAGE_URL_TTL", str(7 * 24 * 3600)))
+# Bitiş zamanı bu aralığa yuvarlanır: aynı resmin URL'i pencere boyunca değişmez, istemci önbelleği tutar
+IMAGE_URL_EXPIRY_WINDOW = int(os.getenv("IMAGE_URL_EXPIRY_WINDOW", "3600"))
+# Geçiş dönemi: imzasız (?device_id=) eski URL'ler USER sorgusuyla kabul edilmeye devam eder
+IMAGE_URL_ALLOW_UNSIGNED = os.getenv("IMAGE_URL_ALLOW_UNSIGNED", "1") == "1"
+
+
+def _parse_keys(raw):
+    keys = []
+    for pair in raw.split(","):
+        kid, _, secret = pair.strip().partition(":")
+        if kid and secret:
+            keys.append((kid, secret.encode("utf-8")))
+    return keys
+
+
+_keys = _parse_keys(IMAGE_URL_SIGNING_KEYS)
+_keys_by_id = dict(_keys)
+
+
+def signing_enabled():
+    return bool(_keys)
+
+
+def _signature(secret, filename, device_id, expires):
+    message = f"{filename}\n{device_id}\n{expires}".encode("utf-8")
+    digest = hmac.new(secret, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def _expires_at(now=None):
+    now = time.time() if now is None else now
+    window = max(1, IMAGE_URL_EXPIRY_WINDOW)
+    return int(math.ceil((now + IMAGE_URL_TTL) / window) * window)
+
+
+def view_image_url(filename, device_id):
+    """Resmin kalıcı (imzasız) adresi; user_images'a bu yazılır"""
+    return f"{PUBLIC_BASE_URL}{VIEW_IMAGE_PATH}{filename}?{urlencode({'device_id': device_id})}"
+
+
+def signed_view_image_url(filename, device_id):
+    """Süreli, HMAC imzalı adres; anahtar tanımlı değilse imzasız adres döner"""
+    if not _keys:
+        return view_image_url(filename, device_id)
+
+    kid, secret = _keys[0]
+    expires = _expires_at()
+    query = urlencode({
+        "device_id": device_id,
+        "exp": expires,
+        "kid": kid,
+        "sig": _signature(secret, filename, device_id, expires)
+    })
+    return f"{PUBLIC_BASE_URL}{VIEW_IMAGE_PATH}{filename}?{query}"
+
+
+def derivative_url(url, width, fmt):
+    """Kendi view-image adreslerimize ?w=&fmt= ekler (imza sadece dosyayı kapsar); başka adreslerde None"""
+    if not isinstance(url, str) or not url.startswith(PUBLIC_BASE_URL + VIEW_IMAGE_PATH):
+        return None
+    return f"{url}{'&' if '?' in url else '?'}{urlencode({'w': width, 'fmt': fmt})}"
+
+
+def verify_signature(filename, device_id, expires, kid, sig):
+    """İmza geçerli ve süresi dolmamışsa True; veritabanına gidilmez"""
+    secret = _keys_by_id.get(kid)
+    if secret is None or not device_id or not sig:
+        return False
+    try:
+        if int(expires) < time.time():
+            return False
+    except (TypeError, ValueError):
+        return False
+    return hmac.compare_digest(_signature(secret, filename, device_id, expires), sig)
+
+
+def resign_url(url):
+    """Kendi view-image adreslerimizi yeniden imzalar; diğer değerler aynen döner"""
+    if not _keys or not isinstance(url, str) or not url.startswith(PUBLIC_BASE_URL + VIEW_IMAGE_PATH):
+        return url
+
+    parts = urlsplit(url)
+    device_id = parse_qs(parts.query).get("device_id", [None])[0]
+    if not device_id:
+        return url
+    return signed_view_image_url(parts.path.removeprefix(VIEW_IMAGE_PATH), device_id)
+
+
+def signature_epoch():
+    """İmzalı URL'lerin değiştiği pencere; yanıt ETag'lerine katılır"""
+    return _expires_at() if _keys else 0
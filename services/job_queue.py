@@ -0,0 +1,331 @@
+import asyncio
+import inspect
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import requests
+
+from services.generation import GenerationError
+from services.async_runtime import runtime
+from services.metrics import log_event
+
+# Aynı anda çalışacak üretim sayısı ve kuyrukta bekleyebilecek en fazla iş
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "16"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "500"))
+# Biten işlerin sonuçları bu kadar saniye tutulur
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+WEBHOOK_TIMEOUT = 10
+# Boş değilse callback_url sadece bu host'lara (virgülle ayrılmış) gönderilebilir;
+# boşsa herkese açık adrese çözülen her https host'u kabul edilir
+WEBHOOK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+# İş kayıtlarının tutulduğu yer; iş her zaman submit edilen process'te çalışır, kayıt ise
+# diğer worker'lardan da sorgulanabilsin diye ortak depoya yazılır.
+# "supabase": generation_jobs tablosu, "redis": REDIS_URL, "memory": sadece process içi (tek worker)
+JOB_STORE = os.getenv("JOB_STORE", "supabase")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+JOB_KEY_PREFIX = os.getenv("JOB_KEY_PREFIX", "hair:job")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class InvalidCallbackUrl(Exception):
+    pass
+
+
+def _resolve_public(host, port):
+    """Host'un çözüldüğü tüm adresler herkese açıksa True"""
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+    except socket.gaierror:
+        return False
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            return False
+    return bool(addresses)
+
+
+def validate_callback_url(url):
+    """Webhook adresini doğrular: https, izinli host, iç ağa (private/loopback/link-local) çözülmeyen adres"""
+    if not url:
+        return None
+    if not isinstance(url, str):
+        raise InvalidCallbackUrl("callback_url metin olmalı")
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port or 443
+    except ValueError:
+        raise InvalidCallbackUrl("callback_url geçersiz")
+    host = (parts.hostname or "").lower()
+
+    if parts.scheme != "https" or not host:
+        raise InvalidCallbackUrl("callback_url https olmalı")
+    if parts.username or parts.password:
+        raise InvalidCallbackUrl("callback_url kullanıcı bilgisi içeremez")
+    if WEBHOOK_ALLOWED_HOSTS and host not in WEBHOOK_ALLOWED_HOSTS:
+        raise InvalidCallbackUrl("callback_url host'una izin verilmiyor")
+    if not _resolve_public(host, port):
+        raise InvalidCallbackUrl("callback_url herkese açık bir adrese çözülmüyor")
+    return url
+
+
+class MemoryJobStore:
+    """Kayıtlar sadece işi çalıştıran process'te; başka worker'a gelen sorgu işi bulamaz (tek worker/geliştirme)"""
+
+    def put(self, job, ttl):
+        pass
+
+    def get(self, job_id):
+        return None
+
+
+class SupabaseJobStore:
+    """İş kayıtları generation_jobs tablosunda; süresi dolan satırlar sorguda görünmez, purge_generation_jobs() ile silinir"""
+
+    def __init__(self):
+        from supabase_client.supabase_client import get_supabase_client
+
+        self._client = get_supabase_client()
+
+    def put(self, job, ttl):
+        expires_at = datetime.fromtimestamp(time.time() + ttl, timezone.utc).isoformat()
+        self._client.table("generation_jobs").upsert({
+            "job_id": job["job_id"],
+            "device_id": job["device_id"],
+            "record": job,
+            "expires_at": expires_at,
+        }).execute()
+
+    def get(self, job_id):
+        now = datetime.now(timezone.utc).isoformat()
+        response = (
+            self._client.table("generation_jobs")
+            .select("record")
+            .eq("job_id", job_id)
+            .gt("expires_at", now)
+            .limit(1)
+            .execute()
+        )
+        return response.data[0]["record"] if response.data else None
+
+
+class RedisJobStore:
+    """İş kayıtları Redis'te JSON olarak, süre sonunda kendiliğinden silinir"""
+
+    def __init__(self, url=REDIS_URL):
+        # redis opsiyonel bağımlılık; sadece JOB_STORE=redis ise gerekir
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+
+    def put(self, job, ttl):
+        self._client.set(f"{JOB_KEY_PREFIX}:{job['job_id']}", json.dumps(job), ex=max(1, int(ttl)))
+
+    def get(self, job_id):
+        raw = self._client.get(f"{JOB_KEY_PREFIX}:{job_id}")
+        return json.loads(raw) if raw else None
+
+
+def build_store(backend=JOB_STORE):
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "supabase":
+        return SupabaseJobStore()
+    if backend == "redis":
+        return RedisJobStore()
+    raise ValueError(f"Bilinmeyen JOB_STORE: {backend}")
+
+
+class JobQueue:
+    """Uzun süren işleri sınırlı bir thread havuzunda çalıştıran submit/poll kuyruğu.
+    İşler ve bekleme olayları process içinde; kayıtlar store üzerinden tüm worker'lardan okunur."""
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, result_ttl=JOB_RESULT_TTL, store=None):
+        self._max_pending = max_pending
+        self._result_ttl = result_ttl
+        self._workers = workers
+        self._store = store if store is not None else build_store()
+        self._reset_after_fork()
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # Parent'ın thread'leri child'a geçmez, havuz ve kilit yeniden kurulur
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="job")
+        # Tek thread: aynı işin güncellemeleri depoya sırayla yazılır, event loop bloklanmaz
+        self._store_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        self._jobs = {}
+        self._done_events = {}
+        # Ortak depoya yazılan işler; diğerleri sadece bu process'te yaşar
+        self._shared = set()
+        self._lock = threading.Lock()
+
+    def submit(self, device_id, func, *args, callback_url=None, on_done=None, shared=True, **kwargs):
+        """func'ı kuyruğa ekler ve job_id döner; func'a progress callback'i verilir.
+        on_done iş bittiğinde (kuyruğa alınamazsa hemen) bir kez çağrılır.
+        shared=False ise iş, share() çağrılana kadar ortak depoya yazılmaz."""
+        with self._lock:
+            self._purge_expired()
+            pending = sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+            if pending >= self._max_pending:
+                if on_done:
+                    on_done()
+                raise QueueFullError("İş kuyruğu dolu, lütfen daha sonra tekrar deneyin")
+
+            job_id = str(uuid.uuid4())
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "device_id": device_id,
+                "status": "queued",
+                "stage": "queued",
+                "result": None,
+                "error": None,
+                "error_status": None,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+            self._done_events[job_id] = threading.Event()
+            if shared:
+                # İstek yolunda depoya gidilmez; kayıt arka planda yazılır
+                self._shared.add(job_id)
+                self._store_writer.submit(self._save, dict(self._jobs[job_id]))
+
+        if inspect.iscoroutinefunction(func):
+            # Coroutine işler thread tutmaz, runtime loop'unda çalışır
+            future = runtime.submit(self._run_async(job_id, callback_url, on_done, func, args, kwargs))
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        else:
+            self._executor.submit(self._run, job_id, callback_url, on_done, func, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        """İşin son hali; bu process'te değilse ortak depodan okunur"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        try:
+            uuid.UUID(job_id)
+        except ValueError:
+            return None
+        return self._store.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """İş bitene ya da timeout dolana kadar bekler, işin son halini döner"""
+        with self._lock:
+            done = self._done_events.get(job_id)
+        if done:
+            done.wait(timeout)
+        return self.get(job_id)
+
+    def share(self, job_id):
+        """İşi (son haliyle) ortak depoya yazar; bundan sonraki güncellemeler de yazılır.
+        Senkron bekleme süresi dolup job_id istemciye dönerken çağrılır."""
+        with self._lock:
+            if job_id not in self._jobs or job_id in self._shared:
+                return
+            self._shared.add(job_id)
+            self._store_writer.submit(self._save, dict(self._jobs[job_id]))
+
+    def depth(self):
+        """Kuyrukta bekleyen ya da çalışan iş sayısı"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            # Kilit altında sıraya alınır: depoya yazılan hal hiçbir zaman geri gitmez
+            if job_id in self._shared:
+                self._store_writer.submit(self._save, dict(self._jobs[job_id]))
+
+    def _save(self, job):
+        # Depo hatası işi durdurmaz; sadece diğer worker'lardan yapılan sorgular eski hali görür
+        try:
+            self._store.put(job, self._result_ttl)
+        except Exception as e:
+            log_event("job_store_failed", job_id=job["job_id"], error=str(e))
+
+    def _run(self, job_id, callback_url, on_done, func, args, kwargs):
+        self._update(job_id, status="running", stage="running")
+        try:
+            result = func(*args, progress=lambda stage: self._update(job_id, stage=stage), **kwargs)
+        except Exception as e:
+            self._finish(job_id, error=e)
+        else:
+            self._finish(job_id, result=result)
+        finally:
+            if on_done:
+                on_done()
+
+        if callback_url:
+            self._notify(job_id, callback_url)
+
+    async def _run_async(self, job_id, callback_url, on_done, func, args, kwargs):
+        self._update(job_id, status="running", stage="running")
+        try:
+            result = await func(*args, progress=lambda stage: self._update(job_id, stage=stage), **kwargs)
+        except asyncio.CancelledError:
+            # Loop kapanırken iptal edilen iş "running"de kalmasın, bekleyenler uyansın
+            self._finish(job_id, error=GenerationError("İş iptal edildi, lütfen tekrar deneyin", 503))
+            raise
+        except Exception as e:
+            self._finish(job_id, error=e)
+        else:
+            self._finish(job_id, result=result)
+        finally:
+            if on_done:
+                on_done()
+
+        if callback_url:
+            await asyncio.to_thread(self._notify, job_id, callback_url)
+
+    def _finish(self, job_id, result=None, error=None):
+        if error is None:
+            self._update(job_id, status="succeeded", stage="done", result=result, finished_at=time.time())
+        elif isinstance(error, GenerationError):
+            self._update(job_id, status="failed", stage="failed", error=error.message, error_status=error.status_code, finished_at=time.time())
+        else:
+            self._update(job_id, status="failed", stage="failed", error=str(error), error_status=500, finished_at=time.time())
+
+        with self._lock:
+            done = self._done_events.pop(job_id, None)
+        if done:
+            done.set()
+
+    def _notify(self, job_id, callback_url):
+        # Webhook hatası işin sonucunu etkilemez, sadece log'lanır
+        try:
+            # DNS submit'ten sonra iç adrese çevrilmiş olabilir; gönderirken tekrar kontrol edilir
+            validate_callback_url(callback_url)
+            job = self.get(job_id)
+            job.pop("device_id", None)
+            requests.post(callback_url, json=job, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+        except Exception as e:
+            log_event("webhook_failed", job_id=job_id, error=str(e))
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] and now - job["finished_at"] > self._result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+            self._shared.discard(job_id)
+
+
+job_queue = JobQueue()
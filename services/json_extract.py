@@ -0,0 +1,83 @@
+import json
+
+
+class IncrementalJsonObject:
+    """Parça parça gelen model çıktısından üst seviye JSON nesnesinin alanlarını tamamlandıkça çıkarır.
+    Nesneden önceki/sonraki metin (```json blokları, açıklamalar) yok sayılır; bozuk tek bir alan
+    diğerlerini düşürmez."""
+
+    def __init__(self):
+        self.fields = {}
+        self.complete = False
+        self._text = ""
+        self._pos = 0
+        self._start = None
+        self._member_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk):
+        """Gelen parçayla yeni tamamlanan alanları {ad: değer} olarak döner"""
+        new_fields = {}
+        if self.complete or not chunk:
+            return new_fields
+
+        self._text += chunk
+        text = self._text
+        i = self._pos
+        while i < len(text):
+            c = text[i]
+            if self._start is None:
+                if c == "{":
+                    self._start = i
+                    self._depth = 1
+                    self._member_start = i + 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._take_member(text[self._member_start:i], new_fields)
+                    if self.fields:
+                        self.complete = True
+                        i += 1
+                        break
+                    # Açıklama metnindeki süslü parantez; asıl nesne daha ileride
+                    self._start = None
+            elif c == "," and self._depth == 1:
+                self._take_member(text[self._member_start:i], new_fields)
+                self._member_start = i + 1
+            i += 1
+        self._pos = i
+        return new_fields
+
+    def _take_member(self, member, new_fields):
+        member = member.strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads("{" + member + "}")
+        except ValueError:
+            return
+        self.fields.update(parsed)
+        new_fields.update(parsed)
+
+
+def extract_json(text):
+    """Model yanıtındaki JSON nesnesini döner; yanıt yarıda kesildiyse tamamlanmış alanlar döner.
+    Hiç alan bulunamazsa ValueError."""
+    parser = IncrementalJsonObject()
+    parser.feed(text or "")
+    if not parser.fields:
+        raise ValueError("Yanıtta JSON nesnesi bulunamadı")
+    return parser.fields
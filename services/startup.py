@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from services.metrics import log_event
+
+# Worker ayağa kalkınca ağır SDK'lar arka planda ısıtılır; bitene kadar /ready 503 döner
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"
+
+# Soğuk başlangıçta yüklenmemesi gereken paketler; raporda hangilerinin yüklendiği görünür
+HEAVY_MODULES = ("replicate", "google.genai", "PIL.Image", "cv2", "numpy", "supabase", "storage3")
+
+
+class StartupReport:
+    """Import aşamalarının süreleri ve process başına ısınma durumu"""
+
+    def __init__(self, started_at=None):
+        self.started_at = started_at or time.perf_counter()
+        self.phases = {}
+        self.import_seconds = None
+        self._reset_warmup()
+        os.register_at_fork(after_in_child=self._reset_warmup)
+
+    def _reset_warmup(self):
+        # Isınma process başınadır; preload'da master'ın durumu worker'a geçmez
+        self.warmup = {}
+        self.warmup_state = "idle"
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - start, 4)
+
+    def finish_import(self):
+        self.import_seconds = round(time.perf_counter() - self.started_at, 4)
+        log_event("startup", import_seconds=self.import_seconds, phases=self.phases, heavy_modules=loaded_heavy_modules())
+
+    def start_warmup(self, tasks):
+        """tasks: ad -> fonksiyon; arka plan thread'inde sırayla çalışır, hatalar sadece raporlanır"""
+        with self._lock:
+            if self.warmup_state != "idle":
+                return
+            self.warmup_state = "running"
+        threading.Thread(target=self._warm, args=(tasks,), name="warmup", daemon=True).start()
+
+    def _warm(self, tasks):
+        start = time.perf_counter()
+        for name, task in tasks.items():
+            task_start = time.perf_counter()
+            try:
+                task()
+                self.warmup[name] = round(time.perf_counter() - task_start, 4)
+            except Exception as e:
+                self.warmup[name] = f"error: {e}"
+        self.warmup_state = "done"
+        log_event("warmup", seconds=round(time.perf_counter() - start, 4), tasks=self.warmup)
+
+    def ready(self):
+        return not STARTUP_WARMUP or self.warmup_state == "done"
+
+    def as_dict(self):
+        return {
+            "pid": os.getpid(),
+            "import_seconds": self.import_seconds,
+            "phases": self.phases,
+            "warmup_state": self.warmup_state,
+            "warmup": dict(self.warmup),
+            "heavy_modules": loaded_heavy_modules(),
+        }
+
+
+def loaded_heavy_modules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
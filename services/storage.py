@@ -0,0 +1,395 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from supabase_client.supabase_client import get_supabase_client
+from services.image_urls import VIEW_IMAGE_PATH
+from services.metrics import log_event
+
+# "local": tek makinenin diski (eski davranış), "supabase": Supabase Storage bucket'ı + yerel disk önbelleği
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", "uploads")
+STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "uploads")
+STORAGE_CACHE_DIR = os.getenv("STORAGE_CACHE_DIR", "storage_cache")
+STORAGE_CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Dosyalar içerik hash'i/uuid ile adlandırıldığı için hiç değişmez
+STORAGE_OBJECT_CACHE_CONTROL = os.getenv("STORAGE_OBJECT_CACHE_CONTROL", str(7 * 24 * 3600))
+STORAGE_LIST_PAGE_SIZE = 1000
+# Bu kadar günden eski girdi/çıktı resimleri ve onları gösteren user_images satırları GC ile silinir.
+# Varsayılan 0: hiç silinmez, GC açıkça etkinleştirilmeli
+STORAGE_RETENTION_DAYS = float(os.getenv("STORAGE_RETENTION_DAYS", "0"))
+# Her grupta adlar user_images'ta tek sorguyla aranır; sorgu URL'i kısa kalsın
+STORAGE_GC_BATCH_SIZE = 50
+STORAGE_GC_REFERENCE_LIMIT = 1000
+# Bu süreden eski yarım dosyalar terk edilmiş sayılır (yenilerini başka bir worker yazıyor olabilir)
+STALE_TEMP_SECONDS = 3600
+
+
+def is_valid_name(name):
+    """Sadece düz dosya adları; alt dizin, gizli/geçici dosya ve '..' kabul edilmez"""
+    return bool(name) and "/" not in name and "\\" not in name and not name.startswith(".")
+
+
+def _atomic_write(path, data):
+    # Yarım yazılmış dosya görünmesin diye önce geçici dosyaya yaz
+    tmp_path = path.parent / f".{path.name}.{uuid.uuid4().hex}.tmp"
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+class LocalStorage:
+    """Dosyaları yerel dizinde tutar; local_path doğrudan dosyanın kendisidir"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, name):
+        return self.root / name
+
+    def staging_path(self, suffix=""):
+        """put_file'a verilecek geçici dosya için aynı dosya sistemindeki yol (os.replace atomik kalsın)"""
+        return self.root / f".{uuid.uuid4().hex}{suffix}.incoming"
+
+    def exists(self, name):
+        return is_valid_name(name) and self._path(name).is_file()
+
+    def touch(self, name):
+        """Tekrar kullanılan dosyanın mtime'ını yeniler (GC mtime'a bakar); dosya yoksa False"""
+        if not is_valid_name(name):
+            return False
+        try:
+            os.utime(self._path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put_bytes(self, name, data, content_type=None):
+        _atomic_write(self._path(name), data)
+
+    def put_file(self, name, source_path, content_type=None):
+        os.replace(source_path, self._path(name))
+
+    def local_path(self, name):
+        if not self.exists(name):
+            return None
+        return self._path(name)
+
+    def delete_many(self, names):
+        for name in names:
+            self._path(name).unlink(missing_ok=True)
+
+    def list_older_than(self, cutoff):
+        """cutoff (unix zamanı) öncesinde yazılmış dosya adları; yarım kalmış geçici dosyalar dahil"""
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    yield entry.name
+
+
+class SupabaseStorage:
+    """Supabase Storage (S3 uyumlu) bucket'ı; havuzlu Supabase client'ının HTTP bağlantılarını kullanır"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def _files(self):
+        return get_supabase_client().storage.from_(self.bucket)
+
+    def _file_options(self, content_type):
+        return {
+            "content-type": content_type or "application/octet-stream",
+            "cache-control": STORAGE_OBJECT_CACHE_CONTROL,
+            # Aynı içerik tekrar yüklenirse hata değil, üzerine yazılır
+            "upsert": "true"
+        }
+
+    def exists(self, name):
+        return is_valid_name(name) and self._files().exists(name)
+
+    def touch(self, name):
+        # updated_at sadece yüklemeyle değişir; kullanımdaki dosyaları GC user_images'tan bulur
+        return self.exists(name)
+
+    def put_bytes(self, name, data, content_type=None):
+        self._files().upload(name, data, self._file_options(content_type))
+
+    def put_file(self, name, source_path, content_type=None):
+        # Dosya belleğe okunmadan multipart olarak akıtılır
+        with open(source_path, "rb") as f:
+            self._files().upload(name, f, self._file_options(content_type))
+
+    def get_bytes(self, name):
+        from storage3.exceptions import StorageApiError
+
+        if not is_valid_name(name):
+            return None
+        try:
+            return self._files().download(name)
+        except StorageApiError as e:
+            if str(e.status) in ("400", "404"):
+                return None
+            raise
+
+    def delete_many(self, names):
+        names = list(names)
+        if names:
+            self._files().remove(names)
+
+    def list_older_than(self, cutoff):
+        # updated_at'e göre eskiden yeniye; cutoff'a gelince durulur
+        offset = 0
+        while True:
+            objects = self._files().list(options={
+                "limit": STORAGE_LIST_PAGE_SIZE,
+                "offset": offset,
+                "sortBy": {"column": "updated_at", "order": "asc"}
+            })
+            for obj in objects:
+                updated_at = obj.get("updated_at") or obj.get("created_at")
+                if updated_at and datetime.fromisoformat(updated_at.replace("Z", "+00:00")).timestamp() >= cutoff:
+                    return
+                yield obj["name"]
+            if len(objects) < STORAGE_LIST_PAGE_SIZE:
+                return
+            offset += len(objects)
+
+
+class DiskCache:
+    """Boyut sınırlı LRU disk önbelleği; aynı dizini paylaşan worker'lar birbirinin dosyalarını görür"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        # isim -> boyut; en az yakın zamanda kullanılan başta
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        """Yeniden başlatmada önbellek dizinini erişim zamanına göre sıralayıp indeksler"""
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if not is_valid_name(entry.name):
+                    # Önceki çalışmalardan kalan yarım dosyalar
+                    if time.time() - stat.st_mtime > STALE_TEMP_SECONDS:
+                        Path(entry.path).unlink(missing_ok=True)
+                    continue
+                files.append((max(stat.st_atime, stat.st_mtime), entry.name, stat.st_size))
+
+        with self._lock:
+            for _, name, size in sorted(files):
+                self._entries[name] = size
+                self._size += size
+            self._evict_locked()
+
+    def _remember(self, name, size):
+        with self._lock:
+            self._size += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict_locked()
+
+    def _evict_locked(self):
+        # Son eklenen dosya tek başına sınırı aşsa bile tutulur (o an servis ediliyor)
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._size -= size
+            # Diğer worker'lar da aynı dizini kullanır; silinen dosyayı ihtiyaç olunca yeniden üretirler
+            (self.directory / name).unlink(missing_ok=True)
+
+    def staging_path(self, suffix=""):
+        return self.directory / f".{uuid.uuid4().hex}{suffix}.incoming"
+
+    def contains(self, name):
+        return (self.directory / name).is_file()
+
+    def get(self, name):
+        """Önbellekteki dosyanın yolu, yoksa None; bulunan dosya en son kullanılan olur"""
+        path = self.directory / name
+        if not path.is_file():
+            return None
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                return path
+        # Dosyayı başka bir worker yazmış
+        self._remember(name, path.stat().st_size)
+        return path
+
+    def put_bytes(self, name, data):
+        path = self.directory / name
+        _atomic_write(path, data)
+        self._remember(name, len(data))
+        return path
+
+    def put_file(self, name, source_path):
+        path = self.directory / name
+        os.replace(source_path, path)
+        self._remember(name, path.stat().st_size)
+        return path
+
+    def remove(self, names):
+        with self._lock:
+            for name in names:
+                self._size -= self._entries.pop(name, 0)
+                (self.directory / name).unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+class CachedStorage:
+    """Uzak backend önünde boyut sınırlı LRU disk önbelleği; yazmalar önbelleğe de düşer (write-through)"""
+
+    def __init__(self, backend, cache_dir, max_bytes):
+        self.backend = backend
+        self.cache = DiskCache(cache_dir, max_bytes)
+
+    def staging_path(self, suffix=""):
+        return self.cache.staging_path(suffix)
+
+    def exists(self, name):
+        if not is_valid_name(name):
+            return False
+        return self.cache.contains(name) or self.backend.exists(name)
+
+    def touch(self, name):
+        if not is_valid_name(name):
+            return False
+        return self.cache.contains(name) or self.backend.touch(name)
+
+    def put_bytes(self, name, data, content_type=None):
+        self.backend.put_bytes(name, data, content_type)
+        self.cache.put_bytes(name, data)
+
+    def put_file(self, name, source_path, content_type=None):
+        self.backend.put_file(name, source_path, content_type)
+        self.cache.put_file(name, source_path)
+
+    def local_path(self, name):
+        """Önbellekteki kopyanın yolu; yoksa backend'den indirir, nesne yoksa None"""
+        if not is_valid_name(name):
+            return None
+
+        path = self.cache.get(name)
+        if path is not None:
+            return path
+
+        data = self.backend.get_bytes(name)
+        if data is None:
+            return None
+        log_event("storage_cache_fill", name=name, size=len(data))
+        return self.cache.put_bytes(name, data)
+
+    def delete_many(self, names):
+        names = list(names)
+        self.backend.delete_many(names)
+        self.cache.remove(names)
+
+    def list_older_than(self, cutoff):
+        return self.backend.list_older_than(cutoff)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+
+def build_storage(backend=STORAGE_BACKEND):
+    if backend == "local":
+        return LocalStorage(STORAGE_LOCAL_DIR)
+    if backend == "supabase":
+        return CachedStorage(SupabaseStorage(STORAGE_BUCKET), STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_BYTES)
+    raise ValueError(f"Bilinmeyen STORAGE_BACKEND: {backend}")
+
+
+storage = build_storage()
+
+
+def _reference_filter(names):
+    """user_images'ta bu adlardan birini gösteren satırlar için PostgREST or= filtresi"""
+    conditions = []
+    for name in names:
+        pattern = f'"*{VIEW_IMAGE_PATH}{name}?*"'
+        conditions += [f"user_image.like.{pattern}", f"generated_image.like.{pattern}"]
+    return ",".join(conditions)
+
+
+def _referenced_since(names, cutoff_iso):
+    """cutoff'tan sonra yazılmış satırların hâlâ kullandığı adlar (tekrar kullanılan girdi resimleri).
+    Sonuç sınıra takılırsa hepsi kullanımda sayılır; emin olunamayan dosya silinmez."""
+    rows = (get_supabase_client().table('user_images')
+            .select('user_image,generated_image')
+            .gte('created_at', cutoff_iso)
+            .or_(_reference_filter(names))
+            .limit(STORAGE_GC_REFERENCE_LIMIT)
+            .execute().data) or []
+    if len(rows) >= STORAGE_GC_REFERENCE_LIMIT:
+        return set(names)
+
+    referenced = set()
+    for row in rows:
+        for url in (row.get('user_image'), row.get('generated_image')):
+            if url:
+                referenced.add(urlsplit(url).path.rsplit("/", 1)[-1])
+    return referenced & set(names)
+
+
+def collect_garbage(retention_days=STORAGE_RETENTION_DAYS, dry_run=False):
+    """Saklama süresini aşan nesneleri ve onları gösteren user_images satırlarını toplu halde siler,
+    silinen dosya sayısını döner (cron ile çalıştırılır). Saklama süresi içinde yazılmış bir satırın
+    hâlâ kullandığı dosya eski olsa da silinmez."""
+    if retention_days <= 0:
+        return 0
+
+    # derivatives storage'ı import ediyor; döngüsel import olmasın diye burada
+    from services.derivatives import purge_derivatives
+
+    cutoff = time.time() - retention_days * 24 * 3600
+    cutoff_iso = datetime.fromtimestamp(cutoff, timezone.utc).isoformat()
+    # Liste sayfalanırken silme yapılırsa offset kayar; önce tüm adlar toplanır
+    names = list(storage.list_older_than(cutoff))
+    deleted = kept = 0
+    for start in range(0, len(names), STORAGE_GC_BATCH_SIZE):
+        batch = names[start:start + STORAGE_GC_BATCH_SIZE]
+        # Yarım kalmış geçici dosyalar satırlarda geçmez
+        referenced = _referenced_since([name for name in batch if is_valid_name(name)], cutoff_iso)
+        batch = [name for name in batch if name not in referenced]
+        kept += len(referenced)
+        if batch and not dry_run:
+            storage.delete_many(batch)
+            # Silinen resmin küçük kopyaları da sunulmaya devam etmesin
+            purge_derivatives(batch)
+            # Galeride artık açılmayan resimleri gösteren eski satırlar kalmasın
+            valid = [name for name in batch if is_valid_name(name)]
+            if valid:
+                (get_supabase_client().table('user_images')
+                 .delete()
+                 .lt('created_at', cutoff_iso)
+                 .or_(_reference_filter(valid))
+                 .execute())
+        deleted += len(batch)
+
+    log_event("storage_gc", backend=STORAGE_BACKEND, retention_days=retention_days, deleted=deleted, kept=kept, dry_run=dry_run)
+    return deleted
+
+
+if __name__ == "__main__":
+    # Örn. günlük cron: python -m services.storage --retention-days 30
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Saklama süresini aşan yüklemeleri ve çıktıları siler")
+    parser.add_argument("--retention-days", type=float, default=STORAGE_RETENTION_DAYS)
+    parser.add_argument("--dry-run", action="store_true", help="Silmeden sadece sayar")
+    args = parser.parse_args()
+    print(collect_garbage(args.retention_days, args.dry_run))
@@ -0,0 +1,22 @@
+import json
+
+from flask import Response, request, stream_with_context
+
+
+def stream_response(items, event_name):
+    """Öğeleri üretildikçe gönderir: Accept text/event-stream ise SSE, değilse satır satır JSON.
+    event_name(öğe) SSE'deki event adını verir."""
+    if request.accept_mimetypes.best_match(["application/x-ndjson", "text/event-stream"]) == "text/event-stream":
+        def encode(item):
+            return f"event: {event_name(item)}\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
+        mimetype = "text/event-stream"
+    else:
+        def encode(item):
+            return json.dumps(item, ensure_ascii=False) + "\n"
+        mimetype = "application/x-ndjson"
+
+    response = Response(stream_with_context(encode(item) for item in items), mimetype=mimetype)
+    response.headers["Cache-Control"] = "no-cache"
+    # nginx yanıtı tamponlamasın, her öğe hemen istemciye gitsin
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
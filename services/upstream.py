@@ -0,0 +1,299 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from services.deadlines import remaining
+from services.metrics import Counter, Gauge, log_event, register
+
+# Geçici sayılan HTTP durum kodları (tekrar denenir, devre kesiciye yazılır)
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+UPSTREAM_SYNC_WORKERS = int(os.getenv("UPSTREAM_SYNC_WORKERS", "64"))
+
+UPSTREAM_CALLS = register(Counter(
+    "upstream_calls_total", "Upstream çağrı denemeleri", labels=("upstream", "outcome")
+))
+
+
+class UpstreamError(Exception):
+    """Upstream'e ulaşılamadı; retry_after saniye sonra tekrar denenebilir"""
+
+    def __init__(self, upstream, message, retry_after=1):
+        super().__init__(message)
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class UpstreamTimeout(UpstreamError):
+    pass
+
+
+class UpstreamPolicy:
+    """timeout: çağrının toplam süresi, attempt_timeout: tek deneme, retries: sadece idempotent adımlarda"""
+
+    def __init__(self, timeout, attempt_timeout=None, retries=0, backoff=0.5, hedge_delay=None,
+                 failure_threshold=5, reset_timeout=30):
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout or timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+
+def _env(name, default, cast=float):
+    value = os.getenv(name)
+    return cast(value) if value else default
+
+
+UPSTREAM_POLICIES = {
+    # Tahmin oluşturmak ücretli ve idempotent değil: tekrar denenmez, sadece süre sınırı + devre kesici
+    "replicate": UpstreamPolicy(
+        timeout=_env("REPLICATE_TIMEOUT", 120),
+        failure_threshold=_env("REPLICATE_BREAKER_THRESHOLD", 5, int),
+        reset_timeout=_env("REPLICATE_BREAKER_RESET", 30)
+    ),
+    # Analiz salt okunur: tekrar denenebilir; yavaş kalan isteğin yanına ikinci bir istek (hedge) açılır
+    "gemini": UpstreamPolicy(
+        timeout=_env("GEMINI_TIMEOUT", 40),
+        attempt_timeout=_env("GEMINI_ATTEMPT_TIMEOUT", 20),
+        retries=_env("GEMINI_RETRIES", 2, int),
+        hedge_delay=_env("GEMINI_HEDGE_DELAY", 4) or None,
+        failure_threshold=_env("GEMINI_BREAKER_THRESHOLD", 5, int),
+        reset_timeout=_env("GEMINI_BREAKER_RESET", 30)
+    ),
+    # Çıktı indirmesi GET: tekrar denenebilir
+    "download": UpstreamPolicy(
+        timeout=_env("DOWNLOAD_TOTAL_TIMEOUT", 90),
+        retries=_env("DOWNLOAD_RETRIES", 2, int),
+        failure_threshold=_env("DOWNLOAD_BREAKER_THRESHOLD", 10, int),
+        reset_timeout=_env("DOWNLOAD_BREAKER_RESET", 15)
+    ),
+}
+
+_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitBreaker:
+    """Art arda geçici hatalarda açılır, reset_timeout sonra tek bir deneme isteğiyle yarı açık olur"""
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_started = None
+            # Deneme isteği iptal edilip sonuç bildirmediyse bir süre sonra yenisine izin verilir
+            if self.state == "half_open" and (self._probe_started is None or now - self._probe_started >= self.reset_timeout):
+                self._probe_started = now
+                return True
+            return False
+
+    def retry_after(self):
+        with self._lock:
+            return max(1, int(self.reset_timeout - (time.monotonic() - self._opened_at)) + 1)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                log_event("circuit_closed", upstream=self.name)
+            self.state = "closed"
+            self._failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_started = None
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                log_event("circuit_opened", upstream=self.name, failures=self._failures)
+
+
+breakers = {
+    name: CircuitBreaker(name, policy.failure_threshold, policy.reset_timeout)
+    for name, policy in UPSTREAM_POLICIES.items()
+}
+for _name, _breaker in breakers.items():
+    register(Gauge(f"upstream_circuit_state_{_name}", f"{_name} devre kesicisi (0 kapalı, 1 yarı açık, 2 açık)",
+                   lambda breaker=_breaker: _STATE_VALUES[breaker.state]))
+
+
+def is_transient(error):
+    """Zaman aşımı, bağlantı hatası ya da 429/5xx: tekrar denemeye ve devre kesiciye değer"""
+    for candidate in (error, error.__cause__):
+        if candidate is None:
+            continue
+        if isinstance(candidate, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+            return True
+        # httpx/requests paketlerini import etmeden sınıf adından tanınır
+        if any(cls.__name__ in ("TransportError", "ConnectionError", "Timeout", "TimeoutException")
+               for cls in type(candidate).__mro__):
+            return True
+        # replicate: status, google-genai: code, downloader/requests: status_code
+        for attr in ("status_code", "status", "code"):
+            value = getattr(candidate, attr, None)
+            if isinstance(value, int) and value in TRANSIENT_STATUS_CODES:
+                return True
+    return False
+
+
+def _backoff(policy, attempt):
+    return policy.backoff * (2 ** attempt) * (0.5 + random.random())
+
+
+def _admit(name, breaker):
+    if not breaker.allow():
+        UPSTREAM_CALLS.inc(name, "rejected")
+        raise CircuitOpenError(name, f"{name} şu anda yanıt vermiyor", breaker.retry_after())
+
+
+def _record_error(name, breaker, error):
+    if is_transient(error):
+        breaker.record_failure()
+        UPSTREAM_CALLS.inc(name, "transient_error")
+        return True
+    # Anlamlı bir hata yanıtı (örn. 400) upstream'in ayakta olduğunu gösterir
+    breaker.record_success()
+    UPSTREAM_CALLS.inc(name, "error")
+    return False
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=UPSTREAM_SYNC_WORKERS, thread_name_prefix="upstream")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def call(name, func, *args, idempotent=True, timeout=None, **kwargs):
+    """Senkron upstream çağrısı: süre sınırı, devre kesici ve (idempotent ise) jitter'lı tekrar deneme.
+    Senkron client'lar kesilemediği için süre dolan deneme arka planda bitip sonucu atılır."""
+    policy = UPSTREAM_POLICIES[name]
+    breaker = breakers[name]
+    if timeout is None:
+        timeout = remaining(default=policy.timeout)
+    deadline = time.monotonic() + timeout
+    retries = policy.retries if idempotent else 0
+
+    for attempt in range(retries + 1):
+        _admit(name, breaker)
+        budget = min(policy.attempt_timeout, deadline - time.monotonic())
+        if budget <= 0:
+            raise UpstreamTimeout(name, f"{name} süre sınırı doldu")
+        try:
+            result = _get_executor().submit(func, *args, **kwargs).result(timeout=budget)
+        except FuturesTimeoutError:
+            breaker.record_failure()
+            UPSTREAM_CALLS.inc(name, "timeout")
+            error = UpstreamTimeout(name, f"{name} {budget:.1f} sn içinde yanıt vermedi")
+            retryable = True
+        except Exception as e:
+            error = e
+            retryable = _record_error(name, breaker, e)
+        else:
+            breaker.record_success()
+            UPSTREAM_CALLS.inc(name, "ok")
+            return result
+
+        delay = _backoff(policy, attempt)
+        if not retryable or attempt >= retries or time.monotonic() + delay >= deadline:
+            raise error
+        UPSTREAM_CALLS.inc(name, "retry")
+        log_event("upstream_retry", upstream=name, attempt=attempt + 1, error=str(error))
+        time.sleep(delay)
+
+
+async def _hedged(name, factory, delay):
+    """İlk istek delay içinde bitmezse ikincisini açar; önce başarıyla biten kazanır"""
+    tasks = {asyncio.ensure_future(factory())}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            UPSTREAM_CALLS.inc(name, "hedge")
+            tasks.add(asyncio.ensure_future(factory()))
+
+        last_error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def call_async(name, factory, idempotent=True, timeout=None, hedge=False):
+    """call'ın asyncio sürümü; factory her denemede yeni bir coroutine üretir.
+    timeout istek thread'inde hesaplanıp verilmeli (runtime loop'unda istek bağlamı yoktur)."""
+    policy = UPSTREAM_POLICIES[name]
+    breaker = breakers[name]
+    deadline = time.monotonic() + (policy.timeout if timeout is None else timeout)
+    retries = policy.retries if idempotent else 0
+
+    for attempt in range(retries + 1):
+        _admit(name, breaker)
+        budget = min(policy.attempt_timeout, deadline - time.monotonic())
+        if budget <= 0:
+            raise UpstreamTimeout(name, f"{name} süre sınırı doldu")
+        try:
+            if hedge and idempotent and policy.hedge_delay and policy.hedge_delay < budget:
+                result = await asyncio.wait_for(_hedged(name, factory, policy.hedge_delay), budget)
+            else:
+                result = await asyncio.wait_for(factory(), budget)
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            UPSTREAM_CALLS.inc(name, "timeout")
+            error = UpstreamTimeout(name, f"{name} {budget:.1f} sn içinde yanıt vermedi")
+            retryable = True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+            retryable = _record_error(name, breaker, e)
+        else:
+            breaker.record_success()
+            UPSTREAM_CALLS.inc(name, "ok")
+            return result
+
+        delay = _backoff(policy, attempt)
+        if not retryable or attempt >= retries or time.monotonic() + delay >= deadline:
+            raise error
+        UPSTREAM_CALLS.inc(name, "retry")
+        log_event("upstream_retry", upstream=name, attempt=attempt + 1, error=str(error))
+        await asyncio.sleep(delay)
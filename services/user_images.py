@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from supabase_client.supabase_client import get_supabase_client
+from services.cache import TTLCache
+from services.image_urls import derivative_url, resign_url, signature_epoch
+from services.derivatives import THUMBNAIL_FORMAT, THUMBNAIL_WIDTH
+
+supabase = get_supabase_client()
+
+# limit verilmeyen sonraki sayfalar bu boyutta; limit ve cursor ikisi de yoksa eski istemciler için tüm liste döner
+USER_IMAGES_DEFAULT_LIMIT = 20
+USER_IMAGES_MAX_LIMIT = 100
+USER_IMAGES_CACHE_TTL = int(os.getenv("USER_IMAGES_CACHE_TTL", "30"))
+USER_IMAGES_CACHE_SIZE = int(os.getenv("USER_IMAGES_CACHE_SIZE", "2048"))
+
+# İstemciye imzalı adresi dönen kolonlar
+IMAGE_URL_FIELDS = ("user_image", "generated_image")
+
+# fields parametresiyle istenebilecek kolonlar; id ve created_at cursor için hep seçilir
+SELECTABLE_FIELDS = {
+    "id", "created_at", "device_id", "user_image", "generated_image",
+    "prompt", "gender", "haircut_style", "hair_color"
+}
+
+# device_id -> {sayfa anahtarı: sonuç}; sadece cursor'lı sayfalar tutulur. Yeni resimler hep ilk sayfaya
+# düştüğü için ilk sayfa her seferinde sorgulanır: önbellek process başına olsa da başka worker'da
+# eklenen resim hemen görünür. Aynı worker'da eklenince cihazın tüm sayfaları ayrıca silinir.
+_listing_cache = TTLCache(maxsize=USER_IMAGES_CACHE_SIZE, ttl=USER_IMAGES_CACHE_TTL)
+
+
+class InvalidListingParams(Exception):
+    pass
+
+
+def encode_cursor(row):
+    raw = json.dumps([row["created_at"], row["id"]])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """(ISO zaman damgası, id); zaman damgası yeniden yazılır, PostgREST filtresine istemcinin metni girmez"""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(created_at, str) or type(row_id) is not int:
+            raise ValueError("cursor alanları geçersiz")
+        created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).isoformat()
+    except Exception:
+        raise InvalidListingParams("Geçersiz cursor")
+    return created_at, row_id
+
+
+def parse_fields(fields):
+    if not fields:
+        return "*"
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - SELECTABLE_FIELDS
+    if unknown:
+        raise InvalidListingParams(f"Geçersiz alan(lar): {', '.join(sorted(unknown))}")
+    return ",".join(sorted(requested | {"id", "created_at"}))
+
+
+def parse_limit(limit, cursor=None):
+    """Sayfa boyutu; limit ve cursor ikisi de yoksa None (sınırsız)"""
+    if limit is None:
+        return USER_IMAGES_DEFAULT_LIMIT if cursor else None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise InvalidListingParams("limit sayı olmalı")
+    return max(1, min(limit, USER_IMAGES_MAX_LIMIT))
+
+
+def _fetch_page(device_id, columns, limit, cursor):
+    query = supabase.table('user_images').select(columns).eq("device_id", device_id)
+
+    if cursor:
+        # (created_at, id) keyset: bir önceki sayfanın son satırından eskiler
+        created_at, row_id = decode_cursor(cursor)
+        # Zaman damgası ':' ve '.' içerdiği için PostgREST'te tırnaklanır
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{row_id})')
+
+    query = query.order("created_at", desc=True).order("id", desc=True)
+    if limit is None:
+        rows = query.execute().data or []
+        next_cursor = None
+    else:
+        # Bir fazla satır çekilir: varsa sonraki sayfa mevcut demektir
+        rows = query.limit(limit + 1).execute().data or []
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        rows = rows[:limit]
+
+    # ETag: sayfanın en yeni satırı + sayfa parametreleri
+    newest = rows[0] if rows else {}
+    etag_source = json.dumps([device_id, columns, limit, cursor, newest.get("id"), newest.get("created_at"), len(rows)])
+    etag = hashlib.sha1(etag_source.encode("utf-8")).hexdigest()
+
+    return {"images": rows, "next_cursor": next_cursor, "etag": etag}
+
+
+def list_user_images(device_id, limit=None, cursor=None, fields=None):
+    """Cihazın resimlerini yeniden eskiye sayfa sayfa döner (kısa süreli önbellekli)"""
+    columns = parse_fields(fields)
+    limit = parse_limit(limit, cursor)
+    if not cursor:
+        return _signed_page(_fetch_page(device_id, columns, limit, None))
+    decode_cursor(cursor)
+
+    page_key = (columns, limit, cursor)
+    pages = _listing_cache.get(device_id)
+    if pages is not None and page_key in pages:
+        return _signed_page(pages[page_key])
+
+    page = _fetch_page(device_id, columns, limit, cursor)
+
+    if pages is None:
+        pages = {}
+        _listing_cache.set(device_id, pages)
+    pages[page_key] = page
+    return _signed_page(page)
+
+
+def _signed_page(page):
+    """Önbellekteki kalıcı adresleri o anki imza penceresine göre imzalar, küçük resim adreslerini ekler"""
+    epoch = signature_epoch()
+
+    images = []
+    for row in page["images"]:
+        row = {key: resign_url(value) if key in IMAGE_URL_FIELDS else value for key, value in row.items()}
+        # Örn. generated_image_thumbnail: ızgara tam boy resmi indirmeden çizilir
+        for field in IMAGE_URL_FIELDS:
+            if row.get(field):
+                row[f"{field}_thumbnail"] = derivative_url(row[field], THUMBNAIL_WIDTH, THUMBNAIL_FORMAT)
+        images.append(row)
+    # İmza penceresi ya da küçük resim ayarı değişince istemcinin elindeki adresler de yenilenir
+    etag_source = f"{page['etag']}:{epoch}:{THUMBNAIL_WIDTH}:{THUMBNAIL_FORMAT}"
+    return dict(page, images=images, etag=hashlib.sha1(etag_source.encode("utf-8")).hexdigest())
+
+
+def invalidate_user_images(device_id):
+    """Cihaza yeni user_images satırı eklendiğinde çağrılır"""
+    _listing_cache.delete(device_id)
@@ -0,0 +1,265 @@
+import atexit
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+
+from supabase_client.supabase_client import get_supabase_client
+from services.metrics import log_event, span
+from services.user_images import invalidate_user_images
+
+supabase = get_supabase_client()
+
+# 0: satırlar istek yolunda, tek tek yazılır (eski davranış)
+USER_IMAGES_WRITE_BEHIND = os.getenv("USER_IMAGES_WRITE_BEHIND", "1") == "1"
+# Tampon bu kadar satıra ulaşınca ya da en eski satır bu kadar beklediyse yazılır
+USER_IMAGES_FLUSH_ROWS = int(os.getenv("USER_IMAGES_FLUSH_ROWS", "50"))
+USER_IMAGES_FLUSH_INTERVAL = float(os.getenv("USER_IMAGES_FLUSH_INTERVAL", "1.0"))
+# Tek insert çağrısında gönderilecek en fazla satır
+USER_IMAGES_MAX_BATCH = int(os.getenv("USER_IMAGES_MAX_BATCH", "500"))
+USER_IMAGES_RETRY_MAX_DELAY = float(os.getenv("USER_IMAGES_RETRY_MAX_DELAY", "60"))
+# Yazılmamış satırlar burada tutulur; process çökerse başka bir worker devralır
+USER_IMAGES_SPOOL_DIR = os.getenv("USER_IMAGES_SPOOL_DIR", "spool")
+# Veritabanının kalıcı olarak reddettiği satırlar (spool dizininde) elle incelenmek üzere buraya taşınır
+USER_IMAGES_DEAD_LETTER = os.getenv("USER_IMAGES_DEAD_LETTER", "dead_letter.jsonl")
+
+# Satırın verisinden kaynaklanan Postgres hata sınıfları (22: geçersiz veri, 23: kısıt ihlali);
+# tekrar denemek sonucu değiştirmez. Diğer hatalar (ağ, zaman aşımı, yetki, şema) tüm satırları
+# aynı şekilde etkiler ve geçici sayılır.
+PERMANENT_ERROR_CLASSES = ("22", "23")
+
+
+def _insert_rows(rows):
+    with span("user_images_flush", "db_insert", rows=len(rows)):
+        supabase.table('user_images').insert(rows).execute()
+    for device_id in {row["device_id"] for row in rows}:
+        invalidate_user_images(device_id)
+
+
+def _is_permanent(error):
+    code = getattr(error, "code", None)
+    return isinstance(code, str) and code[:2] in PERMANENT_ERROR_CLASSES
+
+
+class UserImagesWriter:
+    """user_images için write-behind tampon: satırlar önce yerel spool dosyasına, sonra toplu insert ile Supabase'e"""
+
+    def __init__(self, spool_dir=USER_IMAGES_SPOOL_DIR, flush_rows=USER_IMAGES_FLUSH_ROWS, flush_interval=USER_IMAGES_FLUSH_INTERVAL):
+        self.spool_dir = Path(spool_dir)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Fork sonrası parent'ın thread'i ve spool kilidi child'a ait değildir
+        self._rows = []
+        self._oldest = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._lock_file = None
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            # Kilit dosyası process yaşadığı sürece tutulur; kilitsiz spool sahipsiz demektir
+            self._lock_file = open(self.spool_dir / f"{os.getpid()}.lock", "w")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._pid = os.getpid()
+            # Aynı pid'li, çökmüş eski bir process'in spool'u kalmış olabilir
+            self._rows = self._read_spool(self._spool_path())
+            if self._rows:
+                self._oldest = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name="user-images-writer", daemon=True)
+            self._thread.start()
+        self._adopt_orphans()
+
+    def _spool_path(self, pid=None):
+        return self.spool_dir / f"{pid or os.getpid()}.jsonl"
+
+    def _append_spool_locked(self, rows):
+        """Yeni satırları spool dosyasının sonuna ekler"""
+        with open(self._spool_path(), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact_spool_locked(self):
+        """Yazılan satırlar çıktıktan sonra spool dosyasını kalan satırlarla atomik olarak değiştirir"""
+        path = self._spool_path()
+        if not self._rows:
+            path.unlink(missing_ok=True)
+            return
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in self._rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _dead_letter(self, row, error):
+        with open(self.spool_dir / USER_IMAGES_DEAD_LETTER, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"row": row, "error": str(error), "failed_at": time.time()}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        log_event("user_images_dead_lettered", device_id=row.get("device_id"), error=str(error))
+
+    def _read_spool(self, path):
+        if not path.exists():
+            return []
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # Çökme anında yarım kalan son satır
+                    continue
+        return rows
+
+    def _adopt_orphans(self):
+        """Çöken process'lerin spool dosyalarındaki satırları bu process'in tamponuna alır"""
+        for lock_path in self.spool_dir.glob("*.lock"):
+            pid = lock_path.stem
+            if pid == str(os.getpid()):
+                continue
+            with open(lock_path, "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Sahibi hâlâ çalışıyor
+                    continue
+                spool_path = self._spool_path(pid)
+                rows = self._read_spool(spool_path)
+                if rows:
+                    self.add(rows)
+                    log_event("user_images_spool_adopted", from_pid=pid, rows=len(rows))
+                spool_path.unlink(missing_ok=True)
+                lock_path.unlink(missing_ok=True)
+
+    def add(self, rows):
+        """Satırları kalıcı spool'a yazıp tampona ekler; yazma arka planda yapılır"""
+        if not rows:
+            return
+        self._ensure_started()
+        with self._cond:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._rows.extend(rows)
+            self._append_spool_locked(rows)
+            if len(self._rows) >= self.flush_rows:
+                self._cond.notify()
+
+    def close(self):
+        """Process kapanırken son bir kez yazmayı dener"""
+        if self._pid == os.getpid():
+            self.flush(force=True)
+
+    def pending(self):
+        with self._cond:
+            return len(self._rows)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(timeout=self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log_event("user_images_writer_error", error=str(e))
+
+    def flush(self, force=False):
+        """Eşik aşıldıysa (ya da force) tampondaki satırları toplu yazar; geçici hatada backoff ile tekrar denenir,
+        kalıcı hatada batch ikiye bölünerek bozuk satır bulunur ve dead-letter dosyasına taşınır"""
+        with self._flush_lock:
+            with self._cond:
+                if not self._rows:
+                    return 0
+                due = (force
+                       or len(self._rows) >= self.flush_rows
+                       or time.monotonic() - self._oldest >= self.flush_interval)
+                if not due or (not force and time.monotonic() < self._retry_at):
+                    return 0
+                batch = self._rows[:USER_IMAGES_MAX_BATCH]
+
+            # Batch sırayla işlenir; yazılan ya da dead-letter'a taşınan satırlar hep baştan bir parçadır
+            handled = [0]
+            error = None
+            try:
+                self._insert_isolating(batch, handled)
+            except Exception as db_error:
+                error = db_error
+
+            with self._cond:
+                # Flush sırasında eklenenler tamponda kalır
+                del self._rows[:handled[0]]
+                self._oldest = time.monotonic() if self._rows else None
+                if error is None:
+                    self._failures = 0
+                    self._retry_at = 0.0
+                else:
+                    self._failures += 1
+                    delay = min(USER_IMAGES_RETRY_MAX_DELAY, self.flush_interval * (2 ** self._failures))
+                    self._retry_at = time.monotonic() + delay * (0.5 + random.random())
+                if handled[0]:
+                    self._compact_spool_locked()
+
+            if error is not None:
+                log_event("user_images_flush_failed", rows=len(batch) - handled[0], failures=self._failures, error=str(error))
+                return handled[0]
+            log_event("user_images_flushed", rows=len(batch))
+            return len(batch)
+
+    def _insert_isolating(self, rows, handled):
+        try:
+            _insert_rows(rows)
+        except Exception as db_error:
+            if not _is_permanent(db_error):
+                raise
+            if len(rows) == 1:
+                self._dead_letter(rows[0], db_error)
+            else:
+                middle = len(rows) // 2
+                self._insert_isolating(rows[:middle], handled)
+                self._insert_isolating(rows[middle:], handled)
+                return
+        handled[0] += len(rows)
+
+
+user_images_writer = UserImagesWriter()
+
+
+@atexit.register
+def _flush_on_exit():
+    # Yazılamayanlar spool'da kalır, bir sonraki process devralır
+    try:
+        user_images_writer.close()
+    except Exception as e:
+        log_event("user_images_writer_error", error=str(e))
+
+
+def insert_user_images(device_id, rows):
+    """user_images satırlarını yazar: write-behind açıksa tampona, değilse doğrudan tek insert ile"""
+    if not rows:
+        return
+    if USER_IMAGES_WRITE_BEHIND:
+        user_images_writer.add(rows)
+        return
+    try:
+        _insert_rows(rows)
+        log_event("user_image_inserted", device_id=device_id, rows=len(rows))
+    except Exception as db_error:
+        log_event("user_image_insert_failed", device_id=device_id, rows=len(rows), error=str(db_error))
+        # Hata olsa bile işlemi devam ettir, sadece log'la
@@ -0,0 +1,52 @@
+import os
+import time
+
+from supabase_client.supabase_client import get_supabase_client
+from services.cache import TTLCache
+
+supabase = get_supabase_client()
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+# Kayıtlı olmayan cihazlar daha kısa süre hatırlanır
+USER_NEGATIVE_CACHE_TTL = int(os.getenv("USER_NEGATIVE_CACHE_TTL", "30"))
+# Önbellekteki "yok" bundan eskiyse tekrar sorgulanır (kayıt başka worker'da yapılmış olabilir);
+# daha yenisi doğrudan kullanılır, kayıtsız id ile gelen istek seli her seferinde DB'ye gitmez
+USER_NEGATIVE_RECHECK_SECONDS = float(os.getenv("USER_NEGATIVE_RECHECK_SECONDS", "2"))
+
+
+class _NotFound:
+    """Bulunamayan device_id'ler için saklanan işaret; ne zaman sorgulandığını tutar"""
+
+    def __init__(self):
+        self.checked_at = time.monotonic()
+
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def get_user(device_id, fresh=False, recheck_missing=True):
+    """device_id'ye ait USER satırını döner, yoksa None; fresh=True önbelleği atlar.
+    Kayıt başka worker'da yapılmış olabilir: önbellekteki "yok" USER_NEGATIVE_RECHECK_SECONDS'tan eskiyse
+    reddetmeden önce tekrar sorgulanır (recheck_missing=False ise her zaman önbellekteki "yok" kullanılır)."""
+    if not fresh:
+        cached = _user_cache.get(device_id)
+        if isinstance(cached, _NotFound):
+            if not recheck_missing or time.monotonic() - cached.checked_at < USER_NEGATIVE_RECHECK_SECONDS:
+                return None
+        elif cached is not None:
+            return cached
+
+    user_response = supabase.table('USER').select("*").eq("device_id", device_id).execute()
+
+    if not user_response.data:
+        _user_cache.set(device_id, _NotFound(), ttl=USER_NEGATIVE_CACHE_TTL)
+        return None
+
+    user = user_response.data[0]
+    _user_cache.set(device_id, user)
+    return user
+
+
+def invalidate_user(device_id):
+    """USER satırı yazıldığında çağrılır"""
+    _user_cache.delete(device_id)
@@ -0,0 +1,215 @@
+-- Kredi işlemlerini tek round-trip'te ve atomik yapan fonksiyonlar.
+-- Her fonksiyon satırı tek bir koşullu UPDATE ile değiştirir; aynı idempotency
+-- key ile tekrar gelen istek, ilk çağrının sonucunu aynen geri alır.
+
+create table if not exists credit_operations (
+    idempotency_key text primary key,
+    device_id text not null,
+    operation text not null,
+    response jsonb not null,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists credit_operations_created_at_idx on credit_operations (created_at);
+
+
+-- Premium'a geçiş: mevcut krediler sıfırlanıp abonelik kredisi yazılır
+create or replace function activate_premium(
+    p_device_id text,
+    p_subscription_type text,
+    p_subscription_expiration text,
+    p_last_token_renewal_time text,
+    p_credits integer,
+    p_idempotency_key text default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_previous "USER"%rowtype;
+    v_user "USER"%rowtype;
+    v_response jsonb;
+begin
+    if p_idempotency_key is not null then
+        select response into v_response from credit_operations where idempotency_key = p_idempotency_key;
+        if found then
+            return v_response;
+        end if;
+    end if;
+
+    select * into v_previous from "USER" where device_id = p_device_id for update;
+
+    if not found then
+        v_response := jsonb_build_object('status', 'not_found');
+    elsif coalesce(v_previous.is_premium, false) then
+        v_response := jsonb_build_object('status', 'already_premium', 'user', to_jsonb(v_previous));
+    else
+        update "USER"
+           set subscription_expiration = p_subscription_expiration::timestamptz,
+               subscription_type = p_subscription_type,
+               is_premium = true,
+               credits = p_credits,
+               last_token_renewal_time = p_last_token_renewal_time::timestamptz
+         where device_id = p_device_id
+        returning * into v_user;
+
+        v_response := jsonb_build_object(
+            'status', 'ok',
+            'user', to_jsonb(v_user),
+            'previous_credits', coalesce(v_previous.credits, 0)
+        );
+    end if;
+
+    if p_idempotency_key is not null and v_response->>'status' = 'ok' then
+        insert into credit_operations (idempotency_key, device_id, operation, response)
+        values (p_idempotency_key, p_device_id, 'activate_premium', v_response)
+        on conflict (idempotency_key) do nothing;
+    end if;
+
+    return v_response;
+end;
+$$;
+
+
+-- Abonelik yenileme: son yenileme tarihi farklıysa (koşullu) krediler yenilenir.
+-- p_credit_mapping: {"yearly": 500, "monthly": 250, "weekly": 50}
+create or replace function renew_premium_credits(
+    p_device_id text,
+    p_latest_purchase_date text,
+    p_subscription_expiration text,
+    p_credit_mapping jsonb,
+    p_idempotency_key text default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_current "USER"%rowtype;
+    v_user "USER"%rowtype;
+    v_credits integer;
+    v_response jsonb;
+begin
+    if p_idempotency_key is not null then
+        select response into v_response from credit_operations where idempotency_key = p_idempotency_key;
+        if found then
+            return v_response;
+        end if;
+    end if;
+
+    select * into v_current from "USER" where device_id = p_device_id for update;
+
+    if not found then
+        return jsonb_build_object('status', 'not_found');
+    end if;
+
+    if not coalesce(v_current.is_premium, false) then
+        return jsonb_build_object('status', 'not_premium');
+    end if;
+
+    if v_current.last_token_renewal_time::timestamptz = p_latest_purchase_date::timestamptz then
+        return jsonb_build_object('status', 'already_renewed', 'last_renewal', v_current.last_token_renewal_time);
+    end if;
+
+    v_credits := (p_credit_mapping->>lower(v_current.subscription_type))::integer;
+    if v_credits is null then
+        return jsonb_build_object('status', 'invalid_subscription_type');
+    end if;
+
+    update "USER"
+       set credits = v_credits,
+           last_token_renewal_time = p_latest_purchase_date::timestamptz,
+           subscription_expiration = p_subscription_expiration::timestamptz,
+           is_premium = true
+     where device_id = p_device_id
+    returning * into v_user;
+
+    v_response := jsonb_build_object(
+        'status', 'ok',
+        'new_credits', v_credits,
+        'subscription_type', v_user.subscription_type
+    );
+
+    if p_idempotency_key is not null then
+        insert into credit_operations (idempotency_key, device_id, operation, response)
+        values (p_idempotency_key, p_device_id, 'renew_premium', v_response)
+        on conflict (idempotency_key) do nothing;
+    end if;
+
+    return v_response;
+end;
+$$;
+
+
+-- Üretim başına kredi düşme; yeterli kredi yoksa satır değişmez.
+create or replace function consume_credits(
+    p_device_id text,
+    p_amount integer,
+    p_idempotency_key text default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_credits integer;
+    v_response jsonb;
+begin
+    if p_idempotency_key is not null then
+        select response into v_response from credit_operations where idempotency_key = p_idempotency_key;
+        if found then
+            return v_response;
+        end if;
+    end if;
+
+    update "USER"
+       set credits = coalesce(credits, 0) - p_amount
+     where device_id = p_device_id
+       and coalesce(credits, 0) >= p_amount
+    returning credits into v_credits;
+
+    if not found then
+        if exists (select 1 from "USER" where device_id = p_device_id) then
+            return jsonb_build_object('status', 'insufficient_credits');
+        end if;
+        return jsonb_build_object('status', 'not_found');
+    end if;
+
+    v_response := jsonb_build_object('status', 'ok', 'credits', v_credits);
+
+    if p_idempotency_key is not null then
+        insert into credit_operations (idempotency_key, device_id, operation, response)
+        values (p_idempotency_key, p_device_id, 'consume_credits', v_response)
+        on conflict (idempotency_key) do nothing;
+    end if;
+
+    return v_response;
+end;
+$$;
+
+
+-- Başarısız üretim sonrası iade: consume kaydı silinir ve kredi geri eklenir.
+-- Kayıt yoksa (zaten iade edilmiş) hiçbir şey yapılmaz; aynı anahtarla tekrar
+-- gelen istek böylece yeniden ücretlendirilir.
+create or replace function refund_credits(
+    p_device_id text,
+    p_amount integer,
+    p_consume_key text
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_credits integer;
+begin
+    delete from credit_operations
+     where idempotency_key = p_consume_key
+       and device_id = p_device_id
+       and operation = 'consume_credits';
+
+    if not found then
+        return jsonb_build_object('status', 'not_charged');
+    end if;
+
+    update "USER"
+       set credits = coalesce(credits, 0) + p_amount
+     where device_id = p_device_id
+    returning credits into v_credits;
+
+    return jsonb_build_object('status', 'ok', 'credits', v_credits);
+end;
+$$;
@@ -0,0 +1,239 @@
+-- Idempotency anahtarı, "USER" değişmeden önce transaction düzeyinde kilitlenir.
+-- Önceki sürümde anahtar yazmadan sonra kaydediliyordu; aynı anahtarla eşzamanlı
+-- gelen iki çağrı kontrolü birlikte geçip krediyi iki kez değiştirebiliyordu.
+-- Artık ikinci çağrı birincinin transaction'ı bitene kadar bekler, sonra kaydedilmiş
+-- yanıtı döner.
+
+
+-- Anahtarı kilitler (transaction sonuna kadar), daha önce kaydedilmiş yanıt varsa döner
+create or replace function claim_idempotency_key(p_idempotency_key text)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_response jsonb;
+begin
+    perform pg_advisory_xact_lock(hashtext('credit_operations:' || p_idempotency_key));
+    select response into v_response from credit_operations where idempotency_key = p_idempotency_key;
+    return v_response;
+end;
+$$;
+
+
+create or replace function activate_premium(
+    p_device_id text,
+    p_subscription_type text,
+    p_subscription_expiration text,
+    p_last_token_renewal_time text,
+    p_credits integer,
+    p_idempotency_key text default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_previous "USER"%rowtype;
+    v_user "USER"%rowtype;
+    v_response jsonb;
+begin
+    if p_idempotency_key is not null then
+        v_response := claim_idempotency_key(p_idempotency_key);
+        if v_response is not null then
+            return v_response;
+        end if;
+    end if;
+
+    select * into v_previous from "USER" where device_id = p_device_id for update;
+
+    if not found then
+        v_response := jsonb_build_object('status', 'not_found');
+    elsif coalesce(v_previous.is_premium, false) then
+        v_response := jsonb_build_object('status', 'already_premium', 'user', to_jsonb(v_previous));
+    else
+        update "USER"
+           set subscription_expiration = p_subscription_expiration::timestamptz,
+               subscription_type = p_subscription_type,
+               is_premium = true,
+               credits = p_credits,
+               last_token_renewal_time = p_last_token_renewal_time::timestamptz
+         where device_id = p_device_id
+        returning * into v_user;
+
+        v_response := jsonb_build_object(
+            'status', 'ok',
+            'user', to_jsonb(v_user),
+            'previous_credits', coalesce(v_previous.credits, 0)
+        );
+    end if;
+
+    if p_idempotency_key is not null and v_response->>'status' = 'ok' then
+        insert into credit_operations (idempotency_key, device_id, operation, response)
+        values (p_idempotency_key, p_device_id, 'activate_premium', v_response);
+    end if;
+
+    return v_response;
+end;
+$$;
+
+
+create or replace function renew_premium_credits(
+    p_device_id text,
+    p_latest_purchase_date text,
+    p_subscription_expiration text,
+    p_credit_mapping jsonb,
+    p_idempotency_key text default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_current "USER"%rowtype;
+    v_user "USER"%rowtype;
+    v_credits integer;
+    v_response jsonb;
+begin
+    if p_idempotency_key is not null then
+        v_response := claim_idempotency_key(p_idempotency_key);
+        if v_response is not null then
+            return v_response;
+        end if;
+    end if;
+
+    select * into v_current from "USER" where device_id = p_device_id for update;
+
+    if not found then
+        return jsonb_build_object('status', 'not_found');
+    end if;
+
+    if not coalesce(v_current.is_premium, false) then
+        return jsonb_build_object('status', 'not_premium');
+    end if;
+
+    if v_current.last_token_renewal_time::timestamptz = p_latest_purchase_date::timestamptz then
+        return jsonb_build_object('status', 'already_renewed', 'last_renewal', v_current.last_token_renewal_time);
+    end if;
+
+    v_credits := (p_credit_mapping->>lower(v_current.subscription_type))::integer;
+    if v_credits is null then
+        return jsonb_build_object('status', 'invalid_subscription_type');
+    end if;
+
+    update "USER"
+       set credits = v_credits,
+           last_token_renewal_time = p_latest_purchase_date::timestamptz,
+           subscription_expiration = p_subscription_expiration::timestamptz,
+           is_premium = true
+     where device_id = p_device_id
+    returning * into v_user;
+
+    v_response := jsonb_build_object(
+        'status', 'ok',
+        'new_credits', v_credits,
+        'subscription_type', v_user.subscription_type
+    );
+
+    if p_idempotency_key is not null then
+        insert into credit_operations (idempotency_key, device_id, operation, response)
+        values (p_idempotency_key, p_device_id, 'renew_premium', v_response);
+    end if;
+
+    return v_response;
+end;
+$$;
+
+
+create or replace function consume_credits(
+    p_device_id text,
+    p_amount integer,
+    p_idempotency_key text default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_credits integer;
+    v_response jsonb;
+begin
+    if p_idempotency_key is not null then
+        v_response := claim_idempotency_key(p_idempotency_key);
+        if v_response is not null then
+            return v_response;
+        end if;
+    end if;
+
+    update "USER"
+       set credits = coalesce(credits, 0) - p_amount
+     where device_id = p_device_id
+       and coalesce(credits, 0) >= p_amount
+    returning credits into v_credits;
+
+    if not found then
+        if exists (select 1 from "USER" where device_id = p_device_id) then
+            return jsonb_build_object('status', 'insufficient_credits');
+        end if;
+        return jsonb_build_object('status', 'not_found');
+    end if;
+
+    v_response := jsonb_build_object('status', 'ok', 'credits', v_credits);
+
+    if p_idempotency_key is not null then
+        insert into credit_operations (idempotency_key, device_id, operation, response)
+        values (p_idempotency_key, p_device_id, 'consume_credits', v_response);
+    end if;
+
+    return v_response;
+end;
+$$;
+
+
+-- İade, aynı anahtarla eşzamanlı gelen consume ile yarışmasın diye aynı kilidi alır
+create or replace function refund_credits(
+    p_device_id text,
+    p_amount integer,
+    p_consume_key text
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_credits integer;
+begin
+    perform claim_idempotency_key(p_consume_key);
+
+    delete from credit_operations
+     where idempotency_key = p_consume_key
+       and device_id = p_device_id
+       and operation = 'consume_credits';
+
+    if not found then
+        return jsonb_build_object('status', 'not_charged');
+    end if;
+
+    update "USER"
+       set credits = coalesce(credits, 0) + p_amount
+     where device_id = p_device_id
+    returning credits into v_credits;
+
+    return jsonb_build_object('status', 'ok', 'credits', v_credits);
+end;
+$$;
+
+
+-- Saklama: istemci tekrar denemeleri ve iadeler dakikalar içinde olur; eski kayıtlar silinir
+create or replace function purge_credit_operations(p_older_than interval default interval '30 days')
+returns integer
+language plpgsql
+as $$
+declare
+    v_deleted integer;
+begin
+    delete from credit_operations where created_at < now() - p_older_than;
+    get diagnostics v_deleted = row_count;
+    return v_deleted;
+end;
+$$;
+
+-- pg_cron kuruluysa her gece çalışır; değilse purge_credit_operations() dışarıdan (cron) çağrılmalı
+do $$
+begin
+    if exists (select 1 from pg_extension where extname = 'pg_cron') then
+        perform cron.schedule('purge-credit-operations', '17 3 * * *', 'select purge_credit_operations()');
+    end if;
+end;
+$$;
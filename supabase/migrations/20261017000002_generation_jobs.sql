@@ -0,0 +1,35 @@
+-- Async üretim işlerinin kayıtları. İş, submit edildiği gunicorn worker'ında çalışır;
+-- durum sorgusu başka worker'a düşebildiği için kayıt burada ortak tutulur.
+
+create table if not exists generation_jobs (
+    job_id uuid primary key,
+    device_id text not null,
+    record jsonb not null,
+    expires_at timestamptz not null
+);
+
+create index if not exists generation_jobs_expires_at_idx on generation_jobs (expires_at);
+
+
+-- Süresi dolan kayıtlar sorgularda zaten görünmez; bu fonksiyon tabloyu küçük tutar
+create or replace function purge_generation_jobs()
+returns integer
+language plpgsql
+as $$
+declare
+    v_deleted integer;
+begin
+    delete from generation_jobs where expires_at < now();
+    get diagnostics v_deleted = row_count;
+    return v_deleted;
+end;
+$$;
+
+-- pg_cron kuruluysa saatte bir çalışır; değilse purge_generation_jobs() dışarıdan (cron) çağrılmalı
+do $$
+begin
+    if exists (select 1 from pg_extension where extname = 'pg_cron') then
+        perform cron.schedule('purge-generation-jobs', '23 * * * *', 'select purge_generation_jobs()');
+    end if;
+end;
+$$;
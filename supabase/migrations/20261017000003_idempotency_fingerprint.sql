@@ -0,0 +1,118 @@
+-- Üretim kredisi anahtarı isteğin parmak iziyle (cihaz, girdi hash'i, prompt, filtreler,
+-- çıktı formatı) birlikte saklanır. Önceki sürümde aynı anahtarla farklı bir istek
+-- gönderildiğinde kayıtlı "ok" yanıtı dönüyor, kredi düşmeden yeni üretim yapılıyordu.
+-- Artık farklı istek "conflict" alır; aynı istek tekrar geldiğinde üretim sonucu
+-- (tamamlandıysa) döner, model tekrar çalışmaz.
+
+alter table credit_operations add column if not exists fingerprint text;
+alter table credit_operations add column if not exists result jsonb;
+
+
+drop function if exists consume_credits(text, integer, text);
+
+create or replace function consume_credits(
+    p_device_id text,
+    p_amount integer,
+    p_idempotency_key text default null,
+    p_fingerprint text default null
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_credits integer;
+    v_response jsonb;
+    v_operation credit_operations%rowtype;
+begin
+    if p_idempotency_key is not null then
+        perform claim_idempotency_key(p_idempotency_key);
+        select * into v_operation from credit_operations where idempotency_key = p_idempotency_key;
+        if found then
+            if v_operation.device_id <> p_device_id
+               or v_operation.operation <> 'consume_credits'
+               or v_operation.fingerprint is distinct from p_fingerprint then
+                return jsonb_build_object('status', 'conflict');
+            end if;
+            -- Tekrar: kredi düşülmez; sonuç henüz yoksa ilk çağrı hâlâ sürüyordur
+            return v_operation.response || jsonb_build_object('replayed', true, 'result', v_operation.result);
+        end if;
+    end if;
+
+    update "USER"
+       set credits = coalesce(credits, 0) - p_amount
+     where device_id = p_device_id
+       and coalesce(credits, 0) >= p_amount
+    returning credits into v_credits;
+
+    if not found then
+        if exists (select 1 from "USER" where device_id = p_device_id) then
+            return jsonb_build_object('status', 'insufficient_credits');
+        end if;
+        return jsonb_build_object('status', 'not_found');
+    end if;
+
+    v_response := jsonb_build_object('status', 'ok', 'credits', v_credits);
+
+    if p_idempotency_key is not null then
+        insert into credit_operations (idempotency_key, device_id, operation, response, fingerprint)
+        values (p_idempotency_key, p_device_id, 'consume_credits', v_response, p_fingerprint);
+    end if;
+
+    return v_response;
+end;
+$$;
+
+
+-- Üretim bitince sonucu anahtara yazar; sonraki tekrarlar bunu döner
+create or replace function complete_credit_operation(
+    p_device_id text,
+    p_idempotency_key text,
+    p_result jsonb
+) returns jsonb
+language plpgsql
+as $$
+begin
+    update credit_operations
+       set result = p_result
+     where idempotency_key = p_idempotency_key
+       and device_id = p_device_id
+       and operation = 'consume_credits';
+
+    if not found then
+        return jsonb_build_object('status', 'not_found');
+    end if;
+    return jsonb_build_object('status', 'ok');
+end;
+$$;
+
+
+-- Sonucu yazılmış (başarılı) bir üretimin kredisi iade edilmez
+create or replace function refund_credits(
+    p_device_id text,
+    p_amount integer,
+    p_consume_key text
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_credits integer;
+begin
+    perform claim_idempotency_key(p_consume_key);
+
+    delete from credit_operations
+     where idempotency_key = p_consume_key
+       and device_id = p_device_id
+       and operation = 'consume_credits'
+       and result is null;
+
+    if not found then
+        return jsonb_build_object('status', 'not_charged');
+    end if;
+
+    update "USER"
+       set credits = coalesce(credits, 0) + p_amount
+     where device_id = p_device_id
+    returning credits into v_credits;
+
+    return jsonb_build_object('status', 'ok', 'credits', v_credits);
+end;
+$$;
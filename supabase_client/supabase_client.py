@@ -1,11 +1,135 @@
-from supabase import create_client
+import httpx
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import random
+import threading
+import time
 
+# .env app.py'de, bu modül import edilmeden önce yüklenir
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# Bağlantı havuzu ve zaman aşımı ayarları
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20"))
+SUPABASE_KEEPALIVE = int(os.getenv("SUPABASE_KEEPALIVE", "10"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "15"))
+SUPABASE_RETRIES = int(os.getenv("SUPABASE_RETRIES", "2"))
+SUPABASE_BACKOFF = float(os.getenv("SUPABASE_BACKOFF", "0.2"))
+
+# Sadece bu metodlar ve durum kodları tekrar denenir
+RETRY_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+pool_stats = {"hits": 0, "misses": 0, "retries": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        pool_stats[name] += 1
+
+
+class PooledTransport(httpx.HTTPTransport):
+    """Havuz isabetlerini sayan ve geçici hatalarda backoff ile tekrar deneyen transport"""
+
+    def handle_request(self, request):
+        attempt = 0
+        while True:
+            # Boşta bağlantı varsa istek havuzdan karşılanır
+            idle = any(conn.is_idle() for conn in self._pool.connections)
+            _count("hits" if idle else "misses")
+
+            try:
+                response = super().handle_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                # Bağlantı kurulamadıysa istek gitmemiştir, her metod için güvenli
+                if attempt >= SUPABASE_RETRIES:
+                    raise
+            else:
+                if (response.status_code not in RETRY_STATUS_CODES
+                        or request.method not in RETRY_METHODS
+                        or attempt >= SUPABASE_RETRIES):
+                    return response
+                response.close()
+
+            attempt += 1
+            _count("retries")
+            time.sleep(SUPABASE_BACKOFF * (2 ** (attempt - 1)) * (0.5 + random.random()))
+
+
+def _build_http_client():
+    return httpx.Client(
+        transport=PooledTransport(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_POOL_SIZE,
+                max_keepalive_connections=SUPABASE_KEEPALIVE,
+                keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY
+            )
+        ),
+        timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+        follow_redirects=True
+    )
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def _current_client():
+    global _client, _client_pid
+    # Fork sonrası parent'ın bağlantıları paylaşılmaz, child kendi client'ını kurar
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                # supabase paketi (postgrest, storage3, realtime...) ilk kullanımda yüklenir
+                from supabase import create_client
+                from supabase.lib.client_options import SyncClientOptions
+
+                _client = create_client(SUPABASE_URL, SUPABASE_KEY, options=SyncClientOptions(
+                    httpx_client=_build_http_client(),
+                    postgrest_client_timeout=SUPABASE_TIMEOUT
+                ))
+                _client_pid = os.getpid()
+    return _client
+
+
+class _ClientProxy:
+    """Modül seviyesinde tutulabilen, her çağrıda process'in client'ına yönlenen vekil"""
+
+    def __getattr__(self, name):
+        return getattr(_current_client(), name)
+
+
+_proxy = _ClientProxy()
+
+
 def get_supabase_client():
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    """Process başına tek, havuzlu Supabase client'ı döner (gunicorn preload ile fork-safe)"""
+    return _proxy
+
+
+def init_supabase_client():
+    """Client'ı ilk istekten önce kurar (worker ısınması için)"""
+    return _current_client()
+
+
+def get_pool_stats():
+    """Havuz isabet/ıska ve tekrar deneme sayaçları"""
+    with _stats_lock:
+        return dict(pool_stats, pool_size=SUPABASE_POOL_SIZE, keepalive=SUPABASE_KEEPALIVE)
+
+
+def _reset_after_fork():
+    global _client, _client_pid, _client_lock, _stats_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    for name in pool_stats:
+        pool_stats[name] = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
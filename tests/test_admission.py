@@ -0,0 +1,149 @@
+import time
+
+import pytest
+from flask import Flask, Response, jsonify
+
+from services import admission
+from services.admission import MemoryStore, Policy, admit, hold_admission
+
+
+def test_token_bucket_allows_burst_then_limits():
+    store = MemoryStore()
+    for _ in range(3):
+        assert store.take("k", rate=1, burst=3) == (True, 0.0)
+
+    allowed, retry_after = store.take("k", rate=1, burst=3)
+    assert not allowed
+    assert 0 < retry_after <= 1
+
+
+def test_token_bucket_refills_over_time():
+    store = MemoryStore()
+    assert store.take("k", rate=20, burst=1)[0]
+    assert not store.take("k", rate=20, burst=1)[0]
+    time.sleep(0.06)
+    assert store.take("k", rate=20, burst=1)[0]
+
+
+def test_token_bucket_cost_and_separate_keys():
+    store = MemoryStore()
+    assert store.take("a", rate=1, burst=4, cost=3)[0]
+    allowed, retry_after = store.take("a", rate=1, burst=4, cost=3)
+    assert not allowed
+    assert retry_after == pytest.approx(2, abs=0.1)
+    assert store.take("b", rate=1, burst=4, cost=3)[0]
+
+
+def test_inflight_limit_and_release():
+    store = MemoryStore()
+    assert store.acquire("k", 2)
+    assert store.acquire("k", 2)
+    assert not store.acquire("k", 2)
+    store.release("k")
+    assert store.acquire("k", 2)
+    store.release("k")
+    store.release("k")
+    assert store._inflight == {}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(admission, "store", MemoryStore())
+    return Flask(__name__)
+
+
+def test_concurrency_rejection_does_not_spend_token(app):
+    policy = Policy("test", rate_per_minute=60, burst=2, device_concurrency=1, process_concurrency=0)
+    held = []
+
+    @app.route("/job")
+    @admit(policy, device_id=lambda: "device")
+    def job():
+        held.append(hold_admission())
+        return jsonify(ok=True), 202
+
+    client = app.test_client()
+    assert client.get("/job").status_code == 202
+    # İlk iş sürerken ikinci istek eşzamanlılık sınırına takılır, token harcamaz
+    for _ in range(3):
+        assert client.get("/job").status_code == 429
+
+    held.pop()()
+    assert client.get("/job").status_code == 202
+    held.pop()()
+    assert client.get("/job").status_code == 429
+    assert policy.inflight == 0
+
+
+def test_streamed_response_holds_slot_until_closed(app):
+    policy = Policy("test", rate_per_minute=600, burst=10, device_concurrency=1, process_concurrency=1)
+
+    @app.route("/stream")
+    @admit(policy, device_id=lambda: "device")
+    def stream():
+        return Response(iter(["a", "b"]))
+
+    client = app.test_client()
+    response = client.get("/stream", buffered=False)
+    assert policy.inflight == 1
+    assert client.get("/stream").status_code == 503
+    response.close()
+    assert policy.inflight == 0
+    assert client.get("/stream").status_code == 200
+
+
+def test_view_error_releases_slot(app):
+    policy = Policy("test", rate_per_minute=600, burst=10, device_concurrency=1, process_concurrency=1)
+
+    @app.route("/boom")
+    @admit(policy, device_id=lambda: "device")
+    def boom():
+        raise RuntimeError("boom")
+
+    app.testing = False
+    assert app.test_client().get("/boom").status_code == 500
+    assert policy.inflight == 0
+    assert admission.store._inflight == {}
+
+
+def test_rotating_device_ids_are_limited_per_ip(app, monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_IP_MULTIPLIER", 2)
+    policy = Policy("test", rate_per_minute=0.001, burst=2, device_concurrency=1, process_concurrency=0)
+    device_ids = iter(f"device-{index}" for index in range(10))
+
+    @app.route("/job")
+    @admit(policy, device_id=lambda: next(device_ids))
+    def job():
+        return jsonify(ok=True)
+
+    client = app.test_client()
+    # Her istek yeni bir cihaz gibi görünse de aynı IP'nin kovası 2 * burst
+    statuses = [client.get("/job").status_code for _ in range(6)]
+    assert statuses == [200, 200, 200, 200, 429, 429]
+    # Başka IP etkilenmez
+    assert client.get("/job", environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code == 200
+
+
+def test_ip_concurrency_rejection_releases_nothing_it_did_not_take(app, monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_IP_MULTIPLIER", 1)
+    policy = Policy("test", rate_per_minute=600, burst=10, device_concurrency=1, process_concurrency=0)
+    held = []
+    device_ids = iter(["a", "b", "c"])
+
+    @app.route("/job")
+    @admit(policy, device_id=lambda: next(device_ids))
+    def job():
+        held.append(hold_admission())
+        return jsonify(ok=True), 202
+
+    client = app.test_client()
+    assert client.get("/job").status_code == 202
+    response = client.get("/job")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+    held.pop()()
+    assert admission.store._inflight == {}
+    assert client.get("/job").status_code == 202
+    held.pop()()
+    assert admission.store._inflight == {}
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from services import batch_generation
+from services.generation import GenerationError
+from services.job_queue import JobQueue, MemoryJobStore
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    """Varyantlar ayrı bir kuyrukta sahte üretimle çalışır; yazılan satırlar toplanır"""
+    queue = JobQueue(workers=4, max_pending=3, result_ttl=60, store=MemoryJobStore())
+    inserted = []
+    monkeypatch.setattr(batch_generation, "job_queue", queue)
+    monkeypatch.setattr(batch_generation, "ASYNC_UPSTREAMS", False)
+    monkeypatch.setattr(batch_generation, "BATCH_PARALLELISM", 2)
+    monkeypatch.setattr(batch_generation, "insert_user_images", lambda device_id, rows: inserted.append(list(rows)))
+    return queue, inserted
+
+
+def _variants(*prompts):
+    return batch_generation.parse_variants([{"prompt": prompt} for prompt in prompts])
+
+
+def test_variants_run_on_job_queue_with_bounded_parallelism(batch, monkeypatch):
+    queue, inserted = batch
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def fake_run(device_id, input_filename, prompt, progress=None, on_row=None, **kwargs):
+        with lock:
+            running.append(prompt)
+            peak.append(len(running))
+        if prompt == "bad":
+            with lock:
+                running.remove(prompt)
+            raise GenerationError("Yetersiz kredi", 402)
+        on_row({"prompt": prompt})
+        with lock:
+            running.remove(prompt)
+        return {"output_image_url": f"https://api.example.com/{prompt}.jpg"}
+
+    monkeypatch.setattr(batch_generation, "run_generation", fake_run)
+    events = list(batch_generation.run_batch("device-1", "a.jpg", _variants("bob", "bad", "pixie", "buzz")))
+
+    outcomes = sorted(events[:-1], key=lambda outcome: outcome["index"])
+    assert [outcome["status"] for outcome in outcomes] == ["succeeded", "failed", "succeeded", "succeeded"]
+    assert outcomes[1]["status_code"] == 402
+    assert events[-1] == {"done": True, "succeeded": 3, "failed": 1, "pending": 0}
+    assert max(peak) <= 2
+    # Satırlar tek insert'te, varyant sırasıyla yazılır
+    assert inserted == [[{"prompt": "bob"}, {"prompt": "pixie"}, {"prompt": "buzz"}]]
+    assert queue.depth() == 0
+
+
+def test_timed_out_variants_keep_running_and_are_shared(batch, monkeypatch):
+    queue, inserted = batch
+    release = threading.Event()
+
+    def fake_run(device_id, input_filename, prompt, progress=None, on_row=None, **kwargs):
+        release.wait(5)
+        on_row({"prompt": prompt})
+        return {"output_image_url": "https://api.example.com/out.jpg"}
+
+    monkeypatch.setattr(batch_generation, "run_generation", fake_run)
+    events = list(batch_generation.run_batch("device-1", "a.jpg", _variants("bob", "pixie", "buzz"), timeout=0.05))
+
+    assert [event["status"] for event in events[:-1]] == ["timeout", "timeout", "not_started"]
+    assert events[-1]["pending"] == 3
+    assert inserted == [[]]
+
+    # Arka planda biten varyantın satırı kendisi yazılır, job_id ile sorgulanabilir
+    release.set()
+    job = queue.wait(events[0]["job_id"], timeout=5)
+    queue.wait(events[1]["job_id"], timeout=5)
+    assert job["status"] == "succeeded"
+    assert [{"prompt": "bob"}] in inserted and [{"prompt": "pixie"}] in inserted
+    assert events[0]["job_id"] in queue._shared
+
+
+def test_full_job_queue_fails_variant_with_503(batch, monkeypatch):
+    queue, inserted = batch
+    release = threading.Event()
+    blockers = [queue.submit("other", lambda progress: release.wait(5)) for _ in range(3)]
+
+    monkeypatch.setattr(batch_generation, "run_generation", lambda *args, **kwargs: {})
+    events = list(batch_generation.run_batch("device-1", "a.jpg", _variants("bob")))
+    assert events[0] == {"index": 0, "status": "failed", "error": "İş kuyruğu dolu, lütfen daha sonra tekrar deneyin", "status_code": 503}
+
+    release.set()
+    for job_id in blockers:
+        queue.wait(job_id, timeout=5)
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from services.cache import TTLCache
+
+
+def test_get_set_and_default():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("b", "yok") == "yok"
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_entries_expire():
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=60)
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    # Süresi dolan kayıt okunurken silinir
+    assert len(cache) == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert len(cache) == 2
+
+
+def test_falsy_values_are_cached():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("empty", [])
+    assert "empty" in cache
+    assert cache.get("empty", "yok") == []
+
+
+def test_delete_and_clear():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.delete("a")
+    cache.delete("missing")
+    assert "a" not in cache
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_concurrent_writers_respect_maxsize():
+    cache = TTLCache(maxsize=50, ttl=60)
+
+    def writer(offset):
+        for i in range(500):
+            cache.set(offset + i, i)
+            cache.get(offset + i // 2)
+
+    threads = [threading.Thread(target=writer, args=(n * 1000,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) == 50
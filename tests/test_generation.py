@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+from services import generation
+from services.generation import set_predictor
+
+
+@pytest.fixture
+def predictor():
+    calls = []
+    yield calls
+    set_predictor(None)
+
+
+def test_sync_predictor_runs_in_thread(predictor):
+    def fake(model, model_input):
+        predictor.append((model, model_input))
+        return "https://images.example.com/out.jpg"
+
+    set_predictor(fake)
+    result = asyncio.run(generation._predict_async("owner/model", {"prompt": "bob"}))
+    assert result == "https://images.example.com/out.jpg"
+    assert predictor == [("owner/model", {"prompt": "bob"})]
+
+
+def test_async_predictor_is_awaited(predictor):
+    async def fake(model, model_input):
+        predictor.append(model)
+        return "https://images.example.com/async.jpg"
+
+    set_predictor(fake)
+    assert asyncio.run(generation._predict_async("owner/model", {})) == "https://images.example.com/async.jpg"
+    assert predictor == ["owner/model"]
+
+
+def test_reset_predictor_restores_replicate(predictor):
+    set_predictor(lambda model, model_input: None)
+    set_predictor(None)
+    assert generation._predictor is generation._replicate_predictor
+
+
+class FakeLedger:
+    """credit_operations tablosunun bellekteki karşılığı: anahtar -> (parmak izi, sonuç)"""
+
+    def __init__(self, credits=10):
+        self.credits = credits
+        self.operations = {}
+        self.refunds = []
+
+    def consume(self, device_id, idempotency_key, amount=1, fingerprint=None):
+        operation = self.operations.get(idempotency_key)
+        if operation is not None:
+            if operation["fingerprint"] != fingerprint:
+                return {"status": "conflict"}
+            return {"status": "ok", "replayed": True, "result": operation["result"]}
+        self.credits -= amount
+        self.operations[idempotency_key] = {"fingerprint": fingerprint, "result": None}
+        return {"status": "ok", "credits": self.credits}
+
+    def complete(self, device_id, idempotency_key, result):
+        self.operations[idempotency_key]["result"] = result
+
+    def refund(self, device_id, consume_key, amount=1):
+        self.refunds.append(consume_key)
+        operation = self.operations.get(consume_key)
+        if operation is not None and operation["result"] is None:
+            del self.operations[consume_key]
+            self.credits += amount
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    ledger = FakeLedger()
+    monkeypatch.setattr(generation, "GENERATION_CREDIT_COST", 1)
+    monkeypatch.setattr(generation, "consume_credits", ledger.consume)
+    monkeypatch.setattr(generation, "complete_credit_operation", ledger.complete)
+    monkeypatch.setattr(generation, "refund_credits", ledger.refund)
+    monkeypatch.setattr(generation, "_generation_cache", generation.TTLCache(maxsize=16, ttl=60))
+    return ledger
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    calls = []
+
+    def fake_generate(device_id, input_filename, prompt, output_format, filters, progress, on_row=None):
+        calls.append(prompt)
+        return {
+            "input_image_url": f"https://api.example.com/view-image/{input_filename}",
+            "output_image_url": f"https://api.example.com/view-image/out-{len(calls)}.{output_format}",
+            "original_output_url": "https://replicate.example.com/out.jpg"
+        }
+
+    monkeypatch.setattr(generation, "_generate", fake_generate)
+    return calls
+
+
+def test_one_charge_per_idempotency_key(ledger, generated):
+    first = generation.run_generation("device-1", "a.jpg", "bob", idempotency_key="key-1")
+    # Önbellek boşalsa da aynı anahtar ikinci kez kredi düşmez, model tekrar çalışmaz
+    generation._generation_cache.clear()
+    second = generation.run_generation("device-1", "a.jpg", "bob", idempotency_key="key-1")
+
+    assert ledger.credits == 9
+    assert generated == ["bob"]
+    assert second["output_image_url"] == first["output_image_url"]
+    assert first["cached"] is False and second["cached"] is True
+
+
+def test_replay_with_different_request_is_rejected(ledger, generated):
+    generation.run_generation("device-1", "a.jpg", "bob", idempotency_key="key-1")
+
+    with pytest.raises(generation.GenerationError) as error:
+        generation.run_generation("device-1", "a.jpg", "pixie", idempotency_key="key-1")
+    assert error.value.status_code == 409
+    assert generated == ["bob"]
+    assert ledger.credits == 9
+
+
+def test_replay_while_first_call_runs_is_not_regenerated(ledger, generated):
+    fingerprint = generation._fingerprint(generation._generation_key("device-1", "a.jpg", "bob", "jpg", {}))
+    ledger.consume("device-1", "key-1:consume", fingerprint=fingerprint)
+
+    with pytest.raises(generation.GenerationError) as error:
+        generation.run_generation("device-1", "a.jpg", "bob", idempotency_key="key-1")
+    assert error.value.status_code == 409
+    assert generated == []
+    # Kredi bu çağrıda düşülmediği için iade de edilmez
+    assert ledger.refunds == []
+
+
+def test_failed_generation_is_refunded(ledger, monkeypatch):
+    def failing(*args, **kwargs):
+        raise generation.GenerationError("Görsel indirilemedi")
+
+    monkeypatch.setattr(generation, "_generate", failing)
+    with pytest.raises(generation.GenerationError):
+        generation.run_generation("device-1", "a.jpg", "bob", idempotency_key="key-1")
+
+    assert ledger.credits == 10
+    assert ledger.refunds == ["key-1:consume"]
+
+
+def test_generation_cache_hit_and_miss(ledger, generated):
+    generation.run_generation("device-1", "a.jpg", "bob")
+    cached = generation.run_generation("device-1", "a.jpg", "bob")
+    other = generation.run_generation("device-1", "a.jpg", "bob", filters={"hair_color": "red"})
+
+    assert cached["cached"] is True
+    assert other["cached"] is False
+    assert generated == ["bob", "bob"]
+    assert ledger.credits == 8
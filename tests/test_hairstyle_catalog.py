@@ -0,0 +1,75 @@
+import pytest
+
+from services.hairstyle_catalog import HairstyleCatalog, normalize_gender, normalize_name
+
+STYLES = {
+    "male": ["Buzz Cut", "Crew Cut", "Pompadour", "Undercut"],
+    "female": ["Bob", "Pixie Cut", "Half-Up, Half-Down", "Undercut"],
+}
+
+
+@pytest.fixture
+def catalog():
+    return HairstyleCatalog(STYLES)
+
+
+def test_normalize_helpers():
+    assert normalize_name("Half-Up, Half-Down") == "half up half down"
+    assert normalize_name("Bob+Bangs") == "bob bangs"
+    assert normalize_gender(" Kadın ") == "female"
+    assert normalize_gender("erkek") == "male"
+    assert normalize_gender("other") is None
+    assert normalize_gender(None) is None
+
+
+def test_match_exact_normalized_and_fuzzy(catalog):
+    assert catalog.match("Bob", "female") == "Bob"
+    assert catalog.match("half up half down", "female") == "Half-Up, Half-Down"
+    assert catalog.match("Pompadore", "male") == "Pompadour"
+    assert catalog.match("Mohawk", "male") is None
+    assert catalog.match(None) is None
+
+
+def test_match_is_limited_to_gender(catalog):
+    assert catalog.match("Pixie Cut", "male") is None
+    # Cinsiyet bilinmiyorsa tüm katalogda aranır
+    assert catalog.match("Pixie Cut") == "Pixie Cut"
+
+
+def test_repair_analysis_maps_drops_and_dedupes(catalog):
+    result = catalog.repair_analysis({
+        "gender": "Woman",
+        "face_shape": "oval",
+        "recommended_hairstyles": ["bob", "Bob", "Pixie cut", "Mullet", "Buzz Cut", "half-up half-down"],
+    })
+    assert result == {
+        "gender": "female",
+        "face_shape": "oval",
+        "recommended_hairstyles": ["Bob", "Pixie Cut", "Half-Up, Half-Down"],
+    }
+
+
+def test_repair_analysis_limits_and_keeps_unknown_gender(catalog):
+    result = catalog.repair_analysis({
+        "gender": "unknown",
+        "recommended_hairstyles": ["Buzz Cut", "Crew Cut", "Pompadour", "Undercut", "Bob", "Pixie Cut"],
+    })
+    assert result["gender"] == "unknown"
+    assert result["recommended_hairstyles"] == ["Buzz Cut", "Crew Cut", "Pompadour", "Undercut", "Bob"]
+
+
+def test_repair_analysis_without_recommendations(catalog):
+    assert catalog.repair_analysis({"gender": "male"})["recommended_hairstyles"] == []
+    assert catalog.repair_analysis({"gender": "male", "recommended_hairstyles": None})["recommended_hairstyles"] == []
+
+
+def test_version_and_prompt_follow_catalog(catalog):
+    template = "Erkek: {male_styles}\nKadın: {female_styles}"
+    assert catalog.render_prompt(template) == (
+        "Erkek: Buzz Cut, Crew Cut, Pompadour, Undercut\nKadın: Bob, Pixie Cut, Half-Up, Half-Down, Undercut"
+    )
+    assert HairstyleCatalog(STYLES).version == catalog.version
+
+    changed = HairstyleCatalog(dict(STYLES, male=STYLES["male"] + ["Mohawk"]))
+    assert changed.version != catalog.version
+    assert "Mohawk" in changed.render_prompt(template)
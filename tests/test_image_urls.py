@@ -0,0 +1,98 @@
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from services import image_urls
+from services.image_urls import (
+    VIEW_IMAGE_PATH, derivative_url, resign_url, signed_view_image_url, verify_signature, view_image_url,
+)
+
+
+def use_keys(monkeypatch, raw):
+    keys = image_urls._parse_keys(raw)
+    monkeypatch.setattr(image_urls, "_keys", keys)
+    monkeypatch.setattr(image_urls, "_keys_by_id", dict(keys))
+
+
+def query(url):
+    return {key: values[0] for key, values in parse_qs(urlsplit(url).query).items()}
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    use_keys(monkeypatch, "k1:secret-one")
+
+
+def test_signed_url_verifies(keys):
+    params = query(signed_view_image_url("abc.jpg", "device-1"))
+    assert params["kid"] == "k1"
+    assert int(params["exp"]) > time.time()
+    assert verify_signature("abc.jpg", "device-1", params["exp"], params["kid"], params["sig"])
+
+
+@pytest.mark.parametrize("field, value", [
+    ("filename", "other.jpg"),
+    ("device_id", "device-2"),
+    ("exp", None),
+    ("kid", "unknown"),
+    ("sig", "AAAA"),
+])
+def test_tampered_url_is_rejected(keys, field, value):
+    params = dict(query(signed_view_image_url("abc.jpg", "device-1")), filename="abc.jpg", device_id="device-1")
+    params[field] = str(int(params["exp"]) + 3600) if field == "exp" else value
+    assert not verify_signature(params["filename"], params["device_id"], params["exp"], params["kid"], params["sig"])
+
+
+def test_expired_url_is_rejected(keys):
+    expires = int(time.time()) - 1
+    sig = image_urls._signature(b"secret-one", "abc.jpg", "device-1", expires)
+    assert not verify_signature("abc.jpg", "device-1", expires, "k1", sig)
+
+
+def test_expiry_is_rounded_to_window(keys):
+    # Pencere içinde aynı resmin adresi değişmez (istemci önbelleği tutar)
+    assert signed_view_image_url("abc.jpg", "device-1") == signed_view_image_url("abc.jpg", "device-1")
+    assert int(query(signed_view_image_url("abc.jpg", "device-1"))["exp"]) % image_urls.IMAGE_URL_EXPIRY_WINDOW == 0
+
+
+def test_key_rotation_keeps_old_urls_valid(monkeypatch):
+    use_keys(monkeypatch, "k1:secret-one")
+    old = query(signed_view_image_url("abc.jpg", "device-1"))
+
+    # Yeni anahtar başa eklenir: yeni adresler onunla imzalanır, eskiler hâlâ doğrulanır
+    use_keys(monkeypatch, "k2:secret-two,k1:secret-one")
+    new = query(signed_view_image_url("abc.jpg", "device-1"))
+    assert new["kid"] == "k2"
+    assert verify_signature("abc.jpg", "device-1", old["exp"], old["kid"], old["sig"])
+    assert verify_signature("abc.jpg", "device-1", new["exp"], new["kid"], new["sig"])
+
+    # Eski anahtar listeden çıkınca onunla imzalananlar reddedilir
+    use_keys(monkeypatch, "k2:secret-two")
+    assert not verify_signature("abc.jpg", "device-1", old["exp"], old["kid"], old["sig"])
+
+
+def test_unsigned_url_without_keys(monkeypatch):
+    use_keys(monkeypatch, "")
+    assert signed_view_image_url("abc.jpg", "device-1") == view_image_url("abc.jpg", "device-1")
+    assert not verify_signature("abc.jpg", "device-1", str(int(time.time()) + 60), "k1", "sig")
+
+
+def test_resign_url_signs_own_urls_only(keys):
+    stored = view_image_url("abc.jpg", "device 1")
+    params = query(resign_url(stored))
+    assert params["device_id"] == "device 1"
+    assert verify_signature("abc.jpg", "device 1", params["exp"], params["kid"], params["sig"])
+
+    assert resign_url("https://example.com/x.jpg") == "https://example.com/x.jpg"
+    assert resign_url(None) is None
+
+
+def test_derivative_url_extends_signed_url(keys):
+    url = signed_view_image_url("abc.jpg", "device-1")
+    params = query(derivative_url(url, 256, "webp"))
+    assert params["w"] == "256" and params["fmt"] == "webp"
+    # İmza sadece dosyayı kapsar; boyut parametreleri doğrulamayı bozmaz
+    assert verify_signature("abc.jpg", "device-1", params["exp"], params["kid"], params["sig"])
+    assert derivative_url("https://example.com/x.jpg", 256, "webp") is None
+    assert urlsplit(url).path == VIEW_IMAGE_PATH + "abc.jpg"
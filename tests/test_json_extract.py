@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from services.json_extract import IncrementalJsonObject, extract_json
+
+ANALYSIS = {
+    "gender": "female",
+    "face_shape": "oval",
+    "face_analysis_reason": "Alın ve çene dengeli, {süslü} parantezli açıklama",
+    "recommended_hairstyles": ["Bob", "Pixie Cut"],
+}
+
+
+def test_extract_json_from_fenced_block_with_prose():
+    text = "Analiz sonucu:\n```json\n" + json.dumps(ANALYSIS, ensure_ascii=False) + "\n```\nBaşka soru?"
+    assert extract_json(text) == ANALYSIS
+
+
+def test_extract_json_skips_braces_before_object():
+    text = "Not: {} boş nesne değil. " + json.dumps(ANALYSIS)
+    assert extract_json(text) == ANALYSIS
+
+
+def test_extract_json_keeps_completed_fields_of_truncated_response():
+    text = json.dumps(ANALYSIS)
+    truncated = text[:text.index('"recommended_hairstyles"') + 30]
+    result = extract_json(truncated)
+    assert result == {key: ANALYSIS[key] for key in ("gender", "face_shape", "face_analysis_reason")}
+
+
+def test_extract_json_drops_only_the_broken_field():
+    text = '{"gender": "male", "face_shape": oval, "recommended_hairstyles": ["Buzz Cut"]}'
+    assert extract_json(text) == {"gender": "male", "recommended_hairstyles": ["Buzz Cut"]}
+
+
+def test_extract_json_handles_escaped_quotes():
+    text = '{"face_analysis_reason": "\\"kare\\" çene, \\\\ ters bölü", "gender": "male"}'
+    assert extract_json(text) == {"face_analysis_reason": '"kare" çene, \\ ters bölü', "gender": "male"}
+
+
+@pytest.mark.parametrize("text", ["", None, "JSON yok", "{}", "{bozuk"])
+def test_extract_json_raises_without_fields(text):
+    with pytest.raises(ValueError):
+        extract_json(text)
+
+
+def test_incremental_parser_reports_fields_as_they_complete():
+    text = json.dumps(ANALYSIS, ensure_ascii=False)
+    parser = IncrementalJsonObject()
+    seen = []
+    # Parçalar alanların ve escape dizilerinin ortasından bölünür
+    for i in range(0, len(text), 7):
+        new_fields = parser.feed(text[i:i + 7])
+        seen.extend(new_fields)
+        if "gender" in seen:
+            assert parser.fields["gender"] == "female"
+
+    assert seen == list(ANALYSIS)
+    assert parser.fields == ANALYSIS
+    assert parser.complete
+
+
+def test_incremental_parser_ignores_input_after_object():
+    parser = IncrementalJsonObject()
+    parser.feed('{"gender": "male"} {"gender": "female"}')
+    assert parser.complete
+    assert parser.feed('{"face_shape": "round"}') == {}
+    assert parser.fields == {"gender": "male"}
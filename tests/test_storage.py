@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+
+from services import derivatives
+from services import storage as storage_module
+from services.storage import LocalStorage, collect_garbage
+
+
+class FakeQuery:
+    """user_images için zincirlenen PostgREST çağrılarını kaydeder"""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, method):
+        def call(*args):
+            self.calls.append((method, args))
+            return self
+        return call
+
+    def execute(self):
+        self.client.queries.append(self.calls)
+        data = self.client.rows if self.calls[0][0] == "select" else []
+        return type("Response", (), {"data": data})()
+
+
+class FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def table(self, name):
+        assert name == "user_images"
+        return FakeQuery(self)
+
+
+@pytest.fixture
+def local(tmp_path, monkeypatch):
+    storage = LocalStorage(tmp_path)
+    monkeypatch.setattr(storage_module, "storage", storage)
+    monkeypatch.setattr(derivatives, "purge_derivatives", lambda names: None)
+    return storage
+
+
+def _age(storage, name, days):
+    old = time.time() - days * 24 * 3600
+    os.utime(storage._path(name), (old, old))
+
+
+def test_touch_refreshes_mtime(local):
+    local.put_bytes("a.webp", b"x")
+    _age(local, "a.webp", 40)
+
+    assert local.touch("a.webp") is True
+    assert time.time() - local._path("a.webp").stat().st_mtime < 60
+    assert local.touch("missing.webp") is False
+    assert local.touch("../a.webp") is False
+
+
+def test_gc_is_opt_in(local):
+    local.put_bytes("a.webp", b"x")
+    _age(local, "a.webp", 400)
+    assert collect_garbage() == 0
+    assert local.exists("a.webp")
+
+
+def test_gc_keeps_referenced_files_and_deletes_stale_rows(local, monkeypatch):
+    for name in ("old.webp", "reused.webp", "new.webp"):
+        local.put_bytes(name, b"x")
+    _age(local, "old.webp", 40)
+    _age(local, "reused.webp", 40)
+    # Eski girdi yeni bir üretimde tekrar kullanılmış
+    client = FakeClient([{"user_image": "https://api.example.com/model/view-image/reused.webp?device_id=d", "generated_image": None}])
+    monkeypatch.setattr(storage_module, "get_supabase_client", lambda: client)
+
+    assert collect_garbage(retention_days=30) == 1
+    assert not local.exists("old.webp")
+    assert local.exists("reused.webp") and local.exists("new.webp")
+
+    select, delete = client.queries
+    assert [call[0] for call in select] == ["select", "gte", "or_", "limit"]
+    # Sadece silinen dosyayı gösteren, saklama süresinden eski satırlar silinir
+    assert delete[0] == ("delete", ())
+    assert delete[1][0] == "lt"
+    assert "old.webp" in delete[2][1][0] and "reused.webp" not in delete[2][1][0]
+
+
+def test_gc_keeps_everything_when_references_are_truncated(local, monkeypatch):
+    local.put_bytes("old.webp", b"x")
+    _age(local, "old.webp", 40)
+    client = FakeClient([{"user_image": None, "generated_image": None}])
+    monkeypatch.setattr(storage_module, "STORAGE_GC_REFERENCE_LIMIT", 1)
+    monkeypatch.setattr(storage_module, "get_supabase_client", lambda: client)
+
+    assert collect_garbage(retention_days=30) == 0
+    assert local.exists("old.webp")
@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import pytest
+
+from services import upstream
+from services.upstream import CircuitBreaker, CircuitOpenError, UpstreamPolicy, UpstreamTimeout
+
+
+class FlakyError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    """Testlere özel, kısa süreli "test" upstream'i"""
+    policy = UpstreamPolicy(timeout=2, attempt_timeout=0.5, retries=2, backoff=0.01, hedge_delay=0.05,
+                            failure_threshold=3, reset_timeout=0.2)
+    monkeypatch.setitem(upstream.UPSTREAM_POLICIES, "test", policy)
+    monkeypatch.setitem(upstream.breakers, "test", CircuitBreaker("test", policy.failure_threshold, policy.reset_timeout))
+    return policy
+
+
+def test_breaker_opens_after_threshold_and_probes_after_reset():
+    breaker = CircuitBreaker("b", failure_threshold=2, reset_timeout=0.1)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.12)
+    # Reset süresinden sonra tek deneme isteği geçer, ikincisi beklemede kalır
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_breaker_reopens_when_probe_fails():
+    breaker = CircuitBreaker("b", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.retry_after() >= 1
+
+
+def test_call_retries_transient_errors(policy):
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FlakyError(503)
+        return "ok"
+
+    assert upstream.call("test", flaky, timeout=2) == "ok"
+    assert len(attempts) == 3
+    assert upstream.breakers["test"].state == "closed"
+
+
+def test_call_does_not_retry_non_idempotent_or_permanent_errors(policy):
+    attempts = []
+
+    def failing(status_code):
+        attempts.append(status_code)
+        raise FlakyError(status_code)
+
+    with pytest.raises(FlakyError):
+        upstream.call("test", failing, 503, idempotent=False, timeout=2)
+    with pytest.raises(FlakyError):
+        upstream.call("test", failing, 400, timeout=2)
+    assert attempts == [503, 400]
+
+
+def test_call_times_out_slow_attempt(policy):
+    policy.retries = 0
+    start = time.monotonic()
+    with pytest.raises(UpstreamTimeout):
+        upstream.call("test", time.sleep, 2, timeout=2)
+    assert time.monotonic() - start < 1
+
+
+def test_call_rejects_while_circuit_open(policy):
+    calls = []
+
+    def down():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    policy.retries = 0
+    for _ in range(policy.failure_threshold):
+        with pytest.raises(ConnectionError):
+            upstream.call("test", down, timeout=2)
+
+    with pytest.raises(CircuitOpenError) as excinfo:
+        upstream.call("test", down, timeout=2)
+    assert len(calls) == policy.failure_threshold
+    assert excinfo.value.retry_after >= 1
+
+
+def test_hedged_returns_first_success():
+    delays = iter([1.0, 0.01])
+
+    async def request():
+        delay = next(delays)
+        await asyncio.sleep(delay)
+        return delay
+
+    start = time.monotonic()
+    assert asyncio.run(upstream._hedged("test", request, delay=0.05)) == 0.01
+    assert time.monotonic() - start < 0.5
+
+
+def test_hedged_raises_last_error_when_all_fail():
+    async def request():
+        raise FlakyError(503)
+
+    with pytest.raises(FlakyError):
+        asyncio.run(upstream._hedged("test", request, delay=0.01))
+
+
+def test_call_async_hedges_slow_request(policy):
+    started = []
+
+    async def request():
+        started.append(1)
+        # İlk istek takılır, hedge isteği hızlı döner
+        await asyncio.sleep(1.0 if len(started) == 1 else 0.01)
+        return len(started)
+
+    result = asyncio.run(upstream.call_async("test", request, timeout=2, hedge=True))
+    assert result == 2
+    assert len(started) == 2
@@ -0,0 +1,48 @@
+import base64
+import json
+
+import pytest
+
+from services.user_images import InvalidListingParams, decode_cursor, encode_cursor, parse_fields, parse_limit
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor({"created_at": "2026-10-01T12:00:00.123456+00:00", "id": 7})
+    assert decode_cursor(cursor) == ("2026-10-01T12:00:00.123456+00:00", 7)
+    assert decode_cursor(raw_cursor(["2026-10-01T12:00:00Z", 7])) == ("2026-10-01T12:00:00+00:00", 7)
+
+
+@pytest.mark.parametrize("cursor", [
+    raw_cursor(['2026-10-01T12:00:00\\', 7]),
+    raw_cursor(['x",id.gt.0', 7]),
+    raw_cursor(["2026-10-01T12:00:00Z", "7"]),
+    raw_cursor(["2026-10-01T12:00:00Z", 7.5]),
+    raw_cursor(["2026-10-01T12:00:00Z", True]),
+    raw_cursor([1759320000, 7]),
+    raw_cursor(["2026-10-01T12:00:00Z"]),
+    "bozuk!",
+])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidListingParams):
+        decode_cursor(cursor)
+
+
+def test_limit_defaults():
+    # limit ve cursor yoksa eski davranış: tüm liste
+    assert parse_limit(None) is None
+    assert parse_limit(None, cursor="c") == 20
+    assert parse_limit("500") == 100
+    assert parse_limit("0") == 1
+    with pytest.raises(InvalidListingParams):
+        parse_limit("çok")
+
+
+def test_fields_always_include_cursor_columns():
+    assert parse_fields(None) == "*"
+    assert parse_fields("prompt, generated_image") == "created_at,generated_image,id,prompt"
+    with pytest.raises(InvalidListingParams):
+        parse_fields("prompt,password")
@@ -0,0 +1,92 @@
+import json
+import os
+
+import pytest
+
+from services import user_images_writer as writer_module
+from services.user_images_writer import UserImagesWriter
+
+
+class ConstraintError(Exception):
+    code = "23502"
+
+
+class Database:
+    def __init__(self):
+        self.rows = []
+        self.down = False
+        self.calls = 0
+
+    def insert(self, rows):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("bağlantı yok")
+        if any(row.get("bad") for row in rows):
+            raise ConstraintError("null value in column")
+        self.rows.extend(rows)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = Database()
+    monkeypatch.setattr(writer_module, "_insert_rows", database.insert)
+    return database
+
+
+@pytest.fixture
+def writer(tmp_path, database):
+    # Eşikler yüksek: arka plan thread'i test sırasında flush etmez
+    return UserImagesWriter(spool_dir=tmp_path, flush_rows=1000, flush_interval=1000)
+
+
+def spool_rows(writer):
+    path = writer._spool_path()
+    if not path.exists():
+        return []
+    return [json.loads(line)["i"] for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_rows_are_appended_to_spool_and_compacted_after_flush(writer, database):
+    writer.add([{"device_id": "d", "i": 0}])
+    writer.add([{"device_id": "d", "i": 1}, {"device_id": "d", "i": 2}])
+    assert spool_rows(writer) == [0, 1, 2]
+
+    assert writer.flush(force=True) == 3
+    assert [row["i"] for row in database.rows] == [0, 1, 2]
+    assert not writer._spool_path().exists()
+    assert writer.pending() == 0
+
+
+def test_transient_error_keeps_rows_for_retry(writer, database):
+    writer.add([{"device_id": "d", "i": i} for i in range(3)])
+    database.down = True
+    assert writer.flush(force=True) == 0
+    assert writer.pending() == 3
+    assert spool_rows(writer) == [0, 1, 2]
+
+    database.down = False
+    assert writer.flush(force=True) == 3
+    assert writer.pending() == 0
+
+
+def test_rejected_rows_are_dead_lettered(writer, database, tmp_path):
+    rows = [{"device_id": "d", "i": i, "bad": i in (2, 5)} for i in range(8)]
+    writer.add(rows)
+
+    assert writer.flush(force=True) == 8
+    assert [row["i"] for row in database.rows] == [0, 1, 3, 4, 6, 7]
+    dead = [json.loads(line) for line in (tmp_path / "dead_letter.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [entry["row"]["i"] for entry in dead] == [2, 5]
+    assert "null value" in dead[0]["error"]
+    assert writer.pending() == 0
+
+
+def test_orphaned_spool_is_adopted(tmp_path, database):
+    orphan_pid = os.getpid() + 100000
+    (tmp_path / f"{orphan_pid}.lock").touch()
+    (tmp_path / f"{orphan_pid}.jsonl").write_text(json.dumps({"device_id": "d", "i": 9}) + "\n{yarım", encoding="utf-8")
+
+    writer = UserImagesWriter(spool_dir=tmp_path, flush_rows=1000, flush_interval=1000)
+    writer.add([{"device_id": "d", "i": 1}])
+    assert sorted(spool_rows(writer)) == [1, 9]
+    assert not (tmp_path / f"{orphan_pid}.jsonl").exists()
@@ -0,0 +1,67 @@
+import pytest
+
+from services import user_lookup
+from services.cache import TTLCache
+
+
+class FakeUsers:
+    """USER tablosuna giden sorguları sayar"""
+
+    def __init__(self):
+        self.rows = {}
+        self.queries = 0
+
+    def table(self, name):
+        return self
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.device_id = value
+        return self
+
+    def execute(self):
+        self.queries += 1
+        row = self.rows.get(self.device_id)
+        return type("Response", (), {"data": [row] if row else []})()
+
+
+@pytest.fixture
+def users(monkeypatch):
+    users = FakeUsers()
+    monkeypatch.setattr(user_lookup, "supabase", users)
+    monkeypatch.setattr(user_lookup, "_user_cache", TTLCache(maxsize=16, ttl=60))
+    return users
+
+
+def test_found_user_is_cached(users):
+    users.rows["device"] = {"device_id": "device", "credits": 3}
+    assert user_lookup.get_user("device")["credits"] == 3
+    assert user_lookup.get_user("device")["credits"] == 3
+    assert users.queries == 1
+
+
+def test_fresh_negative_entry_is_not_rechecked(users):
+    assert user_lookup.get_user("unknown") is None
+    # Kayıtsız id ile gelen seli DB'ye taşımaz
+    for _ in range(5):
+        assert user_lookup.get_user("unknown") is None
+    assert users.queries == 1
+
+
+def test_old_negative_entry_is_rechecked(users, monkeypatch):
+    monkeypatch.setattr(user_lookup, "USER_NEGATIVE_RECHECK_SECONDS", 0)
+    assert user_lookup.get_user("device") is None
+    # Kayıt başka worker'da yapıldı
+    users.rows["device"] = {"device_id": "device"}
+    assert user_lookup.get_user("device") == {"device_id": "device"}
+    assert users.queries == 2
+
+
+def test_recheck_missing_false_uses_negative_entry(users, monkeypatch):
+    monkeypatch.setattr(user_lookup, "USER_NEGATIVE_RECHECK_SECONDS", 0)
+    assert user_lookup.get_user("device") is None
+    users.rows["device"] = {"device_id": "device"}
+    assert user_lookup.get_user("device", recheck_missing=False) is None
+    assert users.queries == 1